@@ -0,0 +1,22 @@
+"""
+Flask JSON 提供者：请求体解析 (request.get_json) 与 jsonify 响应都使用 ragflow.codec
+"""
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+from ragflow import codec
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """使用 ragflow.codec 的 JSON 提供者，响应直接以 UTF-8 字节串写出"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return codec.dumps_str(obj, kwargs.get("default", self.default))
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return codec.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(codec.dumps(obj, self.default) + b"\n", mimetype=self.mimetype)
@@ -1,54 +1,99 @@
 # api/routes.py
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+import hmac
 import logging
+import math
 import uuid
 
 from api.shemas import StatusResponse, ErrorResponse, ChatResponse, ChatRequest  # shemas -> schemas (拼写修正)
-from services.chat_service import ChatService
+from ragflow import codec
+from ragflow.deadline import Deadline
+from services.chat_service import create_chat_service
 from services.wechat_service import WeChatService
+from services.metrics import metrics
+from services.batch_service import parse_jsonl, run_batch, ragflow_asker
+from services.admission import AdmissionController
+from services.scheduler import PriorityScheduler, parse_priority_weights, classify_message, PRIORITY_GROUP
+from services.message_stream import MessageStream
+from services.reply_deadline import create_deadline_replier
+from services.faq import create_faq_matcher
+from services.profiler import create_profiler, ProfilerBusy
+from api.webhook_filter import WebhookPrefilter, IGNORE_SELF_MESSAGE, IGNORE_NOT_MENTIONED
 
 logger = logging.getLogger(__name__)
 api_bp = Blueprint('api', __name__)
 
 chat_service = None  # 保持全局，由 before_app_request 初始化
 wechat_service = None  # 新增微信服务
+admission_controller = None  # 准入控制，保护 process_wechat_message
+message_stream = None  # PROCESSING_MODE=stream 时，消息写入 Redis Stream 由 worker 处理
+deadline_replier = None  # 回答超时时先发送提示，超过硬时限回复兜底
+faq_matcher = None  # FAQ 与关键词快速回复，命中时不调用 RagFlow
+webhook_prefilter = None  # 在解析 JSON 之前丢弃未@机器人的群聊消息和机器人自身的消息
+profiler = None  # 采样分析与内存分配跟踪，PROFILING_ENABLED 开启且设置了 ADMIN_TOKEN 时才创建
+
+_IGNORED_BODY = b'{"status":"ok","message":"Ignored."}'
 
 
 @api_bp.before_app_request
 def initialize_services():
     global chat_service
     global wechat_service  # <--- 添加这一行
+    global admission_controller
+    global message_stream
+    global deadline_replier
+    global faq_matcher
+    global webhook_prefilter
+    global profiler
     if chat_service is None:
         config = current_app.config
         logger.info(f"从 app.config 加载配置: RAGFLOW_API_KEY, RAGFLOW_API_BASE, etc.")
 
-        redis_config = {
-            'REDIS_HOST': config['REDIS_HOST'],
-            'REDIS_PORT': config['REDIS_PORT'],
-            'REDIS_DB': config['REDIS_DB'],
-            'REDIS_PASSWORD': config.get('REDIS_PASSWORD'),
-            'RAGFLOW_SESSION_EXPIRY_REDIS': config['RAGFLOW_SESSION_EXPIRY_REDIS']
-        }
-
-        chat_service = ChatService(
-            api_key=config['RAGFLOW_API_KEY'],
-            api_base=config['RAGFLOW_API_BASE'],
-            default_chat_id=config['RAGFLOW_CHAT_ID'],
-            session_expiry=config['SESSION_EXPIRY'],
-            max_tokens=config['MAX_TOKENS'],
-            fallback_reply=config['FALLBACK_REPLY'],
-            redis_config=redis_config
-        )
+        chat_service = create_chat_service(config)
         logger.info("聊天服务 (ChatService) 已使用 Redis 配置重新初始化")
 
         # 现在这次赋值会正确地修改全局变量
-        wechat_service = WeChatService(api_base=config.get('WECHAT_API_BASE', 'http://127.0.0.1:8888/wechat/httpapi'))
+        wechat_service = WeChatService(api_base=config['WECHAT_API_BASE'])
         logger.info(f"微信服务 (WeChatService) 已初始化，API基础URL: {wechat_service.api_base}")
 
+        admission_controller = AdmissionController(
+            max_in_flight=config['ADMISSION_MAX_IN_FLIGHT'],
+            max_queue=config['ADMISSION_MAX_QUEUE'],
+            max_wait=config['ADMISSION_MAX_WAIT'],
+            scheduler=PriorityScheduler(
+                weights=parse_priority_weights(config['PRIORITY_WEIGHTS']),
+                starvation_age=config['PRIORITY_STARVATION_SECONDS']
+            )
+        )
+
+        deadline_replier = create_deadline_replier(config)
+        faq_matcher = create_faq_matcher(config)
+        profiler = create_profiler(config)
+        if config.get('WEBHOOK_PREFILTER', True):
+            webhook_prefilter = WebhookPrefilter(config.get('BOT_WXID', ''))
+
+        if config['PROCESSING_MODE'] == 'stream' and chat_service.redis_health.available():
+            message_stream = MessageStream(chat_service.redis_client, config['STREAM_KEY'],
+                                           config['STREAM_GROUP'], config['STREAM_MAXLEN'])
+            message_stream.ensure_group()
+            logger.info(f"消息处理模式: stream ({config['STREAM_KEY']})，由 services.worker 消费")
+
 
 @api_bp.route('/receive', methods=['POST'])
 def receive():
     """接收微信消息并处理 (修改版)"""
+    # 可以确定丢弃的回调只计数，不解析 JSON、不记录日志
+    if webhook_prefilter is not None:
+        reason = webhook_prefilter.check(request.get_data())
+        if reason is not None:
+            metrics.incr(f"webhook_ignored_{reason}")
+            return current_app.response_class(_IGNORED_BODY, mimetype='application/json')
+
+    # 处理时限从收到请求时开始计算
+    budget = current_app.config.get('MESSAGE_DEADLINE', 0)
+    deadline = Deadline(budget) if budget > 0 else None
+    # 写入去重标记后处理失败时需要删除标记，否则框架重试投递的同一条消息会被当作重复而丢失
+    dedup_msg = None
     try:
         data = request.get_json()
         logger.info(f"收到 /receive 消息: {data}")
@@ -67,6 +112,9 @@ def receive():
         if not from_wxid:
             logger.warning("fromWxid 为空，无法处理")
             return jsonify({"status": "error", "message": "fromWxid 缺失"}), 400
+        if not isinstance(msg_content, str):
+            logger.warning(f"msg 不是字符串: {type(msg_content).__name__}")
+            return jsonify({"status": "error", "message": "msg 必须为字符串"}), 400
 
         is_group = (from_type == 2)
         msg_source = msg_data.get('msgSource', 0)  # 获取 msgSource 字段
@@ -74,7 +122,8 @@ def receive():
 
         # 检查是否是机器人自己发送的消息
         if msg_source == 1 or (is_group and final_from_wxid == bot_wxid):
-            logger.info(f"消息来自机器人自身 (msgSource: {msg_source}, finalFromWxid: {final_from_wxid})，已忽略。")
+            metrics.incr(f"webhook_ignored_{IGNORE_SELF_MESSAGE}")
+            logger.debug(f"消息来自机器人自身 (msgSource: {msg_source}, finalFromWxid: {final_from_wxid})，已忽略。")
             return jsonify({
                 "status": "ok",
                 "message": "Self-message ignored."
@@ -84,12 +133,18 @@ def receive():
         if is_group:
             # 检查是否有人@机器人，如果没有@机器人则不回复
             if bot_wxid not in at_wxid_list:
-                logger.info(f"群聊消息未@机器人，忽略。群ID: {from_wxid}, finalFromWxid: {final_from_wxid}")
+                metrics.incr(f"webhook_ignored_{IGNORE_NOT_MENTIONED}")
+                logger.debug(f"群聊消息未@机器人，忽略。群ID: {from_wxid}, finalFromWxid: {final_from_wxid}")
                 return jsonify({
                     "status": "ok",
                     "message": "Message not mentioning bot, no reply sent."
                 }), 200
 
+        # 框架在响应慢时会重试投递，重复的消息直接确认，不再调用 RagFlow
+        if chat_service.is_duplicate_message(msg_data):
+            return jsonify({"status": "ok", "message": "Duplicate message ignored."}), 200
+        dedup_msg = msg_data
+
         # 处理特殊命令
         if msg_content == "#清除记忆":
             # 对于群聊，清除的是发送命令者的会话 (final_from_wxid)
@@ -117,101 +172,116 @@ def receive():
                 processed_msg_content = parts[1].strip()
             logger.info(f"处理后的群聊消息内容: '{processed_msg_content}'")
 
-        result = chat_service.process_wechat_message(
-            question=processed_msg_content,
-            from_wxid=from_wxid,
-            final_from_wxid=final_from_wxid,
-            is_group=is_group,
-            context={"is_group": is_group, "bot_wxid": bot_wxid}
-        )
+        # 命中 FAQ 或关键词规则时直接回复，不排队、不调用 RagFlow
+        faq_rule = faq_matcher.match(processed_msg_content) if faq_matcher is not None else None
+        if faq_rule is not None:
+            logger.info(f"命中快速回复规则: {faq_rule.name}")
+            wechat_service.send_reply(from_wxid, final_from_wxid, is_group, faq_rule.reply, deadline=deadline)
+            chat_service.archive_wechat_reply(processed_msg_content, faq_rule.reply, from_wxid, final_from_wxid,
+                                              is_group)
+            return jsonify({"status": "ok", "message": "FAQ reply sent.", "faq": faq_rule.name}), 200
+
+        priority = classify_message(is_group, final_from_wxid if is_group else from_wxid, processed_msg_content,
+                                    current_app.config.get('VIP_WXIDS', ()))
+
+        # stream 模式：写入 Redis Stream 后立即返回，由独立 worker 调用 RagFlow 并回复
+        if message_stream is not None:
+            entry_id = message_stream.publish({
+                "question": processed_msg_content,
+                "from_wxid": from_wxid,
+                "final_from_wxid": final_from_wxid,
+                "is_group": int(is_group),
+                "bot_wxid": bot_wxid,
+            })
+            metrics.incr("stream_published")
+            return jsonify({"status": "ok", "message": "Queued.", "entry_id": entry_id}), 200
+
+        def send(content, deadline=None):
+            # 通过微信服务发送回复 (群聊时@发送者)
+            wechat_response = wechat_service.send_reply(from_wxid, final_from_wxid, is_group, content,
+                                                       deadline=deadline)
+            logger.info(f"微信消息发送结果: {wechat_response}")
+
+        with admission_controller.admit(priority, deadline.remaining() if deadline else None) as admitted:
+            if admitted:
+                # 回答、超时提示或兜底回复都由 deadline_replier 发送；回答受时限约束，提示与兜底不受约束
+                result = deadline_replier.run(
+                    lambda: chat_service.process_wechat_message(
+                        question=processed_msg_content,
+                        from_wxid=from_wxid,
+                        final_from_wxid=final_from_wxid,
+                        is_group=is_group,
+                        context={"is_group": is_group, "bot_wxid": bot_wxid},
+                        deadline=deadline
+                    ),
+                    lambda content: send(content, deadline),
+                    deadline=deadline,
+                    notify=send
+                )
+            else:
+                # 负载过高，立即回复繁忙提示，不再调用 RagFlow
+                config = current_app.config
+                result = {"content": config.get('BUSY_REPLY') or config['FALLBACK_REPLY'], "error": True, "shed": True}
+                send(result["content"])
+                chat_service.archive_wechat_reply(processed_msg_content, result["content"], from_wxid,
+                                                  final_from_wxid, is_group, error=True)
 
         # 检查是否是机器人自己的消息
         if result.get("ignore_self_message", False):
             logger.info("忽略机器人自己发送的消息，不再回复")
             return jsonify({"status": "ok", "message": "Self-message ignored"}), 200
 
-        # 正常的回复处理
         logger.info(f"RagFlow 回复: {result}")
 
-        # 获取回复内容
-        reply_content = result.get("content", "")
-
-        # 通过微信服务发送回复
-        global wechat_service
-        if wechat_service is not None and reply_content:
-            # 如果是群聊且有发送者ID，则构建@消息
-            if is_group and final_from_wxid:
-                # 这里可以根据需要修改@的格式
-                # 例如: reply_content = f"@{final_from_wxid} {reply_content}"
-                pass
-
-            # 发送消息
-            wechat_response = wechat_service.send_text_message(
-                to_wxid=from_wxid,
-                content=reply_content,
-                at_list=[final_from_wxid] if is_group and final_from_wxid else None
-            )
-
-            logger.info(f"微信消息发送结果: {wechat_response}")
-        else:
-            logger.warning("微信服务未初始化或回复内容为空，无法发送回复")
-
         return jsonify({
             "status": "ok",
         })
 
     except Exception as e:
         logger.error(f"处理 /receive 请求时发生严重错误: {e}", exc_info=True)
+        if dedup_msg is not None:
+            chat_service.release_message(dedup_msg)
         error_response = ErrorResponse(error="服务器内部错误，处理微信消息失败", status_code=500)
         return jsonify(error_response.__dict__), 500
 
 
-# 其他接口 (/chat, /sessions/*) 的逻辑保持不变，
-# 但要注意它们如果也和 ChatService 交互，ChatService 中的相应方法可能也需要调整会话管理方式。
-# 例如，/api/chat 如果也想用Redis，那么 ChatService.process_message 方法也需要重写。
-# 目前的修改主要集中在 /api/receive 接口的微信会话管理。
-
-# ... (保留 /api/chat, /api/sessions/<session_id>, /api/sessions, /api/health 路由)
-# 例如 /api/chat:
 @api_bp.route('/chat', methods=['POST'])
 def chat():
     """
-    通用聊天接口。
-    注意：此接口当前的会话管理方式可能与微信的Redis会话管理不同。
-    如果需要统一，ChatService 中的 process_message 方法也需要修改。
+    通用聊天接口 (网页组件等)
+    会话映射与微信相同，存储在 Redis 中，命名空间为 chat_session:
     """
     try:
-        # ... (原有 /api/chat 的请求解析和验证逻辑) ...
-        data = request.json
-        if not data:  # ...
-            # ...
-            pass
+        data = request.get_json(silent=True)
+        if not data:
+            error_response = ErrorResponse(error="请求体必须为 JSON", status_code=400)
+            return jsonify(error_response.__dict__), 400
+
         chat_request = ChatRequest(
             question=data.get('question', ''),
             session_id=data.get('session_id'),
             user_id=data.get('user_id'),
             context=data.get('context')
-        )  # ...
-        if not chat_request.question:  # ...
-            # ...
-            pass
+        )
+        if not isinstance(chat_request.question, str):
+            error_response = ErrorResponse(error="question 必须为字符串", status_code=400)
+            return jsonify(error_response.__dict__), 400
+        if not chat_request.question:
+            error_response = ErrorResponse(error="question 不能为空", status_code=400)
+            return jsonify(error_response.__dict__), 400
+        if chat_request.session_id is not None and not isinstance(chat_request.session_id, str):
+            error_response = ErrorResponse(error="session_id 必须为字符串", status_code=400)
+            return jsonify(error_response.__dict__), 400
+
         session_id = chat_request.session_id or str(uuid.uuid4())
-        logger.info(f"通用 /api/chat 接口调用，session_id: {session_id}。该会话管理可能独立于微信Redis会话。")
-
-        # 这里的 chat_service.process_message 是指 ChatService 类中为通用接口准备的方法
-        # 如果这个方法没有实现或未适配新的会话逻辑，可能会有问题
-        # result = chat_service.process_message(
-        #     question=chat_request.question,
-        #     session_id=session_id, # 这是通用接口的 session_id
-        #     user_id=chat_request.user_id or 'anonymous',
-        #     context=chat_request.context or {}
-        # )
-        # 临时返回，提示该接口的会话逻辑可能需要审阅
-        result = {
-            "content": "通用聊天接口的会话逻辑与微信接口独立，请检查 ChatService.process_message 实现。",
-            "error": True,
-            "ragflow_session_id": None
-        }
+        logger.info(f"通用 /api/chat 接口调用，session_id: {session_id}")
+
+        result = chat_service.process_message(
+            question=chat_request.question,
+            session_id=session_id,
+            user_id=chat_request.user_id,
+            context=chat_request.context
+        )
 
         chat_response = ChatResponse(
             session_id=session_id,
@@ -222,10 +292,152 @@ def chat():
         return jsonify(chat_response.__dict__)
 
     except Exception as e:
-        # ... (原有错误处理) ...
-        logger.error(f"处理聊天请求时发生错误: {e}", exc_info=True)  #
-        error_response = ErrorResponse(error="服务器内部错误", status_code=500)  #
-        return jsonify(error_response.__dict__), 500  #
+        logger.error(f"处理聊天请求时发生错误: {e}", exc_info=True)
+        error_response = ErrorResponse(error="服务器内部错误", status_code=500)
+        return jsonify(error_response.__dict__), 500
+
+
+@api_bp.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    批量问答接口
+    请求体为 JSONL，每行一个 {"id", "question", "session_id"(可选, RagFlow 会话ID)}，
+    结果按完成顺序以 JSONL 流式返回。并发数由查询参数 concurrency 指定。
+    需要 X-Admin-Token 请求头；每个问题按最低优先级计入准入控制，负载过高时该项返回繁忙提示。
+    """
+    error = _token_error()
+    if error is not None:
+        return error
+    config = current_app.config
+    try:
+        concurrency = int(request.args.get('concurrency', config['BATCH_CONCURRENCY']))
+    except ValueError:
+        error_response = ErrorResponse(error="concurrency 必须为整数", status_code=400)
+        return jsonify(error_response.__dict__), 400
+    concurrency = max(1, min(concurrency, config['BATCH_MAX_CONCURRENCY']))
 
-# ... 其他 /api/sessions 接口类似，如果它们依赖 ChatService 中的方法，
-# 而这些方法又依赖旧的 SessionManager，那么它们的功能可能会受影响，需要一并检查和适配。
+    lines = request.get_data(as_text=True).splitlines()
+    logger.info(f"批量问答接口调用，共 {len(lines)} 行，并发数: {concurrency}")
+
+    ask = ragflow_asker(chat_service.ragflow_client)
+    busy_reply = config.get('BUSY_REPLY') or config['FALLBACK_REPLY']
+
+    def admitted_ask(item):
+        # 与微信消息共用在途数与排队名额，批量问题不会挤占实时消息
+        with admission_controller.admit(PRIORITY_GROUP) as admitted:
+            if not admitted:
+                return {"content": busy_reply, "error": True, "shed": True}
+            return ask(item)
+
+    def generate():
+        for result in run_batch(admitted_ask, parse_jsonl(lines), concurrency):
+            yield codec.dumps(result) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@api_bp.route('/sessions/<session_id>', methods=['DELETE'])
+def clear_session(session_id):
+    """清除通用聊天接口的指定会话"""
+    if chat_service.clear_session(session_id):
+        return jsonify(StatusResponse(status="success", message="会话已清除").__dict__)
+    return jsonify(StatusResponse(status="failed", message="会话不存在或清除失败").__dict__), 404
+
+
+@api_bp.route('/sessions', methods=['DELETE'])
+def clear_all_sessions():
+    """清除通用聊天接口的所有会话"""
+    chat_service.clear_all_sessions()
+    return jsonify(StatusResponse(status="success", message="所有会话已清除").__dict__)
+
+
+@api_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """查看进程内指标"""
+    return jsonify(metrics.snapshot())
+
+
+def _admin_error():
+    """
+    校验管理接口的访问权限 (X-Admin-Token 请求头)
+
+    Returns:
+        未开启或校验失败时的错误响应，通过时返回 None
+    """
+    if profiler is None:
+        # 未开启时与不存在的路由一致
+        return jsonify(ErrorResponse(error="Not Found", status_code=404).__dict__), 404
+    return _token_error()
+
+
+def _token_error():
+    """
+    校验 X-Admin-Token 请求头，未设置 ADMIN_TOKEN 时一律拒绝
+
+    Returns:
+        校验失败时的错误响应，通过时返回 None
+    """
+    token = current_app.config.get('ADMIN_TOKEN', '')
+    if not token or not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode()):
+        return jsonify(ErrorResponse(error="无权访问", status_code=403).__dict__), 403
+    return None
+
+
+@api_bp.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """
+    对本 worker 采样分析 seconds 秒（默认 10），返回折叠栈文本，可直接生成火焰图
+    查询参数: seconds, interval (采样间隔，秒，默认 0.005)
+    """
+    error = _admin_error()
+    if error:
+        return error
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+    except ValueError:
+        return jsonify(ErrorResponse(error="seconds 与 interval 必须为数字", status_code=400).__dict__), 400
+    if not (math.isfinite(seconds) and math.isfinite(interval)):
+        return jsonify(ErrorResponse(error="seconds 与 interval 必须为有限的数字", status_code=400).__dict__), 400
+    try:
+        result = profiler.sampler.sample(seconds, interval)
+    except ProfilerBusy as e:
+        return jsonify(ErrorResponse(error=str(e), status_code=409).__dict__), 409
+    logger.info(f"采样分析完成: {result['samples']} 次采样, {result['seconds']}s")
+    return Response(profiler.sampler.collapse(result["stacks"]), mimetype='text/plain',
+                    headers={"X-Profile-Samples": str(result["samples"])})
+
+
+@api_bp.route('/admin/tracemalloc/start', methods=['POST'])
+def admin_tracemalloc_start():
+    """开启 tracemalloc，查询参数 frames 为记录的调用栈深度（默认 1）"""
+    error = _admin_error()
+    if error:
+        return error
+    started = profiler.allocations.start(request.args.get('frames', 1, type=int))
+    return jsonify(StatusResponse(status="success", message="已开启" if started else "已在跟踪中").__dict__)
+
+
+@api_bp.route('/admin/tracemalloc/snapshot', methods=['GET'])
+def admin_tracemalloc_snapshot():
+    """拍摄快照，返回占用最多的位置以及与上一次快照的差异；查询参数 top、key_type (lineno/filename/traceback)"""
+    error = _admin_error()
+    if error:
+        return error
+    try:
+        return jsonify(profiler.allocations.snapshot(request.args.get('top', 20, type=int),
+                                                     request.args.get('key_type', 'lineno')))
+    except ProfilerBusy as e:
+        return jsonify(ErrorResponse(error=str(e), status_code=409).__dict__), 409
+    except (RuntimeError, ValueError) as e:
+        return jsonify(ErrorResponse(error=str(e), status_code=400).__dict__), 400
+
+
+@api_bp.route('/admin/tracemalloc/stop', methods=['POST'])
+def admin_tracemalloc_stop():
+    """关闭 tracemalloc 并释放快照"""
+    error = _admin_error()
+    if error:
+        return error
+    stopped = profiler.allocations.stop()
+    return jsonify(StatusResponse(status="success", message="已关闭" if stopped else "未在跟踪").__dict__)
@@ -0,0 +1,46 @@
+"""
+/receive 回调的预过滤
+
+大部分回调是未@机器人的群聊消息或机器人自己发出的消息，完整解析 JSON、记录日志后仍会被丢弃。
+预过滤直接在原始请求体上查找 msgSource、fromType 以及机器人 wxid，不解析 JSON：
+  - msgSource 为 1：机器人自身发出的消息
+  - fromType 为 2 且请求体中根本没有出现机器人 wxid：群聊中未@机器人（atWxidList 不可能包含它，
+    finalFromWxid 也不可能是机器人）
+只做确定可以丢弃的判断，其余情况交给完整流程，完整流程中的检查保持不变。
+JSON 字符串值中的引号必须转义，所以消息正文里出现的 "fromType":2 之类文字不会被误认为字段。
+"""
+import re
+from typing import Optional
+
+_SELF_MESSAGE = re.compile(rb'"msgSource"\s*:\s*1(?![0-9.eE])')
+_GROUP_MESSAGE = re.compile(rb'"fromType"\s*:\s*2(?![0-9.eE])')
+
+IGNORE_SELF_MESSAGE = "self_message"
+IGNORE_NOT_MENTIONED = "not_mentioned"
+
+
+class WebhookPrefilter:
+    """基于原始请求体的快速丢弃判断"""
+
+    def __init__(self, bot_wxid: str):
+        """
+        Args:
+            bot_wxid: 机器人 wxid，为空时与完整流程一致，所有群聊消息都视为未@机器人
+        """
+        self.bot_wxid = bot_wxid.encode('utf-8')
+
+    def check(self, body: bytes) -> Optional[str]:
+        """
+        判断回调是否可以直接丢弃
+
+        Args:
+            body: 原始请求体
+
+        Returns:
+            丢弃原因，需要完整处理时返回 None
+        """
+        if _SELF_MESSAGE.search(body):
+            return IGNORE_SELF_MESSAGE
+        if (not self.bot_wxid or self.bot_wxid not in body) and _GROUP_MESSAGE.search(body):
+            return IGNORE_NOT_MENTIONED
+        return None
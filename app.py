@@ -1,5 +1,7 @@
 from flask import Flask
 from api.routes import api_bp
+from api.json_provider import CodecJSONProvider
+from ragflow import codec
 import logging
 import os
 from dotenv import load_dotenv
@@ -21,6 +23,10 @@ def create_app():
     # 加载配置
     app.config.from_object('config.Config')
 
+    # JSON 编解码：默认优先使用 orjson
+    codec.use(app.config.get('JSON_CODEC') or None)
+    app.json = CodecJSONProvider(app)
+
     # 注册蓝图
     app.register_blueprint(api_bp, url_prefix='/api')
 
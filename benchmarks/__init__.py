@@ -0,0 +1,6 @@
+"""
+性能基准测试脚本
+
+每个脚本都可以单独运行，例如:
+    python -m benchmarks.bench_session_manager
+"""
@@ -0,0 +1,92 @@
+"""
+对话归档吞吐量基准测试
+
+1. 提交开销：消息处理路径上 ArchiveSink.submit 的耗时
+2. 写入吞吐：后台线程写入 SQLite (WAL) 与 JSONL 的最大速率
+3. 定速压测：以目标速率（默认 10000 条/秒）持续提交，统计丢弃数与关闭时的剩余写入耗时
+
+用法:
+    python -m benchmarks.bench_archive [--count 100000] [--rate 10000] [--seconds 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.archive import ArchiveSink, JSONLArchiveWriter, SQLiteArchiveWriter
+from services.metrics import metrics
+
+ANSWER = "您好，订单发货后一般 3-5 个工作日送达，偏远地区可能需要 7 天左右。" * 4
+
+
+def make_record(i):
+    return {"ts": time.time(), "session_key": f"wx_session:private:wxid_{i % 1000}", "ragflow_session_id": "sid",
+            "question": f"请问我的订单 {i} 什么时候发货？", "answer": ANSWER, "error": 0, "latency_ms": 812.3}
+
+
+def make_writer(kind, directory):
+    if kind == "sqlite":
+        return SQLiteArchiveWriter(os.path.join(directory, "archive.db"))
+    return JSONLArchiveWriter(directory)
+
+
+def bench_throughput(kind, directory, count):
+    metrics.reset()
+    sink = ArchiveSink(make_writer(kind, directory), capacity=count, batch_size=1000).start()
+    records = [make_record(i) for i in range(count)]
+    start = time.perf_counter()
+    for record in records:
+        sink.submit(record)
+    submitted = time.perf_counter() - start
+    sink.close(timeout=None)
+    total = time.perf_counter() - start
+    return submitted / count, count / total
+
+
+def bench_paced(kind, directory, rate, seconds, capacity):
+    metrics.reset()
+    sink = ArchiveSink(make_writer(kind, directory), capacity=capacity, batch_size=1000).start()
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    sent = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            break
+        due = int(elapsed / interval)
+        while sent < due:
+            sink.submit(make_record(sent))
+            sent += 1
+        time.sleep(0.001)
+    drain_start = time.perf_counter()
+    sink.close(timeout=None)
+    return sent, metrics.get("archive_dropped"), metrics.get("archive_written"), time.perf_counter() - drain_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对话归档吞吐量基准测试")
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--rate', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--capacity', type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'backend':>8} {'submit(us)':>11} {'write msg/s':>12}")
+    for kind in ("sqlite", "jsonl"):
+        with tempfile.TemporaryDirectory() as directory:
+            per_submit, throughput = bench_throughput(kind, directory, args.count)
+            print(f"{kind:>8} {per_submit * 1e6:>11.2f} {throughput:>12.0f}")
+
+    print(f"\npaced at {args.rate} msg/s for {args.seconds}s (capacity {args.capacity})")
+    print(f"{'backend':>8} {'sent':>8} {'dropped':>8} {'written':>8} {'drain(s)':>9}")
+    for kind in ("sqlite", "jsonl"):
+        with tempfile.TemporaryDirectory() as directory:
+            sent, dropped, written, drain = bench_paced(kind, directory, args.rate, args.seconds, args.capacity)
+            print(f"{kind:>8} {sent:>8} {dropped:>8} {written:>8} {drain:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+JSON 编解码基准测试
+
+按一条微信消息的完整处理路径计量序列化开销：解析 webhook、编码/解析 RagFlow 请求与响应、
+编码/解析微信发送接口的请求与响应、编码本服务的响应，分别测量标准库 json 与 orjson（若已安装）。
+
+用法:
+    python -m benchmarks.bench_codec [--count 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ragflow import codec
+
+ANSWER = "您好，订单发货后一般 3-5 个工作日送达，偏远地区可能需要 7 天左右。" * 6
+
+WEBHOOK = codec.dumps({
+    "event": 10008,
+    "wxid": "wxid_bot",
+    "data": {"type": "recvMsg", "des": "收到消息", "data": {
+        "timeStamp": "1700000000123", "fromType": 1, "msgType": 1, "msgSource": 0,
+        "fromWxid": "wxid_user123", "finalFromWxid": "", "atWxidList": [], "silence": 0,
+        "membercount": 0, "signature": "v1_abcdef", "msg": "请问我的订单 20240518 什么时候发货？",
+        "msgId": "7283910293847561234",
+    }},
+})
+RAGFLOW_REQUEST = {"question": "请问我的订单 20240518 什么时候发货？", "session_id": "9f8e7d6c5b4a", "stream": False}
+RAGFLOW_RESPONSE = codec.dumps({"code": 0, "data": {
+    "answer": ANSWER, "session_id": "9f8e7d6c5b4a", "id": "d1c2b3a4",
+    "reference": {"total": 2, "chunks": [{"id": f"chunk-{i}", "content": ANSWER[:120], "similarity": 0.82,
+                                          "document_name": "售后政策.pdf"} for i in range(4)]},
+}})
+WECHAT_REQUEST = {"type": "sendText2", "data": {"wxid": "wxid_user123", "msg": ANSWER, "compatible": "0"}}
+WECHAT_RESPONSE = codec.dumps({"code": 200, "msg": "操作成功", "result": {}, "wxid": "wxid_bot"})
+API_RESPONSE = {"status": "success", "message": "Message processed and reply sent",
+                "reply": ANSWER, "ragflow_session_id": "9f8e7d6c5b4a"}
+
+
+def per_message(c: codec.Codec) -> None:
+    c.loads(WEBHOOK)
+    c.dumps(RAGFLOW_REQUEST)
+    c.loads(RAGFLOW_RESPONSE)
+    c.dumps(WECHAT_REQUEST)
+    c.loads(WECHAT_RESPONSE)
+    c.dumps(API_RESPONSE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON 编解码基准测试")
+    parser.add_argument('--count', type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {}
+    for name, c in codec.CODECS.items():
+        per_message(c)
+        start = time.perf_counter()
+        for _ in range(args.count):
+            per_message(c)
+        results[name] = (time.perf_counter() - start) / args.count
+
+    print(f"default backend: {codec.BACKEND}")
+    baseline = results["json"]
+    for name, elapsed in results.items():
+        print(f"{name:>8}: {elapsed * 1e6:8.2f} us/message ({baseline / elapsed:.1f}x vs json)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+FAQ 快速回复匹配基准测试
+
+生成指定数量的规则（每条若干整句与关键词），测量 Aho-Corasick 一次扫描与逐条规则做子串查找
+在命中整句、命中关键词、未命中（短消息与长消息）时的单次匹配耗时。
+
+用法:
+    python -m benchmarks.bench_faq [--rules 50] [--count 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.faq import FAQIndex, FAQRule, normalize
+
+MESSAGES = {
+    "exact": "你好！",
+    "keyword": "麻烦帮我转人工",
+    "miss_short": "订单什么时候发货",
+    "miss_long": "我上周在你们店里买了一台洗衣机，到现在还没有发货，订单号是 20240518001，"
+                 "请问能不能帮我查一下物流状态，另外想问一下能不能开增值税专用发票？" * 2,
+}
+
+
+def build_rules(count):
+    rules = [
+        FAQRule("greeting", "您好", exact=["你好", "您好", "在吗", "hi", "hello"]),
+        FAQRule("human", "转接中", exact=["人工"], keywords=["转人工", "人工客服"], max_length=20),
+    ]
+    for i in range(count - len(rules)):
+        rules.append(FAQRule(f"faq_{i}", f"回答 {i}", exact=[f"常见问题{i}", f"问题{i}怎么办"],
+                             keywords=[f"关键词{i}甲", f"关键词{i}乙"], max_length=40))
+    return rules
+
+
+def naive_match(rules, text):
+    """逐条规则查找，用于对比"""
+    normalized = normalize(text)
+    for rule in rules:
+        if any(normalize(p) == normalized for p in rule.exact):
+            return rule
+    for rule in rules:
+        if (not rule.max_length or len(normalized) <= rule.max_length) and \
+                any(normalize(k) in normalized for k in rule.keywords):
+            return rule
+    return None
+
+
+def timeit(func, text, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func(text)
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAQ 快速回复匹配基准测试")
+    parser.add_argument('--rules', type=int, default=50)
+    parser.add_argument('--count', type=int, default=20000)
+    args = parser.parse_args()
+
+    rules = build_rules(args.rules)
+    index = FAQIndex(rules)
+    print(f"rules: {len(rules)}, automaton states: {len(index.automaton)}")
+    print(f"{'message':>11} {'chars':>6} {'aho-corasick(us)':>17} {'naive(us)':>10}")
+    for name, text in MESSAGES.items():
+        fast = timeit(index.match, text, args.count)
+        naive = timeit(lambda t: naive_match(rules, t), text, max(1, args.count // 10))
+        print(f"{name:>11} {len(text):>6} {fast * 1e6:>17.2f} {naive * 1e6:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
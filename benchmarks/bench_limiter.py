@@ -0,0 +1,86 @@
+"""
+自适应并发限制基准测试
+
+固定数量的客户端线程持续向本地模拟器发送问答请求，模拟器的容量按阶段变化
+（正常 -> 过载 -> 恢复），分别在不限制、gradient、aimd 三种方式下测量每个阶段的吞吐量、
+延迟分位数以及阶段结束时的 limit。
+
+用法:
+    python -m benchmarks.bench_limiter [--clients 48] [--latency 0.1] [--phase-seconds 3]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.simulator import RagFlowSimulator
+from ragflow.client import RagFlowClient
+from ragflow.limiter import ALGORITHM_AIMD, ALGORITHM_GRADIENT
+from ragflow.router import Backend, RagFlowRouter
+
+# (阶段名, 模拟器容量)
+PHASES = [("normal", 32), ("overload", 8), ("recovered", 32)]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def bench(algorithm, clients, latency, phase_seconds):
+    with RagFlowSimulator(latency=latency, capacity=PHASES[0][1]) as simulator:
+        limiter_options = {"algorithm": algorithm, "initial_limit": 16, "max_limit": 128} if algorithm else None
+        router = RagFlowRouter([Backend("a", RagFlowClient("key", simulator.api_base, "chat"), "chat")],
+                               limiter_options=limiter_options)
+        limiter = router.backends["a"].limiter
+        samples = []
+        stop = threading.Event()
+
+        def client():
+            while not stop.is_set():
+                start = time.perf_counter()
+                result = router.send_message("你好", "sid", backend="a")
+                samples.append((time.perf_counter(), time.perf_counter() - start, bool(result.get("error"))))
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        rows = []
+        for name, capacity in PHASES:
+            simulator.set_latency(latency, capacity=capacity)
+            begin = time.perf_counter()
+            time.sleep(phase_seconds)
+            phase = [s for s in samples if s[0] >= begin]
+            latencies = [s[1] for s in phase if not s[2]]
+            rows.append((name, capacity, len(latencies) / phase_seconds, percentile(latencies, 0.5),
+                         percentile(latencies, 0.95), sum(s[2] for s in phase),
+                         limiter.limit if limiter else "-"))
+        stop.set()
+        for t in threads:
+            t.join()
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="自适应并发限制基准测试")
+    parser.add_argument('--clients', type=int, default=48)
+    parser.add_argument('--latency', type=float, default=0.1, help="模拟器的基础延迟（秒）")
+    parser.add_argument('--phase-seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{'limiter':>9} {'phase':>10} {'capacity':>9} {'req/s':>8} {'p50(ms)':>8} {'p95(ms)':>8} "
+          f"{'errors':>7} {'limit':>6}")
+    for algorithm in (None, ALGORITHM_GRADIENT, ALGORITHM_AIMD):
+        for name, capacity, throughput, p50, p95, errors, limit in bench(algorithm, args.clients, args.latency,
+                                                                         args.phase_seconds):
+            print(f"{algorithm or 'none':>9} {name:>10} {capacity:>9} {throughput:>8.1f} {p50 * 1000:>8.0f} "
+                  f"{p95 * 1000:>8.0f} {errors:>7} {limit:>6}")
+
+
+if __name__ == '__main__':
+    main()
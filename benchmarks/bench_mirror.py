@@ -0,0 +1,84 @@
+"""
+对话镜像写入开销基准测试
+
+测量每条消息（一轮问答）追加到 Redis 列表镜像的开销：
+  - client: 客户端编码消息并打包 RPUSH + LTRIM + EXPIRE 命令的耗时，不需要 Redis
+  - redis:  实际执行 pipeline 的耗时（含一次往返），需要可访问的 Redis（REDIS_HOST/REDIS_PORT），
+            使用独立的 key 并在结束后删除；Redis 不可用时跳过
+  - redis+record: 与会话记录更新合并在同一个 pipeline 中执行的耗时（即 ChatService 中的实际写法）
+
+用法:
+    python -m benchmarks.bench_mirror [--count 5000] [--max-messages 20]
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import redis
+from redis.connection import Connection
+
+from config import Config
+from services.conversation_mirror import ConversationMirror
+from services.session_record import SessionRecordStore
+
+QUESTION = "请问我的订单 20240518 什么时候发货？"
+ANSWER = "您好，订单发货后一般 3-5 个工作日送达，偏远地区可能需要 7 天左右。" * 4
+
+
+def bench_client(mirror, count):
+    connection = Connection()
+    start = time.perf_counter()
+    for i in range(count):
+        pipe = mirror.redis_client.pipeline(transaction=False)
+        mirror.append_turn(f"bench:{i % 100}", QUESTION, ANSWER, pipe=pipe)
+        connection.pack_commands([args for args, _ in pipe.command_stack])
+    return (time.perf_counter() - start) / count
+
+
+def bench_redis(client, mirror, records, count, prefix, with_record):
+    start = time.perf_counter()
+    for i in range(count):
+        key = f"{prefix}{i % 100}"
+        pipe = client.pipeline(transaction=False)
+        if with_record:
+            records.record_turn(key, 120, 0.8, pipe=pipe)
+        mirror.append_turn(key, QUESTION, ANSWER, pipe=pipe)
+        pipe.execute()
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对话镜像写入开销基准测试")
+    parser.add_argument('--count', type=int, default=5000)
+    parser.add_argument('--max-messages', type=int, default=20)
+    args = parser.parse_args()
+
+    client = redis.StrictRedis(host=Config.REDIS_HOST, port=Config.REDIS_PORT, db=Config.REDIS_DB,
+                               password=Config.REDIS_PASSWORD, decode_responses=True, socket_connect_timeout=1)
+    mirror = ConversationMirror(client, args.max_messages, ttl=600)
+    records = SessionRecordStore(client, ttl=600)
+
+    print(f"{'client':>13}: {bench_client(mirror, args.count) * 1e6:8.2f} us/message")
+
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        print(f"Redis 不可用，跳过 redis 测试: {e}")
+        return
+
+    prefix = f"bench_mirror:{uuid.uuid4().hex}:"
+    try:
+        for label, with_record in (("redis", False), ("redis+record", True)):
+            elapsed = bench_redis(client, mirror, records, args.count, prefix, with_record)
+            print(f"{label:>13}: {elapsed * 1e6:8.2f} us/message")
+    finally:
+        for i in range(100):
+            client.delete(f"{prefix}{i}", mirror.key(f"{prefix}{i}"))
+
+
+if __name__ == '__main__':
+    main()
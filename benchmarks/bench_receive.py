@@ -0,0 +1,73 @@
+"""
+/receive 忽略消息吞吐量基准测试
+
+通过 Flask 测试客户端连续投递未@机器人的群聊消息与机器人自身的消息，
+测量开启与关闭预过滤 (WEBHOOK_PREFILTER) 时每秒可以处理的回调数。
+日志写入 os.devnull，保留格式化与输出的开销但不刷屏。
+
+用法:
+    python -m benchmarks.bench_receive [--count 20000] [--padding 600]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api import routes
+from api.webhook_filter import WebhookPrefilter
+from app import create_app
+
+BOT_WXID = "wxid_bot"
+
+
+def build_payloads(padding):
+    base = {"msgId": "10001", "fromWxid": "12345678@chatroom", "finalFromWxid": "wxid_user",
+            "msg": "今天下午三点开会，大家记得带电脑。" + "啊" * padding, "msgType": 1,
+            "timestamp": 1716000000, "atWxidList": []}
+    group = {"type": "recvMsg", "data": {"type": "recvMsg", "data": dict(base, fromType=2, msgSource=0)}}
+    own = {"type": "recvMsg", "data": {"type": "recvMsg", "data": dict(base, fromType=1, msgSource=1)}}
+    return {"group_not_mentioned": json.dumps(group, ensure_ascii=False).encode('utf-8'),
+            "self_message": json.dumps(own, ensure_ascii=False).encode('utf-8')}
+
+
+def bench(client, body, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        client.post('/api/receive', data=body, content_type='application/json')
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/receive 忽略消息吞吐量基准测试")
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--padding', type=int, default=600, help="消息正文追加的字符数")
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    for handler in root.handlers:
+        handler.setStream(open(os.devnull, 'w'))
+
+    app = create_app()
+    app.config['BOT_WXID'] = BOT_WXID
+    client = app.test_client()
+    # 忽略的消息不会用到这些服务，设置后跳过 initialize_services 对 Redis 的初始化
+    routes.chat_service = MagicMock()
+    routes.wechat_service = MagicMock()
+
+    print(f"{'message':>20} {'bytes':>6} {'prefilter off(req/s)':>21} {'prefilter on(req/s)':>20}")
+    for name, body in build_payloads(args.padding).items():
+        routes.webhook_prefilter = None
+        off = bench(client, body, args.count)
+        routes.webhook_prefilter = WebhookPrefilter(BOT_WXID)
+        on = bench(client, body, args.count)
+        print(f"{name:>20} {len(body):>6} {off:>21.0f} {on:>20.0f}")
+    routes.chat_service.process_wechat_message.assert_not_called()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+SessionManager 基准测试
+
+分别在 1万、10万、100万 个活跃会话下测量:
+- 命中查找 get_session 的平均耗时
+- 新建会话的平均耗时
+- 全部会话过期后一次完整清理的耗时
+
+用法:
+    python -m benchmarks.bench_session_manager [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ragflow.session import SessionManager
+
+
+def bench_size(size: int, lookups: int = 100000) -> dict:
+    manager = SessionManager(expiry_seconds=3600)
+
+    start = time.perf_counter()
+    for i in range(size):
+        manager.get_session(f"s{i}")
+    create_cost = (time.perf_counter() - start) / size
+
+    start = time.perf_counter()
+    for i in range(lookups):
+        manager.get_session(f"s{(i * 7919) % size}")
+    lookup_cost = (time.perf_counter() - start) / lookups
+
+    # 让所有会话过期，测量完整清理耗时
+    manager.expiry_seconds = -1
+    start = time.perf_counter()
+    with manager._lock:
+        removed = manager._cleanup_expired_sessions()
+    sweep_cost = time.perf_counter() - start
+
+    return {
+        "size": size,
+        "create_us": create_cost * 1e6,
+        "lookup_us": lookup_cost * 1e6,
+        "sweep_ms": sweep_cost * 1e3,
+        "removed": removed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SessionManager 基准测试")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'sessions':>10} {'create(us)':>12} {'lookup(us)':>12} {'sweep(ms)':>12}")
+    for size in args.sizes:
+        r = bench_size(size, args.lookups)
+        print(f"{r['size']:>10} {r['create_us']:>12.2f} {r['lookup_us']:>12.2f} {r['sweep_ms']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
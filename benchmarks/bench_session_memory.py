@@ -0,0 +1,86 @@
+"""
+会话内存占用基准测试
+
+用 tracemalloc 测量每个空闲会话、每条消息的内存占用，
+并与原先基于 __dict__ 和 {"role", "content"} 字典的表示方式对比。
+目标：每个会话与每条消息的占用均至少降低 40%。
+
+用法:
+    python -m benchmarks.bench_session_memory [--sessions 100000] [--messages 20]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ragflow.session import RagFlowSession
+
+TARGET_REDUCTION = 0.40
+SYSTEM_PROMPT = "你是一个客服助手，请根据知识库回答用户的问题。"
+
+
+class LegacySession:
+    """原有的会话表示方式，仅用于对比"""
+
+    def __init__(self, session_id, system_prompt=None, ragflow_chat_id=None):
+        self.session_id = session_id
+        self.system_prompt = system_prompt
+        self.messages = []
+        if system_prompt:
+            self.messages.append({"role": "system", "content": system_prompt})
+        self.ragflow_chat_id = ragflow_chat_id
+        self.ragflow_session_id = None
+        self.custom_title_set = False
+        self.created_at = time.time()
+        self.last_active = time.time()
+
+    def add_message(self, role, content):
+        self.messages.append({"role": role, "content": content})
+
+
+def measure(factory, count: int, messages: int):
+    # 预先生成 id 与消息内容，只统计会话结构本身的开销
+    ids = [f"session-{i}" for i in range(count)]
+    contents = ["消息内容" for _ in range(messages)]
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    sessions = [factory(session_id, SYSTEM_PROMPT, "chat-id") for session_id in ids]
+    after_sessions = tracemalloc.get_traced_memory()[0]
+    for session in sessions:
+        for i, content in enumerate(contents):
+            session.add_message("user" if i % 2 == 0 else "assistant", content)
+    after_messages = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    per_session = (after_sessions - base) / count
+    per_message = (after_messages - after_sessions) / (count * messages) if messages else 0.0
+    return per_session, per_message
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话内存占用基准测试")
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--messages', type=int, default=20)
+    args = parser.parse_args()
+
+    legacy_session, legacy_message = measure(LegacySession, args.sessions, args.messages)
+    compact_session, compact_message = measure(RagFlowSession, args.sessions, args.messages)
+
+    session_reduction = 1 - compact_session / legacy_session
+    message_reduction = 1 - compact_message / legacy_message
+
+    print(f"{'':>10} {'legacy(B)':>12} {'compact(B)':>12} {'reduction':>10}")
+    print(f"{'session':>10} {legacy_session:>12.1f} {compact_session:>12.1f} {session_reduction:>10.1%}")
+    print(f"{'message':>10} {legacy_message:>12.1f} {compact_message:>12.1f} {message_reduction:>10.1%}")
+
+    ok = session_reduction >= TARGET_REDUCTION and message_reduction >= TARGET_REDUCTION
+    print(f"目标降低 {TARGET_REDUCTION:.0%}: {'达成' if ok else '未达成'}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
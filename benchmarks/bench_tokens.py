@@ -0,0 +1,52 @@
+"""
+Token估算基准测试
+
+测量中英文混合文本在无缓存、命中缓存、批量模式下的估算耗时。
+
+用法:
+    python -m benchmarks.bench_tokens [--count 10000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ragflow import tokens
+
+SAMPLE = "请问订单 20240518 的物流状态？I ordered the blue one, 谢谢😀"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token估算基准测试")
+    parser.add_argument('--count', type=int, default=10000)
+    args = parser.parse_args()
+
+    texts = [f"{SAMPLE} #{i}" for i in range(args.count)]
+
+    start = time.perf_counter()
+    for text in texts:
+        tokens._estimate(text)
+    uncached = (time.perf_counter() - start) / args.count
+
+    for text in texts[:8192]:
+        tokens.estimate_tokens(text)
+    start = time.perf_counter()
+    for text in texts[:8192]:
+        tokens.estimate_tokens(text)
+    cached = (time.perf_counter() - start) / min(args.count, 8192)
+
+    batch_input = texts * 3
+    start = time.perf_counter()
+    tokens.estimate_tokens_batch(batch_input)
+    batch = (time.perf_counter() - start) / len(batch_input)
+
+    print(f"sample tokens: {tokens.estimate_tokens(SAMPLE)} (chars: {len(SAMPLE)})")
+    print(f"{'uncached':>10}: {uncached * 1e6:8.2f} us/text")
+    print(f"{'cached':>10}: {cached * 1e6:8.2f} us/text")
+    print(f"{'batch':>10}: {batch * 1e6:8.2f} us/text")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+消息截断基准测试
+
+在 1万 条消息的历史上对比:
+- legacy: 原先在倒序循环中 insert 的实现
+- truncate_messages: 线性实现（每次调用重新计数）
+- Session.truncate: 缓存前缀和 + 二分查找，返回视图
+
+用法:
+    python -m benchmarks.bench_truncate [--messages 10000] [--max-tokens 200000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ragflow.session import Session
+from ragflow.utils import truncate_messages
+
+
+def legacy_truncate(messages, max_tokens):
+    """原有的二次复杂度实现，仅用于对比"""
+    system_messages = [msg for msg in messages if msg.get('role') == 'system']
+    other_messages = [msg for msg in messages if msg.get('role') != 'system']
+    system_tokens = sum(len(msg.get('content', '')) for msg in system_messages)
+    if max_tokens - system_tokens <= 0:
+        return system_messages
+    result = system_messages.copy()
+    token_count = system_tokens
+    for msg in reversed(other_messages):
+        msg_tokens = len(msg.get('content', ''))
+        if token_count + msg_tokens <= max_tokens:
+            result.insert(len(system_messages), msg)
+            token_count += msg_tokens
+        else:
+            break
+    return result
+
+
+def timeit(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="消息截断基准测试")
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--max-tokens', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    session = Session("bench", system_prompt="你是一个客服助手。")
+    for i in range(args.messages):
+        session.add_message("user" if i % 2 == 0 else "assistant", "消息内容" * (5 + i % 20))
+    messages = session.get_messages()
+
+    # 预热前缀和，模拟会话中持续追加消息的场景
+    session.truncate(args.max_tokens)
+
+    results = {
+        "legacy": timeit(lambda: legacy_truncate(messages, args.max_tokens), args.repeat),
+        "truncate_messages": timeit(lambda: truncate_messages(messages, args.max_tokens), args.repeat),
+        "Session.truncate": timeit(lambda: session.truncate(args.max_tokens), args.repeat),
+    }
+
+    kept = len(session.truncate(args.max_tokens))
+    print(f"messages={args.messages} max_tokens={args.max_tokens} kept={kept}")
+    for name, cost in results.items():
+        print(f"{name:>18}: {cost * 1e3:10.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
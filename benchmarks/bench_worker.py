@@ -0,0 +1,93 @@
+"""
+Redis Stream worker 扩展性基准测试
+
+向一个独立的 Stream 写入一批消息，分别用 1/2/4/8 个 worker 进程消费，
+RagFlow 与微信接口由本地模拟器提供（每次问答固定延迟），测量吞吐量随 worker 数的变化。
+需要可访问的 Redis（REDIS_HOST/REDIS_PORT，默认 127.0.0.1:6379），会使用独立的 key 并在结束后删除。
+
+用法:
+    python -m benchmarks.bench_worker [--messages 2000] [--workers 1 2 4 8] [--concurrency 4] [--latency 0.1]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import redis
+
+from benchmarks.simulator import RagFlowSimulator
+from config import Config
+from services.chat_service import create_chat_service
+from services.message_stream import MessageStream
+from services.wechat_service import WeChatService
+from services.worker import StreamWorker, config_from_object
+
+
+def run_worker(config, name, concurrency, stop_event):
+    chat_service = create_chat_service(config)
+    stream = MessageStream(chat_service.redis_client, config['STREAM_KEY'], config['STREAM_GROUP'])
+    worker = StreamWorker(chat_service, WeChatService(config['WECHAT_API_BASE']), stream, name,
+                          concurrency=concurrency, block_ms=200)
+    worker.start()
+    stop_event.wait()
+    worker.stop(timeout=5)
+
+
+def bench(config, workers, messages, concurrency, simulator):
+    client = redis.StrictRedis(host=config['REDIS_HOST'], port=config['REDIS_PORT'], db=config['REDIS_DB'],
+                               password=config['REDIS_PASSWORD'], decode_responses=True)
+    config = dict(config, STREAM_KEY=f"bench_stream:{uuid.uuid4().hex}")
+    stream = MessageStream(client, config['STREAM_KEY'], config['STREAM_GROUP'])
+    stream.ensure_group()
+    for i in range(messages):
+        stream.publish({"question": f"问题 {i}", "from_wxid": f"wxid_{i % 500}", "final_from_wxid": "",
+                        "is_group": 0, "bot_wxid": "wxid_bot"})
+
+    baseline = simulator.wechat_messages
+    stop_event = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=run_worker, args=(config, f"bench-{i}", concurrency, stop_event))
+                 for i in range(workers)]
+    start = time.perf_counter()
+    for p in processes:
+        p.start()
+    while simulator.wechat_messages - baseline < messages:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    stop_event.set()
+    for p in processes:
+        p.join()
+    client.delete(config['STREAM_KEY'])
+    for key in client.scan_iter("wx_session:private:wxid_*"):
+        client.delete(key)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redis Stream worker 扩展性基准测试")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--concurrency', type=int, default=4, help="每个 worker 进程的消费线程数")
+    parser.add_argument('--latency', type=float, default=0.1)
+    args = parser.parse_args()
+
+    with RagFlowSimulator(latency=args.latency) as simulator:
+        config = config_from_object(Config)
+        config.update(RAGFLOW_API_BASE=simulator.api_base, WECHAT_API_BASE=simulator.wechat_api_base)
+
+        print(f"{'workers':>8} {'messages':>9} {'elapsed(s)':>11} {'msg/s':>8} {'scaling':>8}")
+        single = None
+        for workers in args.workers:
+            elapsed = bench(config, workers, args.messages, args.concurrency, simulator)
+            throughput = args.messages / elapsed
+            single = single or throughput / workers
+            print(f"{workers:>8} {args.messages:>9} {elapsed:>11.1f} {throughput:>8.1f} "
+                  f"{throughput / (single * workers):>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
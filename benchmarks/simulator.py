@@ -0,0 +1,167 @@
+"""
+本地 RagFlow / 微信 HTTP API 模拟器
+
+在本机端口上模拟 RagFlow 的会话创建与问答接口，以及微信框架的发送接口，
+用于在不依赖真实服务的情况下对整条链路做基准测试。
+
+延迟模型: latency = base_latency * max(1, in_flight / capacity) + 随机抖动，
+即超过 capacity 个并发请求时延迟按比例上升，模拟过载的上游。
+
+用法:
+    python -m benchmarks.simulator [--port 9380] [--latency 0.5] [--capacity 32]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class _Server(ThreadingHTTPServer):
+    # 默认的 listen 队列只有 5，高并发基准测试时会出现连接被重置
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class RagFlowSimulator:
+    """RagFlow 与微信 HTTP API 模拟器"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.05, jitter: float = 0.0, capacity: Optional[int] = None):
+        """
+        初始化模拟器
+
+        Args:
+            host: 监听地址
+            port: 监听端口，0 表示随机端口
+            latency: 问答接口的基础延迟（秒）
+            jitter: 延迟的随机抖动比例 (0~1)
+            capacity: 不增加延迟的最大并发数，None 表示不限
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.in_flight = 0
+        self.completions = 0
+        self.sessions = 0
+        self.wechat_messages = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base(self) -> str:
+        """RagFlow API 基础URL"""
+        return f"{self.base_url}/api/v1"
+
+    @property
+    def wechat_api_base(self) -> str:
+        """微信 HTTP API 基础URL"""
+        return f"{self.base_url}/wechat/httpapi"
+
+    def set_latency(self, latency: float, jitter: Optional[float] = None, capacity: Optional[int] = None) -> None:
+        """运行中调整延迟模型"""
+        self.latency = latency
+        if jitter is not None:
+            self.jitter = jitter
+        if capacity is not None:
+            self.capacity = capacity
+
+    def start(self) -> 'RagFlowSimulator':
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ragflow-simulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'RagFlowSimulator':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _completion_delay(self) -> float:
+        with self._lock:
+            self.in_flight += 1
+            load = self.in_flight / self.capacity if self.capacity else 1.0
+        delay = self.latency * max(1.0, load)
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return delay
+
+    def _handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                data = json.loads(self.rfile.read(length) or b'{}')
+
+                if self.path.startswith('/wechat'):
+                    with simulator._lock:
+                        simulator.wechat_messages += 1
+                    self._reply({"code": 200, "msg": "ok"})
+                elif self.path.endswith('/sessions'):
+                    with simulator._lock:
+                        simulator.sessions += 1
+                    self._reply({"code": 0, "data": {"id": uuid.uuid4().hex, "name": data.get("name")}})
+                elif self.path.endswith('/completions'):
+                    delay = simulator._completion_delay()
+                    try:
+                        time.sleep(delay)
+                    finally:
+                        with simulator._lock:
+                            simulator.in_flight -= 1
+                            simulator.completions += 1
+                    self._reply({"code": 0, "data": {
+                        "answer": f"模拟回答: {data.get('question', '')[:20]}",
+                        "session_id": data.get("session_id") or uuid.uuid4().hex,
+                    }})
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 RagFlow 模拟器")
+    parser.add_argument('--port', type=int, default=9380)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--capacity', type=int, default=None)
+    args = parser.parse_args()
+
+    simulator = RagFlowSimulator(port=args.port, latency=args.latency, jitter=args.jitter, capacity=args.capacity)
+    print(f"RAGFLOW_API_BASE={simulator.api_base}")
+    print(f"WECHAT_API_BASE={simulator.wechat_api_base}")
+    try:
+        simulator._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
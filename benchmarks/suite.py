@@ -0,0 +1,281 @@
+"""
+进程内热点函数的微基准测试套件
+
+与其他 bench_*.py 不同，本套件用于发现性能回退：每个用例运行若干轮，记录每次调用的耗时
+（各轮中的最小值与中位数），结果可以保存为 JSON 基线，之后的运行与基线比较，
+最小值超过基线 (1 + threshold) 倍的用例视为回退，此时以退出码 1 结束，便于在 CI 中使用。
+基线与机器相关，只应与同一台机器上保存的基线比较。
+
+用例:
+  - truncate_messages_*: ragflow.utils.truncate_messages
+  - extract_title_*: ragflow.utils.extract_title_from_first_message
+  - session_manager_*: SessionManager.get_session 的命中与新建、过期会话清理
+  - receive_*: /api/receive 的回调解析（预过滤丢弃、完整解析后因重复投递返回），服务使用 MagicMock
+  - chat_service_session_lookup: ChatService 在 Redis 中查找已有会话记录，
+    需要可访问的 Redis（REDIS_HOST/REDIS_PORT），使用独立的 key 并在结束后删除；Redis 不可用时跳过
+
+用法:
+    python -m benchmarks.suite [--filter session] [--rounds 7] [--min-time 0.1]
+                               [--save baseline.json] [--compare baseline.json] [--threshold 0.2]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ragflow.session import SessionManager
+from ragflow.utils import extract_title_from_first_message, truncate_messages
+
+# 用例函数接收循环次数，返回这些循环的总耗时（秒）；需要准备数据的用例在计时外完成准备
+TimeFunc = Callable[[int], float]
+CASES: Dict[str, Callable[[], Optional[TimeFunc]]] = {}
+
+
+def case(name: str):
+    """注册用例，被装饰的函数完成准备工作并返回计时函数，返回 None 表示跳过"""
+    def register(factory):
+        CASES[name] = factory
+        return factory
+    return register
+
+
+def loop(func: Callable[[], object]) -> TimeFunc:
+    """把无参数的调用包装为计时函数"""
+    def run(loops):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        return time.perf_counter() - start
+    return run
+
+
+def _history(count: int) -> List[Dict[str, str]]:
+    messages = [{"role": "system", "content": "你是一个客服助手，请根据知识库回答用户的问题。"}]
+    for i in range(count):
+        messages.append({"role": "user" if i % 2 == 0 else "assistant",
+                         "content": "请问订单什么时候发货？Order status please." * (1 + i % 5)})
+    return messages
+
+
+@case("truncate_messages_100")
+def _truncate_100():
+    messages = _history(100)
+    return loop(lambda: truncate_messages(messages, 2000))
+
+
+@case("truncate_messages_1000")
+def _truncate_1000():
+    messages = _history(1000)
+    return loop(lambda: truncate_messages(messages, 20000))
+
+
+@case("extract_title_short")
+def _title_short():
+    return loop(lambda: extract_title_from_first_message("你好，请问订单什么时候发货？"))
+
+
+@case("extract_title_long")
+def _title_long():
+    message = "我上周在你们店里买了一台洗衣机, 到现在还没有发货! Order 20240518001, please check. " * 10
+    return loop(lambda: extract_title_from_first_message(message))
+
+
+@case("session_manager_get_hit")
+def _session_hit():
+    manager = SessionManager(expiry_seconds=3600)
+    keys = [f"s{i}" for i in range(10000)]
+    for key in keys:
+        manager.get_session(key)
+    state = {"i": 0}
+
+    def hit():
+        state["i"] = (state["i"] + 7919) % len(keys)
+        manager.get_session(keys[state["i"]])
+    return loop(hit)
+
+
+@case("session_manager_get_new")
+def _session_new():
+    def run(loops):
+        manager = SessionManager(expiry_seconds=3600)
+        keys = [f"s{i}" for i in range(loops)]
+        start = time.perf_counter()
+        for key in keys:
+            manager.get_session(key)
+        return time.perf_counter() - start
+    return run
+
+
+@case("session_manager_cleanup")
+def _session_cleanup():
+    # 每次循环清理一个过期会话
+    def run(loops):
+        manager = SessionManager(expiry_seconds=3600)
+        for i in range(loops):
+            manager.get_session(f"s{i}")
+        manager.expiry_seconds = -1
+        start = time.perf_counter()
+        with manager._lock:
+            manager._cleanup_expired_sessions()
+        return time.perf_counter() - start
+    return run
+
+
+def _receive_client():
+    from api import routes
+    from api.webhook_filter import WebhookPrefilter
+    from app import create_app
+
+    app = create_app()
+    app.config['BOT_WXID'] = "wxid_bot"
+    # 设置后跳过 initialize_services；重复投递时完整解析后直接返回，不再调用其他服务
+    routes.chat_service = MagicMock()
+    routes.chat_service.is_duplicate_message.return_value = True
+    routes.wechat_service = MagicMock()
+    routes.webhook_prefilter = WebhookPrefilter("wxid_bot")
+    return app.test_client()
+
+
+def _webhook(from_type: int, at_bot: bool) -> bytes:
+    data = {"msgId": "10001", "msg": " 请问订单什么时候发货？", "msgType": 1, "msgSource": 0,
+            "fromType": from_type, "fromWxid": "12345678@chatroom", "finalFromWxid": "wxid_user",
+            "atWxidList": ["wxid_bot"] if at_bot else [], "timestamp": 1716000000}
+    return json.dumps({"type": "recvMsg", "data": {"type": "recvMsg", "data": data}}, ensure_ascii=False).encode()
+
+
+@case("receive_prefiltered")
+def _receive_prefiltered():
+    client, body = _receive_client(), _webhook(2, at_bot=False)
+    return loop(lambda: client.post('/api/receive', data=body, content_type='application/json'))
+
+
+@case("receive_parsed")
+def _receive_parsed():
+    client, body = _receive_client(), _webhook(2, at_bot=True)
+    return loop(lambda: client.post('/api/receive', data=body, content_type='application/json'))
+
+
+@case("chat_service_session_lookup")
+def _chat_service_lookup():
+    from config import Config
+    from services.chat_service import create_chat_service
+    from services.session_record import SessionRecord
+    from services.worker import config_from_object
+
+    chat_service = create_chat_service(config_from_object(Config))
+    if not chat_service.redis_health.available():
+        return None
+    backend = next(iter(chat_service.ragflow_client.backends))
+    keys = [f"bench_suite:{uuid.uuid4().hex}:{i}" for i in range(100)]
+    now = time.time()
+    for key in keys:
+        chat_service.session_records.save(key, SessionRecord(session_id=uuid.uuid4().hex, backend=backend,
+                                                             created_at=now, last_active=now))
+
+    def run(loops):
+        start = time.perf_counter()
+        for i in range(loops):
+            chat_service._get_or_create_session_record(keys[i % len(keys)], "bench")
+        return time.perf_counter() - start
+    run.cleanup = lambda: chat_service.redis_client.delete(*keys)
+    return run
+
+
+def measure(run: TimeFunc, rounds: int, min_time: float) -> Dict[str, float]:
+    """
+    先倍增循环次数直到一轮耗时不少于 min_time，再运行 rounds 轮
+
+    Returns:
+        每次调用耗时（微秒）的最小值与中位数，以及每轮的循环次数
+    """
+    loops = 1
+    while True:
+        elapsed = run(loops)
+        if elapsed >= min_time or loops >= 1 << 24:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed * 1.2) + 1))
+    per_call = [run(loops) / loops * 1e6 for _ in range(rounds)]
+    return {"min_us": min(per_call), "median_us": statistics.median(per_call), "loops": loops}
+
+
+def run_suite(pattern: str = "", rounds: int = 7, min_time: float = 0.1) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, factory in CASES.items():
+        if pattern and pattern not in name:
+            continue
+        run = factory()
+        if run is None:
+            print(f"{name:>30}: 跳过")
+            continue
+        try:
+            results[name] = measure(run, rounds, min_time)
+        finally:
+            cleanup = getattr(run, "cleanup", None)
+            if cleanup is not None:
+                cleanup()
+        print(f"{name:>30}: {results[name]['min_us']:12.3f} us (median {results[name]['median_us']:.3f})")
+    return results
+
+
+def compare(baseline: Dict[str, Dict[str, float]], current: Dict[str, Dict[str, float]],
+            threshold: float) -> List[Tuple[str, float, float, float]]:
+    """
+    与基线比较每次调用的最小耗时
+
+    Returns:
+        回退的用例 (名称, 基线耗时, 当前耗时, 变化比例)，基线中没有的用例不参与比较
+    """
+    regressions = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = result["min_us"] / base["min_us"] - 1
+        if change > threshold:
+            regressions.append((name, base["min_us"], result["min_us"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="进程内热点函数的微基准测试套件")
+    parser.add_argument('--filter', default='', help="只运行名称包含该字符串的用例")
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.1, help="每轮的最短时长（秒）")
+    parser.add_argument('--save', help="把结果保存为 JSON 基线")
+    parser.add_argument('--compare', help="与该 JSON 基线比较")
+    parser.add_argument('--threshold', type=float, default=0.2, help="耗时超过基线该比例时视为回退")
+    args = parser.parse_args()
+
+    # 只测量函数本身，不包括日志输出
+    logging.disable(logging.INFO)
+    results = run_suite(args.filter, args.rounds, args.min_time)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"已保存基线: {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(baseline, results, args.threshold)
+        for name, before, after, change in regressions:
+            print(f"回退 {name}: {before:.3f} us -> {after:.3f} us (+{change:.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"与基线相比没有超过 {args.threshold:.0%} 的回退")
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,15 @@ class Config:
     REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
     REDIS_DB = int(os.environ.get('REDIS_DB', 0))
     REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', None)  # 如果Redis有密码
+    # 连接池：读写超时需大于 worker 阻塞读取 Stream 的时间 (2 秒)
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 5.0))
+    REDIS_CONNECT_TIMEOUT = float(os.environ.get('REDIS_CONNECT_TIMEOUT', 1.0))
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 15))  # 空闲连接复用前 PING 的间隔（秒）
+    REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 64))
+    REDIS_RETRY_INTERVAL = float(os.environ.get('REDIS_RETRY_INTERVAL', 5.0))  # Redis 故障降级期间探测恢复的间隔（秒）
+    # 会话记录存储: redis（故障时降级到进程内存储，恢复后写回）、memory 或 sqlite
+    SESSION_STORE = os.environ.get('SESSION_STORE', 'redis')
+    SESSION_STORE_PATH = os.environ.get('SESSION_STORE_PATH', 'data/sessions.db')  # sqlite 数据库文件
 
     # RagFlow会话在Redis中的过期时间（秒），例如1小时
     RAGFLOW_SESSION_EXPIRY_REDIS = int(os.environ.get('RAGFLOW_SESSION_EXPIRY_REDIS', 3600))
@@ -24,11 +33,108 @@ class Config:
     RAGFLOW_API_BASE = os.environ.get('RAGFLOW_API_BASE', 'https://ragflow.wy-ai.uk/api/v1')  # 添加默认值
     RAGFLOW_CHAT_ID = os.environ.get('RAGFLOW_CHAT_ID', '0db793303ae111f08d4b2aa20fe52986')  # 添加默认值
 
+    # 多个 RagFlow 后端（JSON 数组，每项 {"name", "api_key", "api_base", "chat_id"}），为空时只使用上面的单个后端
+    RAGFLOW_BACKENDS = os.environ.get('RAGFLOW_BACKENDS', '')
+    RAGFLOW_BALANCER = os.environ.get('RAGFLOW_BALANCER', 'least_outstanding')  # 新会话的后端选择策略: least_outstanding 或 ewma
+    RAGFLOW_EJECT_FAILURES = int(os.environ.get('RAGFLOW_EJECT_FAILURES', 3))  # 连续失败该次数后暂时摘除后端
+    RAGFLOW_EJECT_SECONDS = float(os.environ.get('RAGFLOW_EJECT_SECONDS', 30.0))  # 摘除时长（秒）
+
+    # 每个后端问答请求的自适应并发限制: gradient 或 aimd，为空时不限制（默认）
+    # 开启后在途请求达到限制时最多等待 RAGFLOW_LIMIT_MAX_WAIT 秒，仍无名额时回复繁忙
+    RAGFLOW_LIMITER = os.environ.get('RAGFLOW_LIMITER', '')
+    RAGFLOW_LIMIT_INITIAL = int(os.environ.get('RAGFLOW_LIMIT_INITIAL', 16))  # 初始在途请求数
+    RAGFLOW_LIMIT_MIN = int(os.environ.get('RAGFLOW_LIMIT_MIN', 2))  # 最小在途请求数
+    RAGFLOW_LIMIT_MAX = int(os.environ.get('RAGFLOW_LIMIT_MAX', 64))  # 最大在途请求数
+    RAGFLOW_LIMIT_TOLERANCE = float(os.environ.get('RAGFLOW_LIMIT_TOLERANCE', 1.5))  # 可容忍的延迟相对无负载延迟的倍数
+    RAGFLOW_LIMIT_MAX_WAIT = float(os.environ.get('RAGFLOW_LIMIT_MAX_WAIT', 5.0))  # 等待名额的最长时间（秒）
+
     BOT_WXID = os.environ.get('BOT_WXID', '')  # 添加默认值
 
+    # 微信HTTP API配置
+    WECHAT_API_BASE = os.environ.get('WECHAT_API_BASE', 'http://127.0.0.1:8888/wechat/httpapi')
+
+    # 消息处理模式: inline 在 Web 进程内直接处理; stream 写入 Redis Stream，由 python -m services.worker 消费
+    PROCESSING_MODE = os.environ.get('PROCESSING_MODE', 'inline')
+    STREAM_KEY = os.environ.get('STREAM_KEY', 'wx_stream:messages')
+    STREAM_GROUP = os.environ.get('STREAM_GROUP', 'wx_workers')
+    STREAM_MAXLEN = int(os.environ.get('STREAM_MAXLEN', 100000))  # Stream 近似最大长度
+    STREAM_CLAIM_IDLE_MS = int(os.environ.get('STREAM_CLAIM_IDLE_MS', 120000))  # 超过该时间未确认的消息由其他 worker 接管
+    STREAM_MAX_DELIVERIES = int(os.environ.get('STREAM_MAX_DELIVERIES', 3))  # 超过该投递次数仍失败则回复兜底并确认
+    WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 8))  # 每个 worker 进程的消费线程数
+
+    # 微信回调去重：同一消息在该时间（秒）内的重复投递直接确认，不再处理
+    WEBHOOK_DEDUP_TTL = int(os.environ.get('WEBHOOK_DEDUP_TTL', 300))
+
+    # RagFlow 会话轮换：会话越长 RagFlow 回答越慢，达到轮次或累计估算token数后换用新会话（0 表示不限制，默认关闭）
+    # 轮换后 RagFlow 不再看到之前的对话，需要保留上下文时同时开启 SESSION_CARRY_SUMMARY，例如 20 轮 / 8000 token
+    SESSION_ROTATE_TURNS = int(os.environ.get('SESSION_ROTATE_TURNS', 0))
+    SESSION_ROTATE_TOKENS = int(os.environ.get('SESSION_ROTATE_TOKENS', 0))
+    SESSION_POOL_SIZE = int(os.environ.get('SESSION_POOL_SIZE', 0))  # 每个后端预创建的会话数，0 表示不预创建
+    SESSION_CARRY_SUMMARY = os.environ.get('SESSION_CARRY_SUMMARY', 'false').lower() in ('1', 'true', 'yes')  # 轮换时带入最近问答的摘要，需要开启对话镜像 (HISTORY_MAX_MESSAGES)
+    SESSION_SUMMARY_TOKENS = int(os.environ.get('SESSION_SUMMARY_TOKENS', 200))  # 带入摘要的token预算
+
+    # 对话镜像：每轮问答追加到 Redis 列表 history:<会话键>，只保留最近的消息，供摘要等功能使用（0 表示不记录）
+    HISTORY_MAX_MESSAGES = int(os.environ.get('HISTORY_MAX_MESSAGES', 0))
+
+    # 对话归档：每轮问答异步批量写入 SQLite (WAL) 或按大小轮转的 JSONL 文件，为空时不归档
+    ARCHIVE_BACKEND = os.environ.get('ARCHIVE_BACKEND', '')  # sqlite 或 jsonl
+    ARCHIVE_PATH = os.environ.get('ARCHIVE_PATH', 'data/archive.db')  # sqlite 为数据库文件，jsonl 为目录
+    ARCHIVE_MAX_BYTES = int(os.environ.get('ARCHIVE_MAX_BYTES', 64 * 1024 * 1024))  # 单个 JSONL 文件的最大字节数
+    ARCHIVE_CAPACITY = int(os.environ.get('ARCHIVE_CAPACITY', 10000))  # 内存缓冲区最多容纳的记录数
+    ARCHIVE_POLICY = os.environ.get('ARCHIVE_POLICY', 'block')  # 缓冲区满时: block 短暂等待后丢弃, drop 立即丢弃新记录
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))  # 每批写入的最大记录数
+    ARCHIVE_FLUSH_INTERVAL = float(os.environ.get('ARCHIVE_FLUSH_INTERVAL', 1.0))  # 最长写入间隔（秒）
+    ARCHIVE_MAX_RETRIES = int(os.environ.get('ARCHIVE_MAX_RETRIES', 3))  # 写入失败后的最多重试次数，之后丢弃该批记录
+    ARCHIVE_RETRY_BACKOFF = float(os.environ.get('ARCHIVE_RETRY_BACKOFF', 0.5))  # 首次重试前的等待（秒），之后每次翻倍
+    ARCHIVE_BUSY_TIMEOUT = float(os.environ.get('ARCHIVE_BUSY_TIMEOUT', 5.0))  # SQLite 数据库被锁定时的最长等待（秒）
+
     # 会话配置
     SESSION_EXPIRY = int(os.environ.get('SESSION_EXPIRY', 3600))  # 会话过期时间（秒）
     MAX_TOKENS = int(os.environ.get('MAX_TOKENS', 2500))  # 最大token数
+    # 单条用户问题的token预算，超出时在发送到RagFlow前抽取式截取（默认为 MAX_TOKENS 的一半）
+    QUESTION_MAX_TOKENS = int(os.environ.get('QUESTION_MAX_TOKENS', MAX_TOKENS // 2))
+
+    # 准入控制（负载削减）：超出在途数/排队数/预计等待时间时立即回复繁忙提示
+    # 限制按进程计算，需要多线程 worker（如 gunicorn --worker-class gthread），每个进程的线程数
+    # 不少于 ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUE，见 Dockerfile 中的 GUNICORN_THREADS
+    ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 16))  # 最大同时处理数
+    ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 32))  # 最大排队数
+    ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', 5.0))  # 最长排队等待时间（秒）
+    BUSY_REPLY = os.environ.get('BUSY_REPLY', "当前咨询人数较多，请稍后再试。")  # 为空时使用 FALLBACK_REPLY
+
+    # 回复时限：超过 REPLY_INTERIM_AFTER 秒仍无回答时先发送提示，超过 REPLY_HARD_DEADLINE 秒回复 FALLBACK_REPLY（0 表示不启用）
+    REPLY_INTERIM_AFTER = float(os.environ.get('REPLY_INTERIM_AFTER', 0))
+    REPLY_HARD_DEADLINE = float(os.environ.get('REPLY_HARD_DEADLINE', 0))
+    INTERIM_REPLY = os.environ.get('INTERIM_REPLY', "正在为您查询，请稍候…")
+
+    # 单条消息从到达起的处理时限（秒），排队、Redis、RagFlow 与微信回复共用；超过后跳过剩余工作（0 表示不限时）
+    # 开启后 RagFlow 请求的超时不会超过剩余时间；stream worker 接管的消息从接管时重新计时
+    MESSAGE_DEADLINE = float(os.environ.get('MESSAGE_DEADLINE', 0))
+
+    # 优先级调度：排队的消息按类别 (vip/command/private/group) 加权公平分配处理名额
+    VIP_WXIDS = frozenset(w.strip() for w in os.environ.get('VIP_WXIDS', '').split(',') if w.strip())
+    PRIORITY_WEIGHTS = os.environ.get('PRIORITY_WEIGHTS', 'vip:8,command:4,private:4,group:1')
+    PRIORITY_STARVATION_SECONDS = float(os.environ.get('PRIORITY_STARVATION_SECONDS', 2.0))  # 等待超过该时间的消息优先处理
+
+    # FAQ 与关键词快速回复规则文件（JSON，格式见 services/faq.py 与 faq_rules.example.json），为空时不启用
+    FAQ_RULES_PATH = os.environ.get('FAQ_RULES_PATH', '')
+    FAQ_RELOAD_INTERVAL = float(os.environ.get('FAQ_RELOAD_INTERVAL', 5.0))  # 检查规则文件是否修改的间隔（秒）
+
+    # 在解析 JSON 前丢弃未@机器人的群聊消息与机器人自身的消息，只计数 (webhook_ignored_*)
+    WEBHOOK_PREFILTER = os.environ.get('WEBHOOK_PREFILTER', 'true').lower() in ('1', 'true', 'yes')
+
+    # 管理接口 (/api/admin/*: 采样分析、tracemalloc)，请求头 X-Admin-Token 必须与之相同；两项都设置后才开启
+    # 批量问答接口 (/api/chat/batch) 同样需要该请求头，未设置 ADMIN_TOKEN 时不可用
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    PROFILING_MAX_SECONDS = float(os.environ.get('PROFILING_MAX_SECONDS', 60.0))  # 单次采样的最长时长（秒）
+
+    # 批量问答配置
+    BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))  # 默认并发数
+    BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 64))  # 接口允许的最大并发数
+
+    # JSON 编解码实现: orjson 或 json，为空时安装了 orjson 则使用 orjson
+    JSON_CODEC = os.environ.get('JSON_CODEC', '')
 
     # 日志配置
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -1,8 +1,10 @@
-import json
 import requests
 import logging
 from typing import Dict, Any, Optional, Union
 
+from ragflow import codec
+from ragflow.deadline import Deadline, expired, timeout_for
+
 logger = logging.getLogger(__name__)
 
 
@@ -33,13 +35,14 @@ class RagFlowClient:
 
         logger.info("RagFlow API 客户端已初始化。")
 
-    def create_session(self, chat_id: str, title: str) -> Optional[str]:
+    def create_session(self, chat_id: str, title: str, deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         创建一个新的RagFlow会话
 
         Args:
             chat_id: 聊天ID
             title: 会话标题
+            deadline: 消息处理时限，超时取剩余时间与10秒中较小者；已过期时不发送请求
 
         Returns:
             会话ID，如果创建失败则返回None
@@ -47,12 +50,17 @@ class RagFlowClient:
         url = f"{self.api_base}/chats/{chat_id}/sessions"
         payload = {"name": title}
 
+        if expired(deadline):
+            logger.warning(f"消息处理已超时，跳过创建RagFlow会话: {title}")
+            return None
+
         logger.debug(f"正在创建RagFlow会话。URL: {url}, 标题: {title}")
 
         try:
-            response = requests.post(url, headers=self.headers, json=payload, timeout=10)
+            response = requests.post(url, headers=self.headers, data=codec.dumps(payload),
+                                     timeout=timeout_for(deadline, 10))
             response.raise_for_status()
-            res_data = response.json()
+            res_data = codec.loads(response.content)
 
             if res_data.get("code") == 0:
                 session_id = res_data.get("data", {}).get("id")
@@ -62,25 +70,27 @@ class RagFlowClient:
                 logger.error(f"创建RagFlow会话失败: {res_data.get('message')}")
                 return None
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, codec.JSONDecodeError) as e:
             logger.error(f"创建RagFlow会话时发生异常: {e}")
             return None
 
     def send_message(self,
                      question: str,
-                     session_id: str,
+                     session_id: Optional[str],
                      chat_id: Optional[str] = None,
                      stream: bool = False,
-                     timeout: int = 60) -> Dict[str, Any]:
+                     timeout: int = 60,
+                     deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
         发送消息到RagFlow
 
         Args:
             question: 用户问题
-            session_id: 会话ID
+            session_id: 会话ID，为None时由RagFlow自动创建新会话
             chat_id: 聊天ID，如果为None则使用默认值
             stream: 是否使用流式响应
             timeout: 请求超时时间（秒）
+            deadline: 消息处理时限，超时取剩余时间与 timeout 中较小者；已过期时不发送请求
 
         Returns:
             包含响应内容的字典
@@ -92,16 +102,26 @@ class RagFlowClient:
             "session_id": session_id,
             "stream": stream,
         }
+        if session_id is None:
+            del payload["session_id"]
+
+        if expired(deadline):
+            logger.warning("消息处理已超时，跳过发送到RagFlow")
+            return {"content": "请求超时，请稍后再试。", "error": True, "timeout": True, "session_id": session_id}
 
         url = f"{self.api_base}/chats/{chat_id_to_use}/completions"
-        logger.debug(f"发送消息到RagFlow。URL: {url}, 负载: {json.dumps(payload)}")
+        body = codec.dumps(payload)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"发送消息到RagFlow。URL: {url}, 负载: {body.decode('utf-8')}")
 
         try:
-            response = requests.post(url, headers=self.headers, json=payload, timeout=timeout)
+            response = requests.post(url, headers=self.headers, data=body, timeout=timeout_for(deadline, timeout))
             response.raise_for_status()
 
-            res_data = response.json()
-            logger.debug(f"RagFlow响应: {json.dumps(res_data, ensure_ascii=False)}")
+            if debug:
+                logger.debug(f"RagFlow响应: {response.content.decode('utf-8', 'replace')}")
+            res_data = codec.loads(response.content)
 
             if res_data.get("code") == 0:
                 data_payload = res_data.get("data", {})
@@ -110,7 +130,7 @@ class RagFlowClient:
                     return {
                         "content": answer.strip(),
                         "error": False,
-                        "session_id": session_id
+                        "session_id": session_id or data_payload.get("session_id")
                     }
 
             logger.error(f"RagFlow API返回错误码: {res_data.get('code')}, 消息: {res_data.get('message')}")
@@ -120,22 +140,34 @@ class RagFlowClient:
                 "session_id": session_id
             }
 
+        except requests.exceptions.ConnectTimeout:
+            # 连接超时说明后端不可达，与剩余时限无关
+            logger.error(f"RagFlow连接超时")
+            return {"content": "请求超时，请稍后再试。", "error": True, "timeout": True, "connect_timeout": True,
+                    "session_id": session_id}
+
         except requests.exceptions.Timeout:
             logger.error(f"RagFlow请求超时")
-            return {"content": "请求超时，请稍后再试。", "error": True, "session_id": session_id}
+            return {"content": "请求超时，请稍后再试。", "error": True, "timeout": True, "session_id": session_id}
+
+        except requests.exceptions.ConnectionError as e:
+            logger.error(f"连接RagFlow失败: {e}")
+            return {"content": "处理您的请求时发生未知错误。", "error": True, "connection_error": True,
+                    "session_id": session_id}
 
         except requests.exceptions.HTTPError as e:
             logger.error(f"RagFlow HTTP错误: {e.response.status_code} - {e.response.text}")
             error_content = f"服务通讯失败 (HTTP {e.response.status_code})。"
 
             try:
-                err_json = e.response.json()
-                if err_json.get("message"):
+                err_json = codec.loads(e.response.content)
+                if isinstance(err_json, dict) and err_json.get("message"):
                     error_content = f"服务通讯失败: {err_json.get('message')}"
-            except json.JSONDecodeError:
+            except codec.JSONDecodeError:
                 pass
 
-            return {"content": error_content, "error": True, "session_id": session_id}
+            return {"content": error_content, "error": True, "status_code": e.response.status_code,
+                    "session_id": session_id}
 
         except Exception as e:
             logger.error(f"发送消息到RagFlow时发生异常: {e}")
@@ -0,0 +1,91 @@
+"""
+JSON 编解码
+
+Webhook 解析、RagFlow/微信接口的请求与响应、本服务的 JSON 响应都经过这里。
+安装了 orjson 时使用 orjson，否则使用标准库 json；两者的输出都是紧凑的 UTF-8 字节串（不转义中文），
+可以直接作为 HTTP 请求体发送。
+
+调用方应使用 codec.dumps / codec.loads（模块属性），use() 切换实现后立即生效。
+"""
+import json
+import logging
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，两种实现都可以用它捕获解析错误
+JSONDecodeError = json.JSONDecodeError
+
+Default = Optional[Callable[[Any], Any]]
+
+
+class Codec(NamedTuple):
+    """一种 JSON 实现"""
+    name: str
+    dumps: Callable[..., bytes]
+    loads: Callable[[Union[bytes, str]], Any]
+
+
+def _json_dumps(obj: Any, default: Default = None) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=default).encode("utf-8")
+
+
+def _json_loads(data: Union[bytes, str]) -> Any:
+    return json.loads(data)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _orjson_dumps(obj: Any, default: Default = None) -> bytes:
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # 超过 64 位的整数等 orjson 不支持的输入交给标准库
+            return _json_dumps(obj, default)
+
+    def _orjson_loads(data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+
+CODECS: Dict[str, Codec] = {"json": Codec("json", _json_dumps, _json_loads)}
+if orjson is not None:
+    CODECS["orjson"] = Codec("orjson", _orjson_dumps, _orjson_loads)
+
+BACKEND = ""
+dumps: Callable[..., bytes] = _json_dumps
+loads: Callable[[Union[bytes, str]], Any] = _json_loads
+
+
+def use(name: Optional[str] = None) -> Codec:
+    """
+    选择 JSON 实现
+
+    Args:
+        name: "orjson" 或 "json"，为 None 时优先使用 orjson；指定的实现未安装时回退到标准库
+
+    Returns:
+        当前使用的实现
+    """
+    global BACKEND, dumps, loads
+    if name is None:
+        name = "orjson" if "orjson" in CODECS else "json"
+    codec = CODECS.get(name)
+    if codec is None:
+        logger.warning(f"JSON 实现 {name} 不可用，使用标准库 json")
+        codec = CODECS["json"]
+    BACKEND, dumps, loads = codec.name, codec.dumps, codec.loads
+    return codec
+
+
+def dumps_str(obj: Any, default: Default = None) -> str:
+    """编码为字符串（用于日志、JSONL 行等需要文本的场合）"""
+    return dumps(obj, default).decode("utf-8")
+
+
+use()
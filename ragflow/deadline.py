@@ -0,0 +1,56 @@
+"""
+单条消息的处理时限
+
+消息到达时创建一个 Deadline，随消息依次传给 ChatService、RagFlowClient 和 WeChatService。
+每次外部调用用剩余时间（不超过该调用原有的超时）作为超时；时限已过时直接跳过后续工作。
+"""
+import time
+from typing import Optional
+
+
+class Deadline:
+    """基于 time.monotonic() 的截止时间"""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, seconds: float):
+        """
+        Args:
+            seconds: 从现在起的可用时间（秒）
+        """
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_received_at(cls, received_at: float, seconds: float) -> 'Deadline':
+        """
+        根据消息到达时的墙上时间 (time.time()) 创建，用于跨进程传递的消息（如 Redis Stream）
+
+        Args:
+            received_at: 消息到达时的时间戳
+            seconds: 从到达起的可用时间（秒）
+        """
+        return cls(received_at + seconds - time.time())
+
+    def remaining(self) -> float:
+        """剩余时间（秒），已过期时为 0"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def timeout(self, cap: float) -> float:
+        """某次调用应使用的超时：剩余时间与该调用原有超时 cap 中较小者"""
+        return min(cap, self.remaining())
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.2f}s)"
+
+
+def timeout_for(deadline: Optional[Deadline], cap: float) -> float:
+    """deadline 为 None 时使用原有超时 cap"""
+    return cap if deadline is None else deadline.timeout(cap)
+
+
+def expired(deadline: Optional[Deadline]) -> bool:
+    """deadline 为 None 表示不限时"""
+    return deadline is not None and deadline.expired()
@@ -0,0 +1,174 @@
+"""
+RagFlow 调用的自适应并发限制
+
+固定的并发数在 RagFlow 空闲时利用不足，在 RagFlow 变慢时又会继续加压。
+AdaptiveLimiter 每经过约一个往返时间（一个采样窗口）根据窗口内的平均延迟与无负载基线延迟的比较调整一次允许的在途请求数：
+  - gradient (Vegas 风格): limit 按 tolerance * 基线 / 窗口延迟 的比例收缩（最多减半），
+    延迟在容忍范围内时增加约 sqrt(limit)
+  - aimd: 窗口内有调用失败或窗口延迟超过 基线 * tolerance 时 limit 乘以 backoff，否则加一
+按窗口而不是按每次调用调整，是因为一次收缩要一个往返之后才反映在延迟上，逐次调整会连续收缩到最小值。
+基线取各窗口延迟的最小值，每 probe_interval 秒以当前窗口延迟重新开始统计，以便跟上 RagFlow 本身变慢或变快。
+在途请求未用到 limit 的一半时不增加 limit，避免负载较低时 limit 无限增长。
+同一后端的所有线程共享一个限制器。
+"""
+import math
+import threading
+import time
+from typing import Any, Dict, Optional
+
+ALGORITHM_GRADIENT = "gradient"
+ALGORITHM_AIMD = "aimd"
+
+
+class AdaptiveLimiter:
+    """基于延迟的自适应并发限制器（线程安全）"""
+
+    def __init__(self, algorithm: str = ALGORITHM_GRADIENT, initial_limit: int = 16, min_limit: int = 2,
+                 max_limit: int = 64, tolerance: float = 1.5, smoothing: float = 0.5, backoff: float = 0.75,
+                 min_window: float = 0.05, probe_interval: float = 60.0, max_wait: float = 5.0):
+        """
+        初始化限制器
+
+        Args:
+            algorithm: 调整算法，gradient 或 aimd
+            initial_limit/min_limit/max_limit: 初始、最小、最大在途请求数
+            tolerance: 可容忍的延迟相对基线的倍数，超过后开始收缩 limit
+            smoothing: gradient 算法中新 limit 的平滑系数
+            backoff: aimd 算法中收缩时的乘数
+            min_window: 采样窗口的最短时长（秒），窗口时长取上一窗口的平均延迟与该值中较大者
+            probe_interval: 重新测量基线延迟的间隔（秒）
+            max_wait: 获取名额的最长等待时间（秒）
+        """
+        if algorithm not in (ALGORITHM_GRADIENT, ALGORITHM_AIMD):
+            raise ValueError(f"未知的并发限制算法: {algorithm}")
+        self.algorithm = algorithm
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.min_window = min_window
+        self.probe_interval = probe_interval
+        self.max_wait = max_wait
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self.rtt = 0.0
+        self.rtt_noload = 0.0
+        self.rejected = 0
+        self._probe_at = 0.0
+        self._window_end = 0.0
+        self._window_sum = 0.0
+        self._window_count = 0
+        self._window_dropped = False
+        self._window_max_in_flight = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """当前允许的在途请求数"""
+        return int(self._limit)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        获取一个名额，limit 已用满时等待
+
+        Args:
+            timeout: 最长等待时间（秒），不超过 max_wait
+
+        Returns:
+            是否获取成功；成功时调用方必须调用 release
+        """
+        wait = self.max_wait if timeout is None else min(self.max_wait, timeout)
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while self.in_flight >= self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: Optional[float] = None, ok: bool = True) -> None:
+        """
+        归还名额并记录本次调用
+
+        Args:
+            latency: 本次调用耗时（秒），为 None 时不记录（如调用方自身时限不足导致的超时）
+            ok: 调用是否成功，失败视为过载信号
+        """
+        with self._cond:
+            self._window_max_in_flight = max(self._window_max_in_flight, self.in_flight)
+            self.in_flight -= 1
+            if latency is not None:
+                self._sample(latency, ok, time.monotonic())
+            self._cond.notify_all()
+
+    def _sample(self, latency: float, ok: bool, now: float) -> None:
+        if ok:
+            self._window_sum += latency
+            self._window_count += 1
+        else:
+            self._window_dropped = True
+        if now < self._window_end or not (self._window_count or self.rtt):
+            return
+
+        if self._window_count:
+            self.rtt = self._window_sum / self._window_count
+            if now >= self._probe_at:
+                # 定期以当前延迟重新开始统计基线，否则 RagFlow 本身变慢后 limit 会一直被压在最小值
+                self.rtt_noload = self.rtt
+                self._probe_at = now + self.probe_interval
+            else:
+                self.rtt_noload = min(self.rtt_noload, self.rtt)
+
+        if self.algorithm == ALGORITHM_AIMD:
+            new_limit = self._aimd()
+        else:
+            new_limit = self._gradient()
+        self._limit = min(max(new_limit, self.min_limit), self.max_limit)
+
+        self._window_end = now + max(self.rtt, self.min_window)
+        self._window_sum = 0.0
+        self._window_count = 0
+        self._window_dropped = False
+        self._window_max_in_flight = self.in_flight
+
+    def _app_limited(self) -> bool:
+        # 在途请求未用到 limit 的一半时，延迟正常不能说明可以承受更高的并发
+        return self._window_max_in_flight * 2 < self._limit
+
+    def _aimd(self) -> float:
+        if self._window_dropped or self.rtt > self.rtt_noload * self.tolerance:
+            return self._limit * self.backoff
+        if self._app_limited():
+            return self._limit
+        return self._limit + 1
+
+    def _gradient(self) -> float:
+        if self._window_dropped:
+            gradient = 0.5
+        elif self.rtt <= 0:
+            # 时钟精度不足时窗口延迟可能为 0，无法比较，视为在容忍范围内
+            gradient = 1.0
+        else:
+            # 窗口延迟在基线的 tolerance 倍以内时 gradient 为 1，超出后按比例收缩，最多减半
+            gradient = max(0.5, min(1.0, self.tolerance * self.rtt_noload / self.rtt))
+        if gradient >= 1.0 and self._app_limited():
+            return self._limit
+        queue_size = math.sqrt(self._limit) if gradient >= 1.0 else 0.0
+        new_limit = self._limit * gradient + queue_size
+        return self._limit * (1 - self.smoothing) + new_limit * self.smoothing
+
+    def stats(self) -> Dict[str, Any]:
+        """获取当前状态"""
+        with self._cond:
+            return {
+                "algorithm": self.algorithm,
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "rtt_ms": round(self.rtt * 1000, 1),
+                "rtt_noload_ms": round(self.rtt_noload * 1000, 1),
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,267 @@
+"""
+多 RagFlow 后端的负载均衡路由
+
+每个后端有独立的 API 密钥、基础URL 和 chat_id。新会话按最少在途请求数或
+EWMA 延迟选择后端；连续失败的后端会被暂时摘除。会话创建后始终发往创建它的后端
+（会话亲和），后端标识与会话ID一起保存在 Redis 中。
+配置 limiter_options 时，每个后端的问答请求经过一个自适应并发限制器 (ragflow.limiter)。
+"""
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from ragflow.client import RagFlowClient
+from ragflow.deadline import Deadline, expired
+from ragflow.limiter import AdaptiveLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "default"
+_REF_SEPARATOR = "@"
+
+# 剩余时限把超时缩短到正常超时的该比例以下时，读取超时才不计入后端失败；
+# 默认配置下（时限 30 秒、超时 60 秒）的超时仍计入，卡住的后端会被摘除
+NEUTRAL_TIMEOUT_FRACTION = 0.25
+
+STRATEGY_LEAST_OUTSTANDING = "least_outstanding"
+STRATEGY_EWMA = "ewma"
+
+
+def encode_session_ref(session_id: str, backend: str) -> str:
+    """将会话ID与后端名编码为一个字符串，用于存入 Redis"""
+    return f"{session_id}{_REF_SEPARATOR}{backend}"
+
+
+def decode_session_ref(value: str) -> Tuple[str, str]:
+    """
+    解析 Redis 中保存的会话引用
+
+    兼容只保存了会话ID的旧数据，此时视为默认后端。
+
+    Returns:
+        (会话ID, 后端名)
+    """
+    session_id, sep, backend = value.rpartition(_REF_SEPARATOR)
+    if not sep:
+        return value, DEFAULT_BACKEND
+    return session_id, backend
+
+
+class Backend:
+    """一个 RagFlow 后端及其负载与健康状态"""
+
+    def __init__(self, name: str, client: RagFlowClient, chat_id: str, limiter: Optional[AdaptiveLimiter] = None):
+        self.name = name
+        self.client = client
+        self.chat_id = chat_id
+        self.limiter = limiter
+        self.outstanding = 0
+        self.latency_ewma = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "outstanding": self.outstanding,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1),
+            "consecutive_failures": self.consecutive_failures,
+            "ejected": not self.is_healthy(time.monotonic()),
+        }
+        if self.limiter is not None:
+            stats["limiter"] = self.limiter.stats()
+        return stats
+
+
+def _overloaded(result) -> bool:
+    """
+    调用结果是否为过载信号：超时、连接失败与 5xx 响应；
+    未知会话、4xx 等业务错误说明后端正常响应，不应使并发限制收缩
+    """
+    if not isinstance(result, dict):
+        return not result
+    if not result.get("error"):
+        return False
+    return bool(result.get("timeout") or result.get("connection_error") or result.get("status_code", 0) >= 500)
+
+
+class RagFlowRouter:
+    """在多个 RagFlow 后端之间路由请求"""
+
+    def __init__(self, backends: List[Backend], strategy: str = STRATEGY_LEAST_OUTSTANDING,
+                 eject_after_failures: int = 3, eject_seconds: float = 30.0, latency_alpha: float = 0.3,
+                 limiter_options: Optional[Dict[str, Any]] = None):
+        """
+        初始化路由
+
+        Args:
+            backends: 后端列表，第一个为默认后端（旧会话数据没有后端标识时使用）
+            strategy: 选择策略，least_outstanding 或 ewma
+            eject_after_failures: 连续失败该次数后摘除后端
+            eject_seconds: 摘除时长（秒），之后重新尝试
+            latency_alpha: 延迟指数移动平均的平滑系数
+            limiter_options: 传给 AdaptiveLimiter 的选项，为 None 时不限制问答并发
+        """
+        if not backends:
+            raise ValueError("RagFlow 后端列表为空。")
+        if limiter_options is not None:
+            for backend in backends:
+                if backend.limiter is None:
+                    backend.limiter = AdaptiveLimiter(**limiter_options)
+        self.backends = {backend.name: backend for backend in backends}
+        self.default_backend = backends[0].name
+        self.strategy = strategy
+        self.eject_after_failures = eject_after_failures
+        self.eject_seconds = eject_seconds
+        self.latency_alpha = latency_alpha
+        self._lock = threading.Lock()
+        logger.info(f"RagFlow 路由已初始化，后端: {list(self.backends)}，策略: {strategy}")
+
+    @classmethod
+    def from_config(cls, api_key: str, api_base: str, default_chat_id: str, backends_json: str = "",
+                    **kwargs) -> 'RagFlowRouter':
+        """
+        根据配置创建路由
+
+        Args:
+            api_key/api_base/default_chat_id: 单后端配置，backends_json 为空时使用
+            backends_json: JSON 数组，每项形如 {"name", "api_key", "api_base", "chat_id"}
+        """
+        specs = json.loads(backends_json) if backends_json else []
+        if not specs:
+            specs = [{"name": DEFAULT_BACKEND, "api_key": api_key, "api_base": api_base, "chat_id": default_chat_id}]
+        backends = [
+            Backend(spec.get("name") or f"backend-{i}",
+                    RagFlowClient(spec["api_key"], spec["api_base"], spec["chat_id"]),
+                    spec["chat_id"])
+            for i, spec in enumerate(specs)
+        ]
+        return cls(backends, **kwargs)
+
+    def get(self, name: Optional[str]) -> Optional[Backend]:
+        """
+        按名称获取后端，None 表示默认后端
+        旧会话数据解析出的 DEFAULT_BACKEND 在没有同名后端时（RAGFLOW_BACKENDS 使用了其他名称）也指向默认后端
+        """
+        if not name or (name == DEFAULT_BACKEND and name not in self.backends):
+            name = self.default_backend
+        return self.backends.get(name)
+
+    def is_available(self, name: Optional[str]) -> bool:
+        """后端是否存在且未被摘除"""
+        backend = self.get(name)
+        return backend is not None and backend.is_healthy(time.monotonic())
+
+    def pick(self) -> Backend:
+        """
+        为新会话选择后端
+
+        健康的后端中按策略选择；全部被摘除时选择最早恢复的后端。
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends.values() if b.is_healthy(now)]
+            if not candidates:
+                return min(self.backends.values(), key=lambda b: b.ejected_until)
+            if self.strategy == STRATEGY_EWMA:
+                return min(candidates, key=lambda b: (b.latency_ewma * (b.outstanding + 1), b.outstanding))
+            return min(candidates, key=lambda b: (b.outstanding, b.latency_ewma))
+
+    def open_session(self, title: str, deadline: Optional[Deadline] = None) -> Optional[Tuple[str, str]]:
+        """
+        在选出的后端上创建新会话
+
+        Returns:
+            (后端名, 会话ID)，创建失败或已超过 deadline 时返回 None
+        """
+        if expired(deadline):
+            return None
+        backend = self.pick()
+        session_id = self._call(backend, backend.client.create_session, chat_id=backend.chat_id, title=title,
+                                deadline=deadline)
+        if not session_id:
+            return None
+        return backend.name, session_id
+
+    def create_session(self, chat_id: Optional[str], title: str, backend: Optional[str] = None,
+                       deadline: Optional[Deadline] = None) -> Optional[str]:
+        """与 RagFlowClient.create_session 兼容的接口，在指定或选出的后端上创建会话"""
+        if expired(deadline):
+            return None
+        target = self.get(backend) if backend else self.pick()
+        return self._call(target, target.client.create_session, chat_id=chat_id or target.chat_id, title=title,
+                          deadline=deadline)
+
+    def send_message(self, question: str, session_id: Optional[str], chat_id: Optional[str] = None,
+                     stream: bool = False, timeout: int = 60, backend: Optional[str] = None,
+                     deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        发送消息，与 RagFlowClient.send_message 兼容
+
+        Args:
+            backend: 会话所在的后端名；未指定时，有会话ID则发往默认后端，否则按策略选择
+            deadline: 消息处理时限；剩余时间远小于 timeout 时发生的读取超时不计入后端的连续失败
+        """
+        if expired(deadline):
+            return {"content": "请求超时，请稍后再试。", "error": True, "timeout": True, "session_id": session_id}
+        if backend or session_id:
+            target = self.get(backend)
+            if target is None:
+                return {"content": f"RagFlow 后端不存在: {backend}", "error": True, "session_id": session_id}
+        else:
+            target = self.pick()
+        if target.limiter is not None and not target.limiter.acquire(deadline.remaining() if deadline else None):
+            logger.warning(f"RagFlow 后端 {target.name} 在途请求已达上限 {target.limiter.limit}")
+            return {"content": "RagFlow 繁忙，请稍后再试。", "error": True, "limited": True, "session_id": session_id}
+        budget_limited = deadline is not None and deadline.timeout(timeout) < timeout * NEUTRAL_TIMEOUT_FRACTION
+        return self._call(target, target.client.send_message, question=question, session_id=session_id,
+                          chat_id=chat_id or target.chat_id, stream=stream, timeout=timeout, deadline=deadline,
+                          _budget_limited=budget_limited, _limiter=target.limiter)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """获取各后端的状态"""
+        with self._lock:
+            return {name: backend.stats() for name, backend in self.backends.items()}
+
+    def _call(self, backend: Backend, func, _budget_limited: bool = False,
+              _limiter: Optional[AdaptiveLimiter] = None, **kwargs):
+        with self._lock:
+            backend.outstanding += 1
+        start = time.monotonic()
+        ok = False
+        result = None
+        try:
+            result = func(**kwargs)
+            ok = bool(result) and not (isinstance(result, dict) and result.get("error"))
+            return result
+        finally:
+            # 调用方剩余时间不足导致的读取超时不代表后端异常；连接超时始终计入
+            neutral = (not ok and _budget_limited and isinstance(result, dict) and result.get("timeout")
+                       and not result.get("connect_timeout"))
+            latency = time.monotonic() - start
+            self._record(backend, latency, ok, count_failure=not neutral)
+            if _limiter is not None:
+                _limiter.release(None if neutral else latency, not _overloaded(result))
+
+    def _record(self, backend: Backend, latency: float, ok: bool, count_failure: bool = True) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            if not count_failure:
+                return
+            if backend.latency_ewma:
+                backend.latency_ewma += self.latency_alpha * (latency - backend.latency_ewma)
+            else:
+                backend.latency_ewma = latency
+
+            if ok:
+                backend.consecutive_failures = 0
+                return
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.eject_after_failures:
+                # 不清零失败计数：恢复后的第一次请求再失败会立即重新摘除
+                backend.ejected_until = time.monotonic() + self.eject_seconds
+                logger.warning(f"RagFlow 后端 {backend.name} 连续失败，摘除 {self.eject_seconds} 秒")
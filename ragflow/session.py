@@ -1,13 +1,161 @@
+import sys
 import time
 import logging
-from typing import Dict, Any, Optional, List, Union
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Sequence
+from enum import Enum
+from typing import Callable, Dict, Any, Optional, List, Tuple, Union
+
+from ragflow.tokens import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
 
+class Role(str, Enum):
+    """消息角色"""
+    SYSTEM = "system"
+    USER = "user"
+    ASSISTANT = "assistant"
+
+
+_ROLES = tuple(Role)
+_ROLE_CODES = {role: code for code, role in enumerate(_ROLES)}
+_SYSTEM_CODE = _ROLE_CODES[Role.SYSTEM]
+
+
+class MessageStore:
+    """
+    紧凑的消息存储
+
+    消息以 [角色编码, 内容, 角色编码, 内容, ...] 的形式平铺在一个列表中，
+    角色编码为小整数（解释器内共享同一对象），不再为每条消息分配一个 dict。
+    按下标访问时才构造 {"role", "content"} 字典，以兼容原有的消息列表用法。
+
+    token 前缀和在第一次截断时才建立，之后随 append 增量维护，
+    空闲会话不需要为此付出内存。
+    """
+
+    __slots__ = ('_items', '_prefix')
+
+    def __init__(self):
+        self._items: List[Union[int, str]] = []
+        self._prefix: Optional[array] = None
+
+    def append(self, role: Union[Role, str], content: str) -> None:
+        """
+        追加一条消息
+
+        Args:
+            role: 消息角色
+            content: 消息内容
+        """
+        self._items += (_ROLE_CODES[Role(role)], content)
+        if self._prefix is not None:
+            self._prefix.append(self._prefix[-1] + estimate_tokens(content))
+
+    def role_at(self, index: int) -> Role:
+        """获取指定消息的角色"""
+        return _ROLES[self._items[self._offset(index)]]
+
+    def content_at(self, index: int) -> str:
+        """获取指定消息的内容"""
+        return self._items[self._offset(index) + 1]
+
+    def clear(self) -> None:
+        """清空所有消息"""
+        self._items.clear()
+        self._prefix = None
+
+    def token_prefix(self) -> array:
+        """
+        获取token前缀和，prefix[i] 为前 i 条消息的token总数
+
+        Returns:
+            长度为消息数+1的前缀和数组
+        """
+        if self._prefix is None:
+            prefix = array('q', [0])
+            total = 0
+            for offset in range(1, len(self._items), 2):
+                total += estimate_tokens(self._items[offset])
+                prefix.append(total)
+            self._prefix = prefix
+        return self._prefix
+
+    def total_tokens(self) -> int:
+        """获取所有消息的token总数"""
+        return self.token_prefix()[-1]
+
+    def leading_system_count(self) -> int:
+        """获取开头连续的系统消息数"""
+        items = self._items
+        count = 0
+        while (count << 1) < len(items) and items[count << 1] == _SYSTEM_CODE:
+            count += 1
+        return count
+
+    def _offset(self, index: int) -> int:
+        size = len(self._items) >> 1
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("message index out of range")
+        return index << 1
+
+    def __len__(self) -> int:
+        return len(self._items) >> 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        offset = self._offset(index)
+        return {"role": _ROLES[self._items[offset]].value, "content": self._items[offset + 1]}
+
+    def __iter__(self):
+        items = self._items
+        for offset in range(0, len(items), 2):
+            yield {"role": _ROLES[items[offset]].value, "content": items[offset + 1]}
+
+
+class MessageView(Sequence):
+    """
+    消息存储的只读视图
+
+    由开头的 head 条消息和从 start 开始的其余消息组成，不复制消息本身。
+    """
+
+    __slots__ = ('_store', '_head', '_start', '_stop')
+
+    def __init__(self, store: MessageStore, head: int, start: int):
+        self._store = store
+        self._head = head
+        self._start = start
+        self._stop = len(store)
+
+    def __len__(self) -> int:
+        return self._head + self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("message index out of range")
+        if index >= self._head:
+            index += self._start - self._head
+        return self._store[index]
+
+
 class Session:
     """基础会话类"""
 
+    __slots__ = ('session_id', 'system_prompt', 'messages')
+
     def __init__(self, session_id: str, system_prompt: Optional[str] = None):
         """
         初始化会话
@@ -17,14 +165,15 @@ class Session:
             system_prompt: 系统提示
         """
         self.session_id = session_id
-        self.system_prompt = system_prompt
-        self.messages = []
+        # 系统提示通常在所有会话间相同，驻留后只保留一份
+        self.system_prompt = sys.intern(system_prompt) if system_prompt else system_prompt
+        self.messages = MessageStore()
 
         # 如果有系统提示，添加为第一条消息
         if system_prompt:
-            self.messages.append({"role": "system", "content": system_prompt})
+            self.messages.append(Role.SYSTEM, self.system_prompt)
 
-    def add_message(self, role: str, content: str) -> None:
+    def add_message(self, role: Union[Role, str], content: str) -> None:
         """
         添加消息到会话
 
@@ -32,23 +181,53 @@ class Session:
             role: 消息角色 (user/assistant)
             content: 消息内容
         """
-        self.messages.append({"role": role, "content": content})
+        self.messages.append(role, content)
 
     def get_messages(self) -> List[Dict[str, str]]:
         """获取所有消息"""
-        return self.messages
+        return list(self.messages)
+
+    def truncate(self, max_tokens: int) -> MessageView:
+        """
+        截断消息，使其不超过最大token数
+
+        保留开头的系统消息，并从最新的消息开始尽可能多地包含其余消息。
+        使用缓存的token前缀和二分查找截断点，复杂度为 O(log n)。
+
+        Args:
+            max_tokens: 最大token数
+
+        Returns:
+            截断后的消息视图
+        """
+        store = self.messages
+        prefix = store.token_prefix()
+        size = len(store)
+        head = store.leading_system_count()
+
+        remaining = max_tokens - prefix[head]
+        if remaining <= 0:
+            logger.warning("系统消息已超过最大token数，无法包含其他消息")
+            return MessageView(store, head, size)
+
+        # 找到最小的 start，使 start 之后的消息总数不超过 remaining
+        start = max(bisect_left(prefix, prefix[size] - remaining, head, size + 1), head)
+        if start > head:
+            logger.info(f"消息已截断，原始消息数: {size}，截断后: {head + size - start}")
+        return MessageView(store, head, start)
 
     def reset(self) -> None:
         """重置会话，保留系统提示"""
+        self.messages.clear()
         if self.system_prompt:
-            self.messages = [{"role": "system", "content": self.system_prompt}]
-        else:
-            self.messages = []
+            self.messages.append(Role.SYSTEM, self.system_prompt)
 
 
 class RagFlowSession(Session):
     """RagFlow会话类"""
 
+    __slots__ = ('ragflow_chat_id', 'ragflow_session_id', 'custom_title_set', 'created_at', 'last_active')
+
     def __init__(self, session_id: str, system_prompt: Optional[str] = None,
                  ragflow_chat_id: Optional[str] = None):
         """
@@ -63,8 +242,8 @@ class RagFlowSession(Session):
         self.ragflow_chat_id = ragflow_chat_id
         self.ragflow_session_id = None
         self.custom_title_set = False
-        self.created_at = time.time()
-        self.last_active = time.time()
+        # 创建时两个时间戳共用同一个 float 对象
+        self.created_at = self.last_active = time.time()
 
     def set_ragflow_session(self, session_id: str, title_was_set: bool = True) -> None:
         """
@@ -103,17 +282,30 @@ class RagFlowSession(Session):
 
 
 class SessionManager:
-    """会话管理器"""
+    """
+    会话管理器
+
+    会话按最后活动时间保存在 OrderedDict 中：每次访问都会把会话移到末尾，
+    因此最久未活动的会话总在头部。过期清理只需从头部弹出，直到遇到未过期的会话，
+    查找为 O(1)，清理为均摊 O(1)，不再在每次查找时扫描全部会话。
+    """
 
-    def __init__(self, expiry_seconds: int = 3600):
+    def __init__(self, expiry_seconds: int = 3600, sweep_batch: int = 64, session_factory=None):
         """
         初始化会话管理器
 
         Args:
             expiry_seconds: 会话过期时间（秒）
+            sweep_batch: 每次查找时顺带清理的最大过期会话数
+            session_factory: 创建会话的类或函数，参数与 RagFlowSession 相同，默认为 RagFlowSession
         """
-        self.sessions: Dict[str, RagFlowSession] = {}
+        self.sessions: "OrderedDict[str, RagFlowSession]" = OrderedDict()
         self.expiry_seconds = expiry_seconds
+        self.sweep_batch = sweep_batch
+        self.session_factory = session_factory or RagFlowSession
+        self._lock = threading.RLock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_stop = threading.Event()
         logger.info(f"会话管理器已初始化，会话过期时间: {expiry_seconds}秒")
 
     def get_session(self, session_id: str, system_prompt: Optional[str] = None,
@@ -129,18 +321,44 @@ class SessionManager:
         Returns:
             会话对象
         """
-        # 清理过期会话
-        self._cleanup_expired_sessions()
+        with self._lock:
+            # 增量清理头部的过期会话（最多 sweep_batch 个）
+            self._cleanup_expired_sessions(limit=self.sweep_batch)
 
-        # 如果会话不存在，创建新会话
-        if session_id not in self.sessions:
-            logger.info(f"创建新会话: {session_id}")
-            self.sessions[session_id] = RagFlowSession(session_id, system_prompt, ragflow_chat_id)
+            session = self.sessions.get(session_id)
+            if session is None:
+                logger.info(f"创建新会话: {session_id}")
+                session = self.session_factory(session_id, system_prompt, ragflow_chat_id)
+                self.sessions[session_id] = session
+            else:
+                self.sessions.move_to_end(session_id)
 
-        # 更新最后活动时间
-        self.sessions[session_id].update_last_active()
+            # 更新最后活动时间
+            session.update_last_active()
 
-        return self.sessions[session_id]
+            return session
+
+    def find_session(self, session_id: str) -> Optional[RagFlowSession]:
+        """
+        获取已存在的会话并更新最后活动时间，不存在或已过期时返回 None
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            会话对象
+        """
+        with self._lock:
+            self._cleanup_expired_sessions(limit=self.sweep_batch)
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            if session.is_expired(self.expiry_seconds):
+                del self.sessions[session_id]
+                return None
+            self.sessions.move_to_end(session_id)
+            session.update_last_active()
+            return session
 
     def clear_session(self, session_id: str) -> bool:
         """
@@ -152,25 +370,107 @@ class SessionManager:
         Returns:
             是否成功清除
         """
-        if session_id in self.sessions:
-            logger.info(f"清除会话: {session_id}")
-            del self.sessions[session_id]
+        with self._lock:
+            if self.sessions.pop(session_id, None) is not None:
+                logger.info(f"清除会话: {session_id}")
+                return True
+            return False
+
+    def update_session(self, session_id: str, update: Callable[[RagFlowSession], None]) -> bool:
+        """
+        在持有锁时修改已存在的会话，避免与并发的查找、清理交错
+
+        Args:
+            session_id: 会话ID
+            update: 接收会话对象的函数
+
+        Returns:
+            会话是否存在（不存在或已过期时不调用 update）
+        """
+        with self._lock:
+            session = self.find_session(session_id)
+            if session is None:
+                return False
+            update(session)
             return True
-        return False
+
+    def clear_prefix(self, prefix: str) -> int:
+        """
+        清除ID以 prefix 开头的所有会话
+
+        Returns:
+            清除的会话数
+        """
+        with self._lock:
+            keys = [key for key in self.sessions if key.startswith(prefix)]
+            for key in keys:
+                del self.sessions[key]
+        return len(keys)
+
+    def active_sessions(self) -> List[Tuple[str, RagFlowSession]]:
+        """
+        清理所有过期会话后，返回剩余会话的 (会话ID, 会话对象) 列表，按最后活动时间从早到晚排列
+        """
+        with self._lock:
+            self._cleanup_expired_sessions()
+            return list(self.sessions.items())
 
     def clear_all_sessions(self) -> None:
         """清除所有会话"""
         logger.info("清除所有会话")
-        self.sessions.clear()
+        with self._lock:
+            self.sessions.clear()
+
+    def start_background_cleanup(self, interval: float = 60.0) -> None:
+        """
+        启动后台清理线程，定期清除过期会话
 
-    def _cleanup_expired_sessions(self) -> None:
-        """清理过期会话"""
-        current_time = time.time()
-        expired_sessions = [
-            session_id for session_id, session in self.sessions.items()
-            if (current_time - session.last_active) > self.expiry_seconds
-        ]
+        Args:
+            interval: 清理间隔（秒）
+        """
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._sweeper_stop.clear()
+            self._sweeper = threading.Thread(
+                target=self._sweep_loop, args=(interval,), name="session-sweeper", daemon=True
+            )
+            self._sweeper.start()
+        logger.info(f"会话后台清理线程已启动，间隔: {interval}秒")
+
+    def stop_background_cleanup(self) -> None:
+        """停止后台清理线程"""
+        self._sweeper_stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+
+    def _sweep_loop(self, interval: float) -> None:
+        while not self._sweeper_stop.wait(interval):
+            # 分批清理，避免长时间持有锁阻塞查找
+            while True:
+                with self._lock:
+                    removed = self._cleanup_expired_sessions(limit=self.sweep_batch * 16)
+                if removed < self.sweep_batch * 16:
+                    break
+
+    def _cleanup_expired_sessions(self, limit: Optional[int] = None) -> int:
+        """
+        从头部清理过期会话
 
-        for session_id in expired_sessions:
+        Args:
+            limit: 本次最多清理的会话数，None 表示清理全部过期会话
+
+        Returns:
+            清理的会话数
+        """
+        deadline = time.time() - self.expiry_seconds
+        removed = 0
+        while self.sessions and (limit is None or removed < limit):
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_active >= deadline:
+                break
             logger.info(f"会话已过期，正在清除: {session_id}")
-            del self.sessions[session_id]
\ No newline at end of file
+            del self.sessions[session_id]
+            removed += 1
+        return removed
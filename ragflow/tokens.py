@@ -0,0 +1,211 @@
+"""
+Token数估算
+
+按字符类别分别计数后加权求和:
+- CJK表意文字：按字计数
+- 拉丁字母单词：按词计数，超过 WORD_CHARS 个字母的长词（URL 片段、base64 等）每 4 个字母多计 1 个
+- 数字：每连续3位计为一组
+- 标点符号：按个计数
+- emoji：按个计数
+- 其他文字（假名、谚文、西里尔字母等）：按字计数
+
+各类别的权重保存在随项目发布的 token_table.json 中，
+可用参考分词器的统计结果通过 calibrate() 重新拟合。
+"""
+import json
+import os
+import re
+import sys
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+TOKEN_TABLE_PATH = os.path.join(os.path.dirname(__file__), 'token_table.json')
+
+FEATURES = ('cjk', 'word', 'digit', 'punct', 'emoji', 'other')
+
+# 不超过该长度的拉丁字母单词计为 1 个单位，更长的单词按长度折算
+WORD_CHARS = 8
+
+# 超过该长度的字符串不进入缓存，避免整篇文档常驻内存
+MEMO_MAX_LENGTH = 4096
+
+_CJK_RE = re.compile(
+    r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002ebef\U00030000-\U0003134f]+'
+)
+_WORD_RE = re.compile(r'[A-Za-z\u00c0-\u024f]+')
+_DIGIT_RE = re.compile(r'[0-9]+')
+_EMOJI_RE = re.compile(r'[\U0001f000-\U0001faff\u2600-\u27bf\ufe0f\u200d]')
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def load_token_table(path: str = TOKEN_TABLE_PATH) -> Dict[str, float]:
+    """
+    加载各字符类别的token权重
+
+    Args:
+        path: 权重表路径
+
+    Returns:
+        类别到权重的映射
+    """
+    with open(path, encoding='utf-8') as f:
+        table = json.load(f)
+    return {feature: float(table['weights'][feature]) for feature in FEATURES}
+
+
+_weights = load_token_table()
+
+
+def count_features(text: str) -> Tuple[int, ...]:
+    """
+    统计文本中各字符类别的数量
+
+    Args:
+        text: 文本
+
+    Returns:
+        与 FEATURES 顺序一致的计数
+    """
+    cjk = sum(map(len, _CJK_RE.findall(text)))
+    words = _WORD_RE.findall(text)
+    word_chars = sum(map(len, words))
+    # 长度 <= WORD_CHARS 计为 1，之后每 4 个字母加 1，否则 'a' * 10000 只算作 1 个词
+    word_units = sum(max(1, (len(word) + 3) // 4 - WORD_CHARS // 4 + 1) for word in words)
+    digit_runs = _DIGIT_RE.findall(text)
+    digit_chars = sum(map(len, digit_runs))
+    digit_groups = sum((len(run) + 2) // 3 for run in digit_runs)
+    emoji = len(_EMOJI_RE.findall(text))
+    punct = len(_PUNCT_RE.findall(text)) - emoji
+    spaces = sum(map(len, _SPACE_RE.findall(text)))
+    other = len(text) - cjk - word_chars - digit_chars - emoji - punct - spaces
+    return cjk, word_units, digit_groups, punct, emoji, max(other, 0)
+
+
+def _estimate(text: str) -> int:
+    counts = count_features(text)
+    total = sum(_weights[feature] * count for feature, count in zip(FEATURES, counts))
+    # 向上取整，非空文本至少计为1个token
+    return max(int(-(-total // 1)), 1)
+
+
+_estimate_cached = lru_cache(maxsize=8192)(_estimate)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的token数
+    """
+    if not text:
+        return 0
+    if len(text) > MEMO_MAX_LENGTH:
+        return _estimate(text)
+    return _estimate_cached(text)
+
+
+def estimate_tokens_batch(texts: Sequence[str]) -> List[int]:
+    """
+    批量估算token数，相同的文本只计算一次
+
+    Args:
+        texts: 文本列表
+
+    Returns:
+        与输入顺序一致的token数列表
+    """
+    results: Dict[str, int] = {}
+    for text in texts:
+        if text not in results:
+            results[text] = estimate_tokens(text)
+    return [results[text] for text in texts]
+
+
+def set_weights(weights: Dict[str, float]) -> None:
+    """
+    替换当前使用的权重，并清空缓存
+
+    Args:
+        weights: 类别到权重的映射
+    """
+    global _weights
+    _weights = {feature: float(weights[feature]) for feature in FEATURES}
+    _estimate_cached.cache_clear()
+
+
+def calibrate(samples: Iterable[Tuple[str, int]]) -> Dict[str, float]:
+    """
+    用参考分词器的统计结果拟合各类别权重（最小二乘）
+
+    Args:
+        samples: (文本, 参考token数) 序列
+
+    Returns:
+        拟合得到的类别权重
+    """
+    size = len(FEATURES)
+    # 正规方程 (X^T X) w = X^T y，加一个很小的岭项避免某类别缺样本时矩阵奇异
+    xtx = [[1e-6 if i == j else 0.0 for j in range(size)] for i in range(size)]
+    xty = [0.0] * size
+    for text, tokens in samples:
+        x = count_features(text)
+        for i in range(size):
+            xty[i] += x[i] * tokens
+            for j in range(size):
+                xtx[i][j] += x[i] * x[j]
+
+    # 高斯消元求解
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(xtx[r][col]))
+        xtx[col], xtx[pivot] = xtx[pivot], xtx[col]
+        xty[col], xty[pivot] = xty[pivot], xty[col]
+        for row in range(size):
+            if row != col and xtx[row][col]:
+                factor = xtx[row][col] / xtx[col][col]
+                xtx[row] = [a - factor * b for a, b in zip(xtx[row], xtx[col])]
+                xty[row] -= factor * xty[col]
+
+    return {feature: round(max(xty[i] / xtx[i][i], 0.0), 4) for i, feature in enumerate(FEATURES)}
+
+
+def main(argv: List[str]) -> int:
+    """
+    根据参考分词器样本重新生成权重表
+
+    用法:
+        python -m ragflow.tokens samples.jsonl [reference_name]
+
+    samples.jsonl 每行形如 {"text": "...", "tokens": 12}
+    """
+    if not argv:
+        print(main.__doc__)
+        return 1
+
+    with open(argv[0], encoding='utf-8') as f:
+        samples = [(row['text'], int(row['tokens'])) for row in map(json.loads, f) if row]
+    weights = calibrate(samples)
+
+    with open(TOKEN_TABLE_PATH, encoding='utf-8') as f:
+        table = json.load(f)
+    table['weights'] = weights
+    table['samples'] = len(samples)
+    if len(argv) > 1:
+        table['reference'] = argv[1]
+    with open(TOKEN_TABLE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(table, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+    print(json.dumps(weights, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -5,6 +5,8 @@ import re
 import logging
 from typing import Dict, Any, List, Optional
 
+from ragflow.tokens import estimate_tokens
+
 logger = logging.getLogger(__name__)
 
 
@@ -47,15 +49,16 @@ def truncate_messages(messages: List[Dict[str, str]], max_tokens: int) -> List[D
     Returns:
         截断后的消息列表
     """
-    # 简单实现：假设每个字符占用1个token
-    # 实际应用中应使用更准确的token计数方法
+    # token数由 ragflow.tokens.estimate_tokens 按字符类别估算
 
     # 保留系统消息
-    system_messages = [msg for msg in messages if msg.get('role') == 'system']
-    other_messages = [msg for msg in messages if msg.get('role') != 'system']
+    system_messages = []
+    other_messages = []
+    for msg in messages:
+        (system_messages if msg.get('role') == 'system' else other_messages).append(msg)
 
     # 计算系统消息的token数
-    system_tokens = sum(len(msg.get('content', '')) for msg in system_messages)
+    system_tokens = sum(estimate_tokens(msg.get('content', '')) for msg in system_messages)
 
     # 计算剩余可用token数
     remaining_tokens = max_tokens - system_tokens
@@ -65,20 +68,119 @@ def truncate_messages(messages: List[Dict[str, str]], max_tokens: int) -> List[D
         logger.warning("系统消息已超过最大token数，无法包含其他消息")
         return system_messages
 
-    # 从最新的消息开始，尽可能多地包含消息
-    result = system_messages.copy()
-    token_count = system_tokens
-
-    for msg in reversed(other_messages):
-        msg_tokens = len(msg.get('content', ''))
-        if token_count + msg_tokens <= max_tokens:
-            result.insert(len(system_messages), msg)  # 插入到系统消息之后
-            token_count += msg_tokens
-        else:
+    # 从最新的消息开始向前累计，找到能保留的最早一条消息
+    start = len(other_messages)
+    while start > 0:
+        msg_tokens = estimate_tokens(other_messages[start - 1].get('content', ''))
+        if msg_tokens > remaining_tokens:
             break
+        remaining_tokens -= msg_tokens
+        start -= 1
+
+    # 一次性拼接，避免在循环中 insert 导致的二次复杂度
+    result = system_messages + other_messages[start:]
 
     # 如果截断了消息，记录日志
     if len(result) < len(messages):
         logger.info(f"消息已截断，原始消息数: {len(messages)}，截断后: {len(result)}")
 
-    return result
\ No newline at end of file
+    return result
+
+
+_SENTENCE_RE = re.compile(r'[^。！？!?；;\n]+[。！？!?；;\n]*')
+_TERM_RE = re.compile(r'[A-Za-z0-9]+|[一-鿿]')
+_QUESTION_MARKERS = ('?', '？', '吗', '什么', '怎么', '如何', '为什么', '哪', '多少', '能否', '是否')
+
+
+def _hard_cut(text: str, max_tokens: int) -> str:
+    """按token预算直接截断单个过长的句子"""
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def clamp_question(question: str, max_tokens: int, head_ratio: float = 0.4, tail_ratio: float = 0.3) -> str:
+    """
+    将超出预算的问题抽取式压缩到预算以内
+
+    保留开头和结尾的句子（通常包含背景与真正的问题），
+    再从中间按词频打分挑选关键句，最后按原顺序拼接。
+
+    Args:
+        question: 用户问题
+        max_tokens: token预算
+        head_ratio: 开头句子占用的预算比例
+        tail_ratio: 结尾句子占用的预算比例
+
+    Returns:
+        未超出预算时原样返回，否则返回压缩后的问题
+    """
+    if max_tokens <= 0 or estimate_tokens(question) <= max_tokens:
+        return question
+
+    sentences = [s.strip() for s in _SENTENCE_RE.findall(question) if s.strip()]
+    costs = [estimate_tokens(s) for s in sentences]
+    separator_cost = estimate_tokens("……")
+    budget = max_tokens
+    selected = set()
+    seen = set()
+
+    def take(index: int) -> bool:
+        nonlocal budget
+        if sentences[index] in seen:
+            # 重复的句子直接跳过，不占预算
+            return True
+        cost = costs[index] + separator_cost
+        if cost > budget:
+            return False
+        selected.add(index)
+        seen.add(sentences[index])
+        budget -= cost
+        return True
+
+    # 开头的句子
+    head_budget = max_tokens * head_ratio
+    for i in range(len(sentences)):
+        if max_tokens - budget >= head_budget or not take(i):
+            break
+
+    # 结尾的句子
+    tail_budget = max_tokens * tail_ratio
+    used_before_tail = max_tokens - budget
+    for i in range(len(sentences) - 1, -1, -1):
+        if (max_tokens - budget) - used_before_tail >= tail_budget or not take(i):
+            break
+
+    # 中间的关键句：与首尾句（背景与真正的问题）共享的词越多越重要，疑问句加权
+    anchor_terms = set(_TERM_RE.findall("".join(sentences[i] for i in selected).lower()))
+
+    def score(index: int) -> float:
+        terms = set(_TERM_RE.findall(sentences[index].lower()))
+        value = len(terms & anchor_terms) / (len(terms) or 1)
+        if any(marker in sentences[index] for marker in _QUESTION_MARKERS):
+            value += 1
+        return value
+
+    for i in sorted((i for i in range(len(sentences)) if i not in selected), key=score, reverse=True):
+        take(i)
+
+    if not selected:
+        # 第一句本身就超出预算，直接截断
+        return _hard_cut(sentences[0] if sentences else question, max_tokens)
+
+    parts = []
+    previous = -1
+    for i in sorted(selected):
+        if previous >= 0 and i != previous + 1:
+            parts.append("……")
+        parts.append(sentences[i])
+        previous = i
+    clamped = "".join(parts)
+
+    logger.info(f"问题已压缩，原始token数: {estimate_tokens(question)}，压缩后: {estimate_tokens(clamped)}")
+    return clamped
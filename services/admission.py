@@ -0,0 +1,166 @@
+"""
+准入控制（负载削减）
+
+在 RagFlow 变慢时限制同时处理的消息数和排队长度，并根据最近的处理耗时估算排队等待时间。
+超出限制的请求立即被拒绝并回复繁忙提示，保证已接纳的请求仍能满足延迟目标。
+排队中的请求由 PriorityScheduler 按优先级类别公平地分配空出的名额。
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from services.metrics import metrics
+from services.scheduler import PriorityScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class _Waiter:
+    """排队等待名额的请求"""
+
+    __slots__ = ('priority', 'enqueued_at', 'event', 'granted')
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    """基于在途数、队列长度和预计等待时间的准入控制器"""
+
+    def __init__(self, max_in_flight: int = 16, max_queue: int = 32, max_wait: float = 5.0,
+                 latency_alpha: float = 0.2, name: str = "admission",
+                 scheduler: Optional[PriorityScheduler] = None):
+        """
+        初始化准入控制器
+
+        Args:
+            max_in_flight: 最大同时处理数
+            max_queue: 最大排队数
+            max_wait: 允许的最长排队等待时间（秒），预计或实际超过时拒绝
+            latency_alpha: 处理耗时指数移动平均的平滑系数
+            name: 指标名前缀
+            scheduler: 排队请求的优先级调度器，默认使用内置权重
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.latency_alpha = latency_alpha
+        self.name = name
+        self.scheduler = scheduler or PriorityScheduler()
+        self.in_flight = 0
+        self.latency_ewma = 0.0
+        self._lock = threading.Lock()
+        metrics.register_gauge(f"{name}_in_flight", lambda: self.in_flight)
+        metrics.register_gauge(f"{name}_queued", lambda: len(self.scheduler))
+        metrics.register_gauge(f"{name}_latency_ewma_ms", lambda: round(self.latency_ewma * 1000, 1))
+
+    @property
+    def queued(self) -> int:
+        """当前排队数"""
+        return len(self.scheduler)
+
+    def estimated_wait(self) -> float:
+        """根据排队数和最近的平均处理耗时估算新请求的等待时间（秒）"""
+        return (self.queued + 1) * self.latency_ewma / self.max_in_flight
+
+    def try_acquire(self, priority: Optional[str] = None, max_wait: Optional[float] = None) -> bool:
+        """
+        尝试获取处理名额，必要时按优先级排队等待
+
+        Args:
+            priority: 优先级类别，见 services.scheduler
+            max_wait: 本次请求允许的最长排队时间（秒），如消息剩余的处理时限；不超过配置的 max_wait
+
+        Returns:
+            是否被接纳；返回 False 时调用方应立即回复繁忙提示
+        """
+        wait_limit = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self.queued:
+                self.in_flight += 1
+                return True
+
+            if self.queued >= self.max_queue:
+                return self._shed("queue_full", priority)
+            if self.estimated_wait() > wait_limit:
+                return self._shed("wait_estimate", priority)
+
+            waiter = _Waiter(self.scheduler.resolve(priority))
+            self.scheduler.push(waiter, waiter.priority)
+
+        waiter.event.wait(wait_limit)
+
+        with self._lock:
+            # 名额由 release 直接转交给 waiter，granted 在锁内设置
+            if waiter.granted:
+                return True
+            self.scheduler.remove(waiter, waiter.priority)
+            return self._shed("wait_timeout", priority)
+
+    def release(self, latency: Optional[float] = None) -> None:
+        """
+        归还处理名额，有排队请求时直接转交给调度器选出的下一个
+
+        Args:
+            latency: 本次处理耗时（秒），用于更新平均耗时
+        """
+        with self._lock:
+            if latency is not None:
+                if self.latency_ewma:
+                    self.latency_ewma += self.latency_alpha * (latency - self.latency_ewma)
+                else:
+                    self.latency_ewma = latency
+
+            waiter = self.scheduler.pop()
+            if waiter is None:
+                self.in_flight -= 1
+                return
+            waiter.granted = True
+            waiter.event.set()
+            metrics.observe(f"{self.name}_wait_{waiter.priority}", time.monotonic() - waiter.enqueued_at)
+
+    @contextmanager
+    def admit(self, priority: Optional[str] = None, max_wait: Optional[float] = None) -> Iterator[bool]:
+        """
+        以上下文管理器的方式使用准入控制
+
+            with controller.admit(priority) as admitted:
+                if not admitted:
+                    return busy_reply
+                ...
+        """
+        start = time.monotonic()
+        if not self.try_acquire(priority, max_wait):
+            yield False
+            return
+        admitted_at = time.monotonic()
+        try:
+            yield True
+        finally:
+            now = time.monotonic()
+            self.release(now - admitted_at)
+            # 按类别记录从到达到处理完成的总耗时
+            metrics.observe(f"{self.name}_latency_{self.scheduler.resolve(priority)}", now - start)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取当前状态"""
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "latency_ewma_ms": round(self.latency_ewma * 1000, 1),
+                "estimated_wait_ms": round(self.estimated_wait() * 1000, 1),
+            }
+
+    def _shed(self, reason: str, priority: Optional[str] = None) -> bool:
+        metrics.incr(f"{self.name}_shed")
+        metrics.incr(f"{self.name}_shed_{reason}")
+        metrics.incr(f"{self.name}_shed_{self.scheduler.resolve(priority)}")
+        logger.warning(f"负载过高，拒绝处理 ({reason})，在途: {self.in_flight}，排队: {self.queued}，"
+                       f"平均耗时: {self.latency_ewma * 1000:.0f}ms")
+        return False
@@ -0,0 +1,271 @@
+"""
+对话归档
+
+每轮问答提交到内存中的定长缓冲区后立即返回，后台线程按批写入 SQLite（WAL 模式，每批一个事务）
+或按大小轮转的 JSONL 文件，磁盘 I/O 不在消息处理路径上。
+缓冲区满时按策略丢弃新记录 (drop) 或等待至多 block_timeout 秒 (block)；进程退出时写完缓冲区中的记录。
+写入失败时关闭写入器，按指数退避重试同一批记录，重试 max_retries 次仍失败才丢弃。
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from ragflow import codec
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+POLICY_DROP = "drop"
+POLICY_BLOCK = "block"
+
+# 丢弃记录时警告日志的最短间隔（秒）
+DROP_LOG_INTERVAL = 60.0
+
+ARCHIVE_FIELDS = ("ts", "session_key", "ragflow_session_id", "question", "answer", "error", "latency_ms")
+
+
+class SQLiteArchiveWriter:
+    """写入 SQLite 数据库（WAL 模式）"""
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        """
+        Args:
+            path: 数据库文件路径
+            busy_timeout: 数据库被其他连接锁定时的最长等待时间（秒）
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # 连接只在后台写入线程中创建和使用
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY, ts REAL, session_key TEXT, ragflow_session_id TEXT, "
+            "question TEXT, answer TEXT, error INTEGER, latency_ms REAL)"
+        )
+        return conn
+
+    def write_batch(self, records: List[Dict[str, Any]]) -> None:
+        if self._conn is None:
+            self._conn = self._connect()
+        rows = [tuple(record.get(field) for field in ARCHIVE_FIELDS) for record in records]
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                f"INSERT INTO messages ({', '.join(ARCHIVE_FIELDS)}) VALUES ({', '.join('?' * len(ARCHIVE_FIELDS))})",
+                rows
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class JSONLArchiveWriter:
+    """写入 JSONL 文件，超过 max_bytes 时轮转到新文件"""
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024, prefix: str = "archive"):
+        """
+        Args:
+            directory: 归档目录
+            max_bytes: 单个文件的最大字节数
+            prefix: 文件名前缀，文件名形如 archive-20240518-120000-<pid>-1.jsonl，
+                多个 gunicorn worker 写入同一目录时按进程号区分
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self._file = None
+        self._size = 0
+        self._seq = 0
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._seq += 1
+        name = f"{self.prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._seq}.jsonl"
+        self._file = open(os.path.join(self.directory, name), "ab")
+        self._size = self._file.tell()
+
+    def write_batch(self, records: List[Dict[str, Any]]) -> None:
+        if self._file is None or self._size >= self.max_bytes:
+            self.close()
+            self._open()
+        data = b"".join(codec.dumps(record) + b"\n" for record in records)
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ArchiveSink:
+    """定长缓冲区 + 后台批量写入"""
+
+    def __init__(self, writer, capacity: int = 10000, policy: str = POLICY_BLOCK, batch_size: int = 500,
+                 flush_interval: float = 1.0, block_timeout: float = 1.0, max_retries: int = 3,
+                 retry_backoff: float = 0.5):
+        """
+        初始化归档
+
+        Args:
+            writer: SQLiteArchiveWriter 或 JSONLArchiveWriter
+            capacity: 缓冲区最多容纳的记录数
+            policy: 缓冲区满时的策略，drop 丢弃新记录，block 等待至多 block_timeout 秒后丢弃
+            batch_size: 每批写入的最大记录数
+            flush_interval: 缓冲区未攒满一批时，最长等待该时间（秒）后写入
+            block_timeout: block 策略下的最长等待时间（秒）
+            max_retries: 一批记录写入失败后的最多重试次数
+            retry_backoff: 第一次重试前的等待时间（秒），之后每次翻倍
+        """
+        self.writer = writer
+        self.capacity = capacity
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self._thread = None
+        self._dropped = 0
+        self._next_drop_log = 0.0
+        metrics.register_gauge("archive_queued", lambda: len(self._buffer))
+
+    def submit(self, record: Dict[str, Any]) -> bool:
+        """
+        提交一条记录
+
+        Returns:
+            是否已放入缓冲区（缓冲区满被丢弃或已关闭时为 False）
+        """
+        with self._lock:
+            if len(self._buffer) >= self.capacity and self.policy == POLICY_BLOCK and not self._closed:
+                deadline = time.monotonic() + self.block_timeout
+                while len(self._buffer) >= self.capacity and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._not_full.wait(remaining):
+                        break
+            if self._closed or len(self._buffer) >= self.capacity:
+                metrics.incr("archive_dropped")
+                self._dropped += 1
+                now = time.monotonic()
+                if now >= self._next_drop_log:
+                    # 限制日志频率，缓冲区持续满时每 DROP_LOG_INTERVAL 秒记录一次
+                    logger.warning(f"归档{'已关闭' if self._closed else '缓冲区已满'}，"
+                                   f"累计丢弃 {self._dropped} 条记录")
+                    self._next_drop_log = now + DROP_LOG_INTERVAL
+                return False
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._not_empty.notify()
+        return True
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            if len(self._buffer) < self.batch_size and not self._closed:
+                self._not_empty.wait(self.flush_interval)
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        start = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.writer.write_batch(batch)
+                metrics.incr("archive_written", len(batch))
+                break
+            except Exception as e:
+                # 关闭后下一次写入重新打开连接或文件
+                try:
+                    self.writer.close()
+                except Exception:
+                    pass
+                if attempt >= self.max_retries:
+                    metrics.incr("archive_failed", len(batch))
+                    logger.error(f"写入归档失败，已重试 {self.max_retries} 次，丢弃 {len(batch)} 条记录: {e}",
+                                 exc_info=True)
+                    break
+                delay = self.retry_backoff * 2 ** attempt
+                metrics.incr("archive_retried")
+                logger.warning(f"写入归档失败，{delay:.1f} 秒后重试: {e}")
+                time.sleep(delay)
+        metrics.observe("archive_batch", time.monotonic() - start)
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+            elif self._closed:
+                break
+        self.writer.close()
+
+    def start(self) -> 'ArchiveSink':
+        """启动后台写入线程，并在进程退出时写完缓冲区"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="archive-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """停止接收新记录，写完缓冲区中的记录后关闭"""
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def create_archive(config) -> Optional[ArchiveSink]:
+    """
+    根据配置创建并启动归档，ARCHIVE_BACKEND 为空时返回 None
+    """
+    backend = config.get('ARCHIVE_BACKEND', '')
+    if not backend:
+        return None
+    path = config.get('ARCHIVE_PATH', 'archive')
+    if backend == 'sqlite':
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        writer = SQLiteArchiveWriter(path, busy_timeout=config.get('ARCHIVE_BUSY_TIMEOUT', 5.0))
+    elif backend == 'jsonl':
+        writer = JSONLArchiveWriter(path, max_bytes=config.get('ARCHIVE_MAX_BYTES', 64 * 1024 * 1024))
+    else:
+        raise ValueError(f"未知的归档后端: {backend}")
+
+    logger.info(f"对话归档已启用: {backend} -> {path}")
+    return ArchiveSink(
+        writer,
+        capacity=config.get('ARCHIVE_CAPACITY', 10000),
+        policy=config.get('ARCHIVE_POLICY', POLICY_BLOCK),
+        batch_size=config.get('ARCHIVE_BATCH_SIZE', 500),
+        flush_interval=config.get('ARCHIVE_FLUSH_INTERVAL', 1.0),
+        max_retries=config.get('ARCHIVE_MAX_RETRIES', 3),
+        retry_backoff=config.get('ARCHIVE_RETRY_BACKOFF', 0.5)
+    ).start()
@@ -0,0 +1,182 @@
+"""
+批量问答
+
+将一批问题以有限并发发送到 RagFlow，按完成顺序逐条产出结果，
+用于知识库的离线评估和夜间回归检查。
+
+命令行用法:
+    python -m services.batch_service questions.jsonl [-o results.jsonl] [-c 16]
+
+输入每行形如 {"id": "q1", "question": "...", "session_id": "可选"}，
+输出每行形如 {"id": "q1", "index": 0, "question": "...", "answer": "...", "error": false, "latency_ms": 812.3}。
+"""
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TextIO
+
+from ragflow import codec
+from ragflow.client import RagFlowClient
+
+logger = logging.getLogger(__name__)
+
+
+def parse_jsonl(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    解析 JSONL 格式的问题，跳过空行，无法解析的行以及不是对象或字符串的行作为错误项产出
+
+    Args:
+        lines: 文本行
+
+    Returns:
+        问题字典的迭代器
+    """
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = codec.loads(line)
+        except codec.JSONDecodeError as e:
+            item = {"id": f"line-{line_no}", "invalid": f"JSON 解析失败: {e}"}
+        if isinstance(item, str):
+            item = {"question": item}
+        elif not isinstance(item, dict):
+            item = {"id": f"line-{line_no}", "invalid": f"每行应为 JSON 对象或字符串，实际为 {type(item).__name__}"}
+        yield item
+
+
+def run_batch(ask: Callable[[Dict[str, Any]], Dict[str, Any]],
+              items: Iterable[Dict[str, Any]],
+              concurrency: int = 8) -> Iterator[Dict[str, Any]]:
+    """
+    以有限并发执行一批问题，按完成顺序产出结果
+
+    输入是惰性读取的，任一时刻最多只有 concurrency 个问题在处理中，
+    因此内存占用与批量大小无关。
+
+    Args:
+        ask: 处理单个问题的函数，返回包含 content/error 的字典
+        items: 问题字典的可迭代对象
+        concurrency: 最大并发数
+
+    Returns:
+        结果字典的迭代器
+    """
+    concurrency = max(1, concurrency)
+    source = enumerate(items)
+
+    def timed(index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        if not isinstance(item, dict):
+            item = {"invalid": f"问题应为 JSON 对象，实际为 {type(item).__name__}"}
+        question = item.get("question", "")
+        start = time.perf_counter()
+        if item.get("invalid"):
+            result = {"content": item["invalid"], "error": True}
+        elif not isinstance(question, str):
+            result = {"content": "question 必须为字符串", "error": True}
+        elif not question:
+            result = {"content": "question 不能为空", "error": True}
+        else:
+            try:
+                result = ask(item)
+            except Exception as e:
+                logger.error(f"批量问答第 {index} 项处理失败: {e}", exc_info=True)
+                result = {"content": f"处理失败: {e}", "error": True}
+        return {
+            "id": item.get("id", index),
+            "index": index,
+            "question": question,
+            "answer": result.get("content", ""),
+            "error": bool(result.get("error", False)),
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        pending = set()
+        for index, item in source:
+            pending.add(executor.submit(timed, index, item))
+            if len(pending) >= concurrency:
+                break
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                # 每完成一个就补充一个，保持并发数
+                next_item = next(source, None)
+                if next_item is not None:
+                    pending.add(executor.submit(timed, *next_item))
+
+
+def ragflow_asker(client: RagFlowClient, chat_id: Optional[str] = None) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    构造直接调用 RagFlowClient.send_message 的处理函数
+
+    未指定 session_id 的问题由 RagFlow 自动创建独立会话，互不影响。
+
+    Args:
+        client: RagFlow客户端
+        chat_id: 聊天ID，为None时使用客户端默认值
+
+    Returns:
+        处理单个问题的函数
+    """
+    def ask(item: Dict[str, Any]) -> Dict[str, Any]:
+        return client.send_message(
+            question=item["question"],
+            session_id=item.get("session_id"),
+            chat_id=item.get("chat_id") or chat_id
+        )
+    return ask
+
+
+def write_jsonl(results: Iterable[Dict[str, Any]], out: TextIO) -> Dict[str, int]:
+    """
+    将结果逐行写出并实时刷新
+
+    Returns:
+        总数与失败数
+    """
+    stats = {"total": 0, "errors": 0}
+    for result in results:
+        out.write(codec.dumps_str(result) + "\n")
+        out.flush()
+        stats["total"] += 1
+        stats["errors"] += int(result["error"])
+    return stats
+
+
+def main(argv=None) -> int:
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="批量向 RagFlow 提问，结果以 JSONL 按完成顺序输出")
+    parser.add_argument('input', help="问题文件 (JSONL)，'-' 表示标准输入")
+    parser.add_argument('-o', '--output', help="结果文件 (JSONL)，默认输出到标准输出")
+    parser.add_argument('-c', '--concurrency', type=int, default=Config.BATCH_CONCURRENCY)
+    parser.add_argument('--chat-id', default=None, help="RagFlow 聊天ID，默认使用配置中的 RAGFLOW_CHAT_ID")
+    args = parser.parse_args(argv)
+
+    client = RagFlowClient(Config.RAGFLOW_API_KEY, Config.RAGFLOW_API_BASE, Config.RAGFLOW_CHAT_ID)
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    out = sys.stdout if not args.output else open(args.output, 'w', encoding='utf-8')
+
+    start = time.perf_counter()
+    try:
+        stats = write_jsonl(run_batch(ragflow_asker(client, args.chat_id), parse_jsonl(source), args.concurrency), out)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"完成 {stats['total']} 个问题，失败 {stats['errors']} 个，耗时 {elapsed:.1f} 秒", file=sys.stderr)
+    return 0 if stats['errors'] == 0 else 1
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
@@ -1,94 +1,259 @@
+import hashlib
 import logging
+import time
+from typing import Optional
 import redis  # 引入redis
 
-from ragflow.client import RagFlowClient
+from ragflow.deadline import expired
+from ragflow.router import RagFlowRouter
+from ragflow.tokens import estimate_tokens
+from ragflow.utils import clamp_question
+from services.archive import create_archive
+from services.conversation_mirror import ConversationMirror, HISTORY_PREFIX
+from services.metrics import metrics
+from services.session_pool import SessionPool
+from services.session_record import SessionRecord
+from services.session_store import RedisHealth, create_session_store, REDIS_DOWN_ERRORS
 
-# SessionManager 和 RagFlowSession 在此场景下可能不再直接用于微信会话管理，
-# 因为我们将直接用 Redis 存储 wxid -> ragflow_session_id 的映射。
-# 但如果通用 /api/chat 接口仍需使用它们，则保留。
+# 微信与通用 /api/chat 接口都在 Redis 中为每个 key 保存一个会话记录哈希 (services.session_record)，
+# 两者只是 key 的命名空间不同。记录中的后端名保证会话始终发往创建它的 RagFlow 后端。
 
 logger = logging.getLogger(__name__)
 
+# 通用 /api/chat 接口会话在 Redis 中的前缀
+CHAT_SESSION_PREFIX = "chat_session:"
+# 微信回调去重标记在 Redis 中的前缀
+DEDUP_PREFIX = "wx_dedup:"
+# 生成轮换摘要时从对话镜像中读取的token预算（相对摘要预算的倍数）
+SUMMARY_SOURCE_FACTOR = 4
+
 
 class ChatService:
     def __init__(self, api_key, api_base, default_chat_id, session_expiry, max_tokens, fallback_reply,
-                 redis_config):  # 添加 redis_config
+                 redis_config, question_max_tokens=None, dedup_ttl=300, backends_json="",
+                 router_options=None, rotate_turns=0, rotate_tokens=0, session_pool_size=0,
+                 carry_summary=False, summary_tokens=200, history_max_messages=0,
+                 archive=None):  # 添加 redis_config
         """
         初始化聊天服务
+        question_max_tokens: 单条问题的token预算，默认为 max_tokens 的一半
+        dedup_ttl: 微信回调去重标记的有效期（秒）
+        backends_json: 多个 RagFlow 后端的 JSON 配置，为空时只使用 api_key/api_base/default_chat_id
+        router_options: 传给 RagFlowRouter 的选项 (strategy, eject_after_failures, eject_seconds, limiter_options)
+        rotate_turns/rotate_tokens: 会话轮次或累计估算token数达到该值时轮换到新的 RagFlow 会话，0 表示不限制
+        session_pool_size: 每个后端预创建的会话数，0 表示不预创建
+        carry_summary: 轮换时是否将最近几轮问答的抽取式摘要带入新会话
+        summary_tokens: 带入摘要的token预算
+        history_max_messages: 对话镜像中每个会话保留的消息数，0 表示不记录
+        archive: 对话归档 (services.archive.ArchiveSink)，为 None 时不归档
         """
-        self.ragflow_client = RagFlowClient(api_key, api_base, default_chat_id)
+        self.ragflow_client = RagFlowRouter.from_config(api_key, api_base, default_chat_id, backends_json,
+                                                        **(router_options or {}))
+        metrics.register_gauge("ragflow_backends", self.ragflow_client.stats)
         self.default_chat_id = default_chat_id
-        # self.session_manager = SessionManager(expiry_seconds=session_expiry) # 通用 session 管理器
         self.max_tokens = max_tokens
+        self.question_max_tokens = question_max_tokens if question_max_tokens is not None else max_tokens // 2
         self.fallback_reply = fallback_reply
         self.ragflow_session_expiry_redis = redis_config.get('RAGFLOW_SESSION_EXPIRY_REDIS', 3600)
-
-        # 初始化 Redis 客户端
+        self.dedup_ttl = dedup_ttl
+        self.rotate_turns = rotate_turns
+        self.rotate_tokens = rotate_tokens
+        self.carry_summary = carry_summary
+        self.summary_tokens = summary_tokens
+        self.archive = archive
+
+        # 初始化 Redis 客户端：阻塞式连接池（连接用尽时等待而不是立即报错），带读写与连接超时、
+        # 空闲连接健康检查；启动时连不上也保留客户端，由 RedisHealth 定期探测，恢复后继续使用
+        socket_timeout = redis_config.get('REDIS_SOCKET_TIMEOUT', 5.0)
+        self.redis_client = redis.StrictRedis(connection_pool=redis.BlockingConnectionPool(
+            host=redis_config['REDIS_HOST'],
+            port=redis_config['REDIS_PORT'],
+            db=redis_config['REDIS_DB'],
+            password=redis_config['REDIS_PASSWORD'],
+            decode_responses=True,  # 重要：这样get出来的值是字符串而不是bytes
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=redis_config.get('REDIS_CONNECT_TIMEOUT', 1.0),
+            health_check_interval=redis_config.get('REDIS_HEALTH_CHECK_INTERVAL', 15),
+            max_connections=redis_config.get('REDIS_MAX_CONNECTIONS', 64),
+            timeout=socket_timeout
+        ))
+        self.redis_health = RedisHealth(self.redis_client, redis_config.get('REDIS_RETRY_INTERVAL', 5.0))
         try:
-            self.redis_client = redis.StrictRedis(
-                host=redis_config['REDIS_HOST'],
-                port=redis_config['REDIS_PORT'],
-                db=redis_config['REDIS_DB'],
-                password=redis_config['REDIS_PASSWORD'],
-                decode_responses=True  # 重要：这样get出来的值是字符串而不是bytes
-            )
             self.redis_client.ping()  # 测试连接
             logger.info("成功连接到 Redis")
-        except Exception as e:
+        except redis.RedisError as e:
             logger.error(f"连接 Redis 失败: {e}")
-            self.redis_client = None
+            self.redis_health.mark_down(e)
+
+        self.session_records = create_session_store(redis_config, self.redis_client, self.redis_health,
+                                                    self.ragflow_session_expiry_redis)
+        self.conversation_mirror = None
+        if history_max_messages > 0:
+            self.conversation_mirror = ConversationMirror(self.redis_client, history_max_messages,
+                                                          self.ragflow_session_expiry_redis)
+        self.session_pool = None
+        if session_pool_size > 0:
+            self.session_pool = SessionPool(self.ragflow_client, self.redis_client, session_pool_size,
+                                            redis_health=self.redis_health, ttl=self.ragflow_session_expiry_redis)
+            self.session_pool.start()
 
         # 不再使用 self.wxid_to_session 字典
         # self.wxid_to_session = {}
 
-        logger.info("聊天服务已初始化 (微信会话使用 Redis)")
+        logger.info(f"聊天服务已初始化，会话存储: {redis_config.get('SESSION_STORE') or 'redis'}")
 
-    def get_or_create_ragflow_session_for_wechat(self, session_key: str, title_prefix: str, is_group_user: bool):
+    @staticmethod
+    def _dedup_key(msg_data) -> Optional[str]:
         """
-        从 Redis 获取或创建 RagFlow 会话ID，并存储到 Redis。
-        session_key: 用于 Redis 存储的键 (如 finalFromWxid 或 fromWxid)
-        title_prefix: 用于创建新会话时的标题前缀 (如 "群聊用户" 或 "私聊")
-        is_group_user: 是否为群聊用户，用于生成标题
+        去重标记的键：优先使用 msgId，缺失时使用 发送方+内容+时间戳 的哈希；
+        两者都没有时返回 None（只凭发送方与内容无法区分重复投递和用户再次发送相同内容）
         """
-        if not self.redis_client:
-            logger.error("Redis 客户端未初始化，无法获取或创建会话")
-            return None
+        msg_id = msg_data.get('msgId')
+        if not msg_id:
+            if not (msg_data.get('timeStamp') or msg_data.get('timestamp')):
+                return None
+            raw = "\x1f".join(str(msg_data.get(field, '')) for field in
+                              ('fromWxid', 'finalFromWxid', 'msg', 'timeStamp', 'timestamp'))
+            msg_id = "h:" + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        return f"{DEDUP_PREFIX}{msg_id}"
 
-        # 尝试从 Redis 获取已存在的 RagFlow 会话ID
-        ragflow_session_id = self.redis_client.get(session_key)
+    def is_duplicate_message(self, msg_data) -> bool:
+        """
+        判断微信回调是否为重复投递 (SET NX，一次 Redis 往返)
+        没有 msgId 也没有时间戳的消息不做去重；Redis 不可用时不做去重，保证消息不被误丢。
+        处理失败时应调用 release_message 删除标记，让框架的重试得到处理。
+        """
+        key = self._dedup_key(msg_data)
+        if key is None or not self.redis_health.available():
+            return False
 
-        if ragflow_session_id:
-            logger.info(f"从 Redis 找到现有会话: {session_key} -> {ragflow_session_id}")
-            # 每次获取时刷新过期时间
-            self.redis_client.expire(session_key, self.ragflow_session_expiry_redis)
-            return ragflow_session_id
-        else:
-            # 创建新会话
-            if is_group_user:
-                title = f"{title_prefix} {session_key[:8]}"  # 使用 session_key (即 finalFromWxid)
+        try:
+            first_delivery = self.redis_client.set(key, 1, nx=True, ex=self.dedup_ttl)
+        except redis.RedisError as e:
+            if isinstance(e, REDIS_DOWN_ERRORS):
+                self.redis_health.mark_down(e)
+            logger.error(f"写入去重标记失败: {e}")
+            return False
+
+        if first_delivery:
+            return False
+        metrics.incr("webhook_duplicate")
+        logger.info(f"重复的微信回调，已忽略: {key}")
+        return True
+
+    def release_message(self, msg_data) -> None:
+        """删除去重标记，处理失败后框架重试投递的同一条消息不再被当作重复"""
+        key = self._dedup_key(msg_data)
+        if key is None or not self.redis_health.available():
+            return
+        try:
+            self.redis_client.delete(key)
+        except redis.RedisError as e:
+            logger.error(f"删除去重标记失败: {key}, {e}")
+
+    def get_or_create_ragflow_session(self, session_key: str, title: str):
+        """
+        从 Redis 获取或创建 RagFlow 会话ID，并存储到 Redis。
+        微信与通用 /api/chat 接口共用此路径，只是 session_key 的命名空间不同。
+        session_key: 用于 Redis 存储的键 (如 wx_session:private:<wxid> 或 chat_session:<session_id>)
+        title: 创建新会话时使用的标题
+        """
+        record = self._get_or_create_session_record(session_key, title)
+        return record.session_id if record else None
+
+    def _get_or_create_session_record(self, session_key: str, title: str, deadline=None):
+        """
+        获取或创建会话记录，失败时返回 None
+        已保存的会话所在后端被摘除或已从配置中移除时，在其他后端上重新创建会话。
+        deadline: 消息处理时限 (ragflow.deadline.Deadline)，创建会话时使用剩余时间作为超时
+        """
+        # 读取已存在的会话记录并刷新过期时间（Redis 为一次往返）
+        record = self.session_records.load(session_key)
+
+        carry_over = ""
+        if record:
+            if not self.ragflow_client.is_available(record.backend):
+                metrics.incr("ragflow_session_rehomed")
+                logger.warning(f"会话所在的 RagFlow 后端 {record.backend} 不可用，重新创建会话: {session_key}")
+            elif self._should_rotate(record):
+                metrics.incr("ragflow_session_rotated")
+                logger.info(f"会话已达到轮换阈值 (轮次 {record.turns}, token {record.tokens})，轮换: {session_key}")
+                if self.carry_summary:
+                    carry_over = self._summarize_recent(session_key)
             else:
-                title = f"{title_prefix} {session_key[:8]}"  # 使用 session_key (即 fromWxid)
+                logger.info(f"找到现有会话: {session_key} -> {record.session_id}@{record.backend}")
+                return record
 
-            new_ragflow_session_id = self.ragflow_client.create_session(
-                chat_id=self.default_chat_id,
-                title=title
-            )
+        # 优先使用预创建的会话，否则在选出的后端上创建新会话
+        opened = ((self.session_pool.take() if self.session_pool else None) or
+                  self.ragflow_client.open_session(title, deadline=deadline))
 
-            if not new_ragflow_session_id:
-                logger.error(f"创建 RagFlow 会话失败，Redis Key: {session_key}")
-                return None
+        if not opened:
+            logger.error(f"创建 RagFlow 会话失败，Redis Key: {session_key}")
+            return None
+
+        backend, new_ragflow_session_id = opened
+        now = time.time()
+        record = SessionRecord(session_id=new_ragflow_session_id, backend=backend, created_at=now, last_active=now,
+                               carry_over=carry_over)
+        # 保存会话记录，并设置过期时间
+        self.session_records.save(session_key, record)
+        logger.info(f"创建新 RagFlow 会话并保存: {session_key} -> {new_ragflow_session_id}@{backend}")
+        return record
+
+    def _should_rotate(self, record: SessionRecord) -> bool:
+        """会话的轮次或累计token数是否已达到轮换阈值"""
+        return ((self.rotate_turns > 0 and record.turns >= self.rotate_turns) or
+                (self.rotate_tokens > 0 and record.tokens >= self.rotate_tokens))
+
+    def _summarize_recent(self, session_key: str) -> str:
+        """将对话镜像中最近几轮问答压缩为不超过 summary_tokens 的抽取式摘要"""
+        if not self.conversation_mirror or not self.redis_health.available():
+            return ""
+        try:
+            messages = self.conversation_mirror.context(session_key, self.summary_tokens * SUMMARY_SOURCE_FACTOR)
+        except redis.RedisError as e:
+            logger.error(f"读取对话镜像失败: {session_key}, {e}")
+            return ""
+        if not messages:
+            return ""
+        labels = {"user": "问", "assistant": "答"}
+        text = "\n".join(f"{labels.get(msg.get('role'), msg.get('role'))}：{msg.get('content', '')}"
+                         for msg in messages)
+        return clamp_question(text, self.summary_tokens)
+
+    def get_or_create_ragflow_session_for_wechat(self, session_key: str, title_prefix: str, is_group_user: bool):
+        """
+        从 Redis 获取或创建微信用户的 RagFlow 会话ID。
+        session_key: 用于 Redis 存储的键 (如 finalFromWxid 或 fromWxid)
+        title_prefix: 用于创建新会话时的标题前缀 (如 "群聊用户" 或 "私聊")
+        is_group_user: 是否为群聊用户，用于生成标题
+        """
+        # 群聊用户与私聊目前使用相同的标题格式
+        title = f"{title_prefix} {session_key[:8]}"
+        return self.get_or_create_ragflow_session(session_key, title)
+
+    def clamp_question(self, question, session_key=""):
+        """
+        将超出预算的问题压缩到 question_max_tokens 以内，并记录指标
+        """
+        question_tokens = estimate_tokens(question)
+        if question_tokens <= self.question_max_tokens:
+            return question
 
-            # 保存到 Redis，并设置过期时间
-            self.redis_client.setex(session_key, self.ragflow_session_expiry_redis, new_ragflow_session_id)
-            logger.info(f"创建新 RagFlow 会话并存入 Redis: {session_key} -> {new_ragflow_session_id}")
-            return new_ragflow_session_id
+        clamped = clamp_question(question, self.question_max_tokens)
+        metrics.incr("question_clamped")
+        metrics.incr("question_clamped_tokens", question_tokens - estimate_tokens(clamped))
+        logger.warning(f"问题估算token数 {question_tokens} 超过预算 ({self.question_max_tokens})，已压缩。session_key: {session_key}")
+        return clamped
 
-    def process_wechat_message(self, question, from_wxid, final_from_wxid, is_group, context=None):
+    def process_wechat_message(self, question, from_wxid, final_from_wxid, is_group, context=None, deadline=None):
         """
         处理微信消息 (修改版)
         from_wxid: 对于私聊是对方wxid，对于群聊是群wxid
         final_from_wxid: 群聊中消息发送者的wxid，私聊中为空
         is_group: 是否为群聊
+        deadline: 消息处理时限 (ragflow.deadline.Deadline)，为 None 时不限时
         """
         if context is None:
             context = {}
@@ -119,27 +284,120 @@ class ChatService:
 
         logger.info(f"微信消息处理: session_key_for_redis='{session_key_for_redis}', is_group={is_group}")
 
-        ragflow_session_id = self.get_or_create_ragflow_session_for_wechat(
+        if expired(deadline):
+            return self._deadline_exceeded(session_key_for_redis, question)
+
+        # 群聊用户与私聊目前使用相同的标题格式
+        record = self._get_or_create_session_record(
             session_key_for_redis,
-            title_prefix_for_new_session,
-            is_group_user_session
+            f"{title_prefix_for_new_session} {session_key_for_redis[:8]}",
+            deadline=deadline
         )
 
-        if not ragflow_session_id:
+        if not record:
             return {
                 "content": "抱歉，创建或获取会话失败，请稍后再试。",
                 "error": True
             }
 
-        # 发送消息到RagFlow
+        return self._ask_ragflow(question, record, session_key_for_redis, deadline)
+
+    def process_message(self, question, session_id, user_id=None, context=None, deadline=None):
+        """
+        处理通用 /api/chat 接口的消息
+        会话映射与微信相同，存储在 Redis 的 chat_session:<session_id> 下。
+        session_id: 调用方提供的会话ID
+        user_id: 用户ID，仅用于生成会话标题
+        deadline: 消息处理时限 (ragflow.deadline.Deadline)，为 None 时不限时
+        """
+        session_key = f"{CHAT_SESSION_PREFIX}{session_id}"
+        logger.info(f"通用聊天消息处理: session_key='{session_key}', user_id={user_id}")
+
+        if expired(deadline):
+            return dict(self._deadline_exceeded(session_key, question), ragflow_session_id=None)
+
+        record = self._get_or_create_session_record(session_key, f"网页 {str(user_id or session_id)[:8]}",
+                                                    deadline=deadline)
+
+        if not record:
+            return {
+                "content": "抱歉，创建或获取会话失败，请稍后再试。",
+                "error": True,
+                "ragflow_session_id": None
+            }
+
+        return self._ask_ragflow(question, record, session_key, deadline)
+
+    def archive_reply(self, question, reply, session_key, error=False, ragflow_session_id=None, latency=0.0):
+        """
+        归档一轮问答；FAQ、繁忙提示、超时兜底等没有调用 RagFlow 的回复 ragflow_session_id 为空，延迟为 0
+        """
+        if not self.archive:
+            return
+        self.archive.submit({
+            "ts": time.time(),
+            "session_key": session_key,
+            "ragflow_session_id": ragflow_session_id,
+            "question": question,
+            "answer": reply,
+            "error": int(bool(error)),
+            "latency_ms": round(latency * 1000, 1),
+        })
+
+    def archive_wechat_reply(self, question, reply, from_wxid, final_from_wxid, is_group, error=False):
+        """归档没有经过 process_wechat_message 的微信回复，会话键与 process_wechat_message 相同"""
+        if is_group:
+            session_key = f"wx_session:group_user:{final_from_wxid}"
+        else:
+            session_key = f"wx_session:private:{from_wxid}"
+        self.archive_reply(question, reply, session_key, error=error)
+
+    def _deadline_exceeded(self, session_key, question):
+        """消息处理时限已过，不再访问 Redis 与 RagFlow，直接返回兜底回复"""
+        metrics.incr("deadline_exceeded")
+        logger.warning(f"消息处理已超过时限，跳过: {session_key}")
+        content = self.fallback_reply or "抱歉，我无法回答这个问题。"
+        self.archive_reply(question, content, session_key, error=True)
+        return {
+            "content": content,
+            "error": True,
+            "deadline_exceeded": True
+        }
+
+    def _ask_ragflow(self, question, record, session_key, deadline=None):
+        """
+        压缩问题后发送到会话所在的 RagFlow 后端，出错时返回兜底回复
+        成功时在会话记录中累计轮次、token 数并记录延迟。
+        record: 会话记录 (SessionRecord)
+        deadline: 消息处理时限，RagFlow 请求使用剩余时间作为超时
+        """
+        ragflow_session_id = record.session_id
+        if expired(deadline):
+            return dict(self._deadline_exceeded(session_key, question), ragflow_session_id=ragflow_session_id)
+
+        # 归档保存用户原始的问题，对话镜像与会话记录使用压缩后的问题
+        original = question
+        question = self.clamp_question(question, session_key)
+        asked = question
+        if record.carry_over:
+            # 轮换后的第一个问题带上之前对话的摘要
+            question = f"以下是之前对话的摘要，供参考：\n{record.carry_over}\n\n当前问题：{question}"
+
+        # 发送消息到RagFlow，chat_id 使用该后端的配置
+        start = time.monotonic()
         response = self.ragflow_client.send_message(
             question=question,
             session_id=ragflow_session_id,  # 使用从 Redis 获取或新创建的 RagFlow session ID
-            chat_id=self.default_chat_id
+            backend=record.backend,
+            deadline=deadline
         )
+        latency = time.monotonic() - start
+
+        self.archive_reply(original, response.get("content", ""), session_key, error=response.get("error"),
+                           ragflow_session_id=ragflow_session_id, latency=latency)
 
         if response.get("error"):
-            logger.error(f"RagFlow 响应错误: {response.get('error_message')}")
+            logger.error(f"RagFlow 响应错误: {response.get('content')}")
             # 即使出错，也返回 ragflow_session_id，因为会话可能已经建立
             return {
                 "content": self.fallback_reply or "抱歉，我无法回答这个问题。",
@@ -147,20 +405,47 @@ class ChatService:
                 "ragflow_session_id": ragflow_session_id
             }
 
+        content = response.get("content", "")
+        # 使用 Redis 时会话记录与对话镜像在同一个 pipeline 中写入（一次往返）；
+        # 其他存储返回的 pipeline 为 None，对话镜像使用自己的 pipeline 写入 Redis；Redis 降级期间不写对话镜像
+        try:
+            pipe = self.session_records.pipeline()
+            self.session_records.record_turn(session_key, estimate_tokens(question) + estimate_tokens(content),
+                                             latency, {"carry_over": ""} if record.carry_over else None, pipe=pipe)
+            if self.conversation_mirror and (pipe is not None or self.redis_health.available()):
+                self.conversation_mirror.append_turn(session_key, asked, content, pipe=pipe)
+            if pipe is not None:
+                pipe.execute()
+        except redis.RedisError as e:
+            if isinstance(e, REDIS_DOWN_ERRORS):
+                self.redis_health.mark_down(e)
+            logger.error(f"更新会话记录失败: {session_key}, {e}")
+
         return {
-            "content": response.get("content", ""),
+            "content": content,
             "error": False,
             "ragflow_session_id": ragflow_session_id
         }
 
+    def _clear_history(self, pattern: str) -> None:
+        """删除对话镜像（pattern 可以是单个会话键或以 * 结尾的前缀），Redis 不可用时跳过"""
+        if not self.redis_health.available():
+            return
+        try:
+            if pattern.endswith("*"):
+                for key in self.redis_client.scan_iter(f"{HISTORY_PREFIX}{pattern}"):
+                    self.redis_client.delete(key)
+            else:
+                self.redis_client.delete(f"{HISTORY_PREFIX}{pattern}")
+        except redis.RedisError as e:
+            if isinstance(e, REDIS_DOWN_ERRORS):
+                self.redis_health.mark_down(e)
+            logger.error(f"删除对话镜像失败: {pattern}, {e}")
+
     def clear_wechat_session(self, from_wxid, final_from_wxid, is_group):
         """
-        清除指定微信会话 (基于 Redis)
+        清除指定微信会话
         """
-        if not self.redis_client:
-            logger.error("Redis 客户端未初始化，无法清除会话")
-            return False
-
         session_key_to_clear = ""
         if is_group:
             if not final_from_wxid:
@@ -170,52 +455,92 @@ class ChatService:
         else:
             session_key_to_clear = f"wx_session:private:{from_wxid}"
 
-        if self.redis_client.exists(session_key_to_clear):
-            self.redis_client.delete(session_key_to_clear)
-            logger.info(f"已从 Redis 清除会话: {session_key_to_clear}")
+        self._clear_history(session_key_to_clear)
+        if self.session_records.delete(session_key_to_clear):
+            logger.info(f"已清除会话: {session_key_to_clear}")
             return True
         else:
-            logger.info(f"尝试清除的会话在 Redis 中不存在: {session_key_to_clear}")
+            logger.info(f"尝试清除的会话不存在: {session_key_to_clear}")
             return False
 
     def clear_all_wechat_sessions(self):
         """
-        清除所有微信相关的会话 (从 Redis 中，基于 "wx_session:" 前缀)
+        清除所有微信相关的会话 (基于 "wx_session:" 前缀)
         注意：这个操作可能比较耗时，取决于key的数量。
         """
-        if not self.redis_client:
-            logger.error("Redis 客户端未初始化，无法清除所有会话")
-            return
+        self._clear_history("wx_session:*")
+        count = self.session_records.delete_prefix("wx_session:")
+        logger.info(f"已清除所有 {count} 个微信会话 (前缀 wx_session:*)")
 
-        count = 0
-        # 使用 scan_iter 迭代匹配的key，避免一次性加载过多key导致阻塞
-        for key in self.redis_client.scan_iter("wx_session:*"):
-            self.redis_client.delete(key)
-            count += 1
-        logger.info(f"已从 Redis 清除所有 {count} 个微信会话 (前缀 wx_session:*)")
-
-    # --- 原有的通用 chat service 方法 ---
-    # 如果 /api/chat 接口仍然需要基于 SessionManager 的会话，
-    # 则 ChatService 中原有的 process_message, clear_session, clear_all_sessions 方法需要保留并适配。
-    # 但根据您的提问，主要关注的是微信 /receive 接口的会话。
-    # 以下是示例性的保留，如果您的 /api/chat 接口不再使用，可以移除或重构。
-    # def process_message(self, question, session_id, user_id, context):
-    #     """ 这是原来 /api/chat 接口调用的方法，如果它也需要改用Redis或保持原样，需明确 """
-    #     # ... 原有逻辑或修改后的逻辑 ...
-    #     logger.warning("通用 process_message 方法被调用，请确认其会话管理方式是否需要同步修改。")
-    #     # 这是一个占位，您需要根据 /api/chat 的具体需求实现
-    #     # 比如，它可能也需要一个 session_key_prefix (e.g., "generic_session:") 来存入 Redis
-    #     # 或者继续使用 self.session_manager
-    #     return {"content": "通用接口待处理", "error": True, "session_id": session_id}
-
-    # def clear_session(self, session_id: str) -> bool:
-    #    # 原 /api/sessions/{session_id} 调用的方法
-    #    # return self.session_manager.clear_session(session_id)
-    #    logger.warning("通用 clear_session 方法被调用，请确认其会话管理方式。")
-    #    return False # 占位
-
-    # def clear_all_sessions(self) -> None:
-    #    # 原 /api/sessions 调用的方法
-    #    # self.session_manager.clear_all_sessions()
-    #    logger.warning("通用 clear_all_sessions 方法被调用，请确认其会话管理方式。")
-    #    pass # 占位
+    def clear_session(self, session_id: str) -> bool:
+        """
+        清除通用 /api/chat 接口的会话
+        """
+        session_key = f"{CHAT_SESSION_PREFIX}{session_id}"
+        self._clear_history(session_key)
+        if self.session_records.delete(session_key):
+            logger.info(f"已清除会话: {session_key}")
+            return True
+        logger.info(f"尝试清除的会话不存在: {session_key}")
+        return False
+
+    def clear_all_sessions(self) -> None:
+        """
+        清除所有通用 /api/chat 接口的会话 (基于 "chat_session:" 前缀)
+        """
+        self._clear_history(f"{CHAT_SESSION_PREFIX}*")
+        count = self.session_records.delete_prefix(CHAT_SESSION_PREFIX)
+        logger.info(f"已清除所有 {count} 个通用会话 (前缀 {CHAT_SESSION_PREFIX}*)")
+
+
+def create_chat_service(config) -> ChatService:
+    """
+    根据配置 (Flask app.config 或其他映射) 创建聊天服务，供 Web 进程和独立 worker 共用
+    """
+    redis_config = {
+        'REDIS_HOST': config['REDIS_HOST'],
+        'REDIS_PORT': config['REDIS_PORT'],
+        'REDIS_DB': config['REDIS_DB'],
+        'REDIS_PASSWORD': config.get('REDIS_PASSWORD'),
+        'RAGFLOW_SESSION_EXPIRY_REDIS': config['RAGFLOW_SESSION_EXPIRY_REDIS'],
+        'REDIS_SOCKET_TIMEOUT': config.get('REDIS_SOCKET_TIMEOUT', 5.0),
+        'REDIS_CONNECT_TIMEOUT': config.get('REDIS_CONNECT_TIMEOUT', 1.0),
+        'REDIS_HEALTH_CHECK_INTERVAL': config.get('REDIS_HEALTH_CHECK_INTERVAL', 15),
+        'REDIS_MAX_CONNECTIONS': config.get('REDIS_MAX_CONNECTIONS', 64),
+        'REDIS_RETRY_INTERVAL': config.get('REDIS_RETRY_INTERVAL', 5.0),
+        'SESSION_STORE': config.get('SESSION_STORE', 'redis'),
+        'SESSION_STORE_PATH': config.get('SESSION_STORE_PATH', 'data/sessions.db')
+    }
+
+    return ChatService(
+        api_key=config['RAGFLOW_API_KEY'],
+        api_base=config['RAGFLOW_API_BASE'],
+        default_chat_id=config['RAGFLOW_CHAT_ID'],
+        session_expiry=config['SESSION_EXPIRY'],
+        max_tokens=config['MAX_TOKENS'],
+        fallback_reply=config['FALLBACK_REPLY'],
+        redis_config=redis_config,
+        question_max_tokens=config.get('QUESTION_MAX_TOKENS'),
+        dedup_ttl=config.get('WEBHOOK_DEDUP_TTL', 300),
+        backends_json=config.get('RAGFLOW_BACKENDS', ''),
+        router_options={
+            'strategy': config.get('RAGFLOW_BALANCER', 'least_outstanding'),
+            'eject_after_failures': config.get('RAGFLOW_EJECT_FAILURES', 3),
+            'eject_seconds': config.get('RAGFLOW_EJECT_SECONDS', 30.0),
+            'limiter_options': {
+                'algorithm': config['RAGFLOW_LIMITER'],
+                'initial_limit': config.get('RAGFLOW_LIMIT_INITIAL', 16),
+                'min_limit': config.get('RAGFLOW_LIMIT_MIN', 2),
+                'max_limit': config.get('RAGFLOW_LIMIT_MAX', 64),
+                'tolerance': config.get('RAGFLOW_LIMIT_TOLERANCE', 1.5),
+                'max_wait': config.get('RAGFLOW_LIMIT_MAX_WAIT', 5.0),
+            } if config.get('RAGFLOW_LIMITER') else None,
+        },
+        rotate_turns=config.get('SESSION_ROTATE_TURNS', 0),
+        rotate_tokens=config.get('SESSION_ROTATE_TOKENS', 0),
+        session_pool_size=config.get('SESSION_POOL_SIZE', 0),
+        carry_summary=config.get('SESSION_CARRY_SUMMARY', False),
+        summary_tokens=config.get('SESSION_SUMMARY_TOKENS', 200),
+        history_max_messages=config.get('HISTORY_MAX_MESSAGES', 0),
+        archive=create_archive(config)
+    )
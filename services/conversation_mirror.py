@@ -0,0 +1,101 @@
+"""
+本地对话镜像
+
+每轮问答以 {"role", "content", "ts"} 消息的形式追加到会话键对应的 Redis 列表 (history:<session_key>)，
+列表只保留最近 max_messages 条，过期时间与会话记录一致。会话摘要、分析等需要上下文的功能
+直接读取镜像，不必再向 RagFlow 查询。
+"""
+import logging
+import time
+from typing import Dict, Iterable, List
+
+from ragflow import codec
+from ragflow.utils import truncate_messages
+from ragflow.session import Role
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PREFIX = "history:"
+
+
+class ConversationMirror:
+    """基于 Redis 列表的定长对话镜像"""
+
+    def __init__(self, redis_client, max_messages: int = 20, ttl: int = 3600):
+        """
+        初始化对话镜像
+
+        Args:
+            redis_client: Redis 客户端 (decode_responses=True)
+            max_messages: 每个会话保留的最大消息数（一轮问答为两条）
+            ttl: 过期时间（秒），应与会话记录一致
+        """
+        self.redis_client = redis_client
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    @staticmethod
+    def key(session_key: str) -> str:
+        return f"{HISTORY_PREFIX}{session_key}"
+
+    def append_turn(self, session_key: str, question: str, answer: str, pipe=None) -> None:
+        """
+        追加一轮问答 (RPUSH + LTRIM + EXPIRE)
+
+        Args:
+            session_key: 会话键
+            question: 用户问题
+            answer: 回答
+            pipe: 已有的 pipeline，传入时只追加命令、由调用方执行，以便与其他写入合并为一次往返
+        """
+        ts = round(time.time(), 3)
+        key = self.key(session_key)
+        own = pipe is None
+        if own:
+            pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpush(key,
+                   codec.dumps({"role": Role.USER.value, "content": question, "ts": ts}),
+                   codec.dumps({"role": Role.ASSISTANT.value, "content": answer, "ts": ts}))
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.ttl)
+        if own:
+            pipe.execute()
+
+    def read(self, session_key: str) -> List[Dict[str, str]]:
+        """读取一个会话的全部镜像消息（按时间顺序）"""
+        return self.read_many([session_key])[session_key]
+
+    def read_many(self, session_keys: Iterable[str]) -> Dict[str, List[Dict[str, str]]]:
+        """
+        批量读取多个会话的镜像消息（一次往返）
+
+        Returns:
+            会话键到消息列表的映射，无法解析的条目被跳过
+        """
+        session_keys = list(session_keys)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for session_key in session_keys:
+            pipe.lrange(self.key(session_key), 0, -1)
+        result = {}
+        for session_key, entries in zip(session_keys, pipe.execute()):
+            messages = []
+            for entry in entries or ():
+                try:
+                    messages.append(codec.loads(entry))
+                except codec.JSONDecodeError:
+                    logger.warning(f"跳过无法解析的对话镜像条目: {session_key}")
+            result[session_key] = messages
+        return result
+
+    def context(self, session_key: str, max_tokens: int) -> List[Dict[str, str]]:
+        """读取一个会话最近的消息，截断到 max_tokens 以内"""
+        return truncate_messages(self.read(session_key), max_tokens)
+
+    def contexts(self, session_keys: Iterable[str], max_tokens: int) -> Dict[str, List[Dict[str, str]]]:
+        """批量读取多个会话最近的消息，每个会话分别截断到 max_tokens 以内"""
+        return {key: truncate_messages(messages, max_tokens)
+                for key, messages in self.read_many(session_keys).items()}
+
+    def clear(self, session_key: str, pipe=None) -> None:
+        """删除一个会话的镜像"""
+        (pipe or self.redis_client).delete(self.key(session_key))
@@ -0,0 +1,247 @@
+"""
+FAQ 与关键词快速回复
+
+问候、"转人工" 以及若干固定问题占了相当比例的消息，它们不需要调用 RagFlow。
+规则从 JSON 文件加载，每条规则包含：
+    {"name": "greeting", "reply": "您好，请问有什么可以帮您？",
+     "exact": ["你好", "在吗"], "keywords": ["转人工"], "max_length": 20}
+  - exact: 整条消息（忽略大小写、空白和标点）等于其中之一时命中
+  - keywords: 消息包含其中之一，且消息长度不超过 max_length（0 表示不限）时命中
+所有短语编译进一个 Aho-Corasick 自动机，一次扫描消息即可找出全部命中；
+多条规则命中时，exact 优先于 keywords，同类按文件中的顺序。
+文件修改后在 reload_interval 秒内自动重新加载，加载失败时继续使用旧规则。
+"""
+import logging
+import os
+import string
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from ragflow import codec
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+KIND_EXACT = 0
+KIND_KEYWORD = 1
+
+# 匹配前去除的空白与标点（含中文标点和微信@后的特殊空格）
+_STRIP_CHARS = string.whitespace + string.punctuation + "，。！？、；：“”‘’（）【】《》〈〉…～· 　"
+_STRIP_TABLE = str.maketrans("", "", _STRIP_CHARS)
+
+
+def normalize(text: str) -> str:
+    """转为小写并去除空白与标点"""
+    return text.lower().translate(_STRIP_TABLE)
+
+
+@dataclass
+class FAQRule:
+    """一条快速回复规则"""
+    name: str
+    reply: str
+    exact: List[str] = field(default_factory=list)
+    keywords: List[str] = field(default_factory=list)
+    max_length: int = 0
+
+
+class AhoCorasick:
+    """多模式串匹配自动机，构建后只读，可被多个线程同时使用"""
+
+    def __init__(self, patterns: Dict[str, List]):
+        """
+        Args:
+            patterns: 模式串到其负载列表的映射，匹配时原样返回负载
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, object]]] = [[]]
+        for pattern, payloads in patterns.items():
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].extend((len(pattern), payload) for payload in payloads)
+        self._build()
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # 合并后缀节点的输出，扫描时无需沿失败链收集
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def iter_matches(self, text: str):
+        """
+        扫描文本，依次产生 (起始位置, 结束位置(不含), 负载)
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, payload in out[node]:
+                yield i + 1 - length, i + 1, payload
+
+
+class FAQIndex:
+    """编译后的规则集合"""
+
+    def __init__(self, rules: List[FAQRule]):
+        self.rules = rules
+        patterns: Dict[str, List[Tuple[int, int]]] = {}
+        # 可能命中任一规则的最大消息长度，更长的消息不必扫描；None 表示存在不限长度的关键词规则
+        self.max_text_length = 0
+        for index, rule in enumerate(rules):
+            for phrase in rule.exact:
+                phrase = normalize(phrase)
+                patterns.setdefault(phrase, []).append((KIND_EXACT, index))
+                if self.max_text_length is not None:
+                    self.max_text_length = max(self.max_text_length, len(phrase))
+            for keyword in rule.keywords:
+                patterns.setdefault(normalize(keyword), []).append((KIND_KEYWORD, index))
+            if rule.keywords:
+                if not rule.max_length:
+                    self.max_text_length = None
+                elif self.max_text_length is not None:
+                    self.max_text_length = max(self.max_text_length, rule.max_length)
+        self.automaton = AhoCorasick(patterns)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'FAQIndex':
+        """从 JSON 文件加载规则（规则对象的数组）"""
+        with open(path, 'rb') as f:
+            specs = codec.loads(f.read())
+        return cls([FAQRule(name=spec["name"], reply=spec["reply"], exact=list(spec.get("exact", ())),
+                            keywords=list(spec.get("keywords", ())), max_length=int(spec.get("max_length", 0)))
+                    for spec in specs])
+
+    def match(self, text: str) -> Optional[FAQRule]:
+        """
+        查找命中的规则
+
+        Returns:
+            优先级最高的命中规则，没有命中时返回 None
+        """
+        normalized = normalize(text)
+        length = len(normalized)
+        if not length or (self.max_text_length is not None and length > self.max_text_length):
+            return None
+        best = None
+        for start, end, (kind, index) in self.automaton.iter_matches(normalized):
+            if kind == KIND_EXACT:
+                if start != 0 or end != length:
+                    continue
+            else:
+                max_length = self.rules[index].max_length
+                if max_length and length > max_length:
+                    continue
+            if best is None or (kind, index) < best:
+                best = (kind, index)
+        return self.rules[best[1]] if best else None
+
+
+class FAQMatcher:
+    """带热加载和命中计数的快速回复匹配器"""
+
+    def __init__(self, path: str, reload_interval: float = 5.0):
+        """
+        初始化匹配器
+
+        Args:
+            path: 规则文件路径，文件不存在时没有规则
+            reload_interval: 检查文件是否修改的间隔（秒）
+        """
+        self.path = path
+        self.reload_interval = reload_interval
+        self.index = FAQIndex([])
+        self._mtime = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+        self.reload()
+        metrics.register_gauge("faq_rules", lambda: len(self.index.rules))
+
+    def reload(self) -> bool:
+        """
+        文件修改时重新加载规则
+
+        Returns:
+            是否加载了新规则
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        if mtime is None:
+            logger.warning(f"FAQ 规则文件不存在: {self.path}")
+            self.index = FAQIndex([])
+            return True
+        try:
+            index = FAQIndex.from_file(self.path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            metrics.incr("faq_reload_failed")
+            logger.error(f"加载 FAQ 规则失败，继续使用旧规则: {self.path}, {e}")
+            return False
+        # 整体替换，正在匹配的线程继续使用旧索引
+        self.index = index
+        logger.info(f"已加载 {len(index.rules)} 条 FAQ 规则: {self.path}")
+        return True
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now < self._next_check or not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.reload_interval
+            self.reload()
+        finally:
+            self._reload_lock.release()
+
+    def match(self, text: str) -> Optional[FAQRule]:
+        """
+        查找命中的规则并记录命中次数 (faq_hit_<规则名>) 与匹配耗时
+
+        Returns:
+            命中的规则，没有命中时返回 None
+        """
+        self._maybe_reload()
+        start = time.perf_counter()
+        rule = self.index.match(text)
+        metrics.observe("faq_match", time.perf_counter() - start)
+        if rule is not None:
+            metrics.incr("faq_hit")
+            metrics.incr(f"faq_hit_{rule.name}")
+        return rule
+
+
+def create_faq_matcher(config) -> Optional[FAQMatcher]:
+    """根据配置创建，FAQ_RULES_PATH 为空时返回 None"""
+    path = config.get('FAQ_RULES_PATH', '')
+    if not path:
+        return None
+    return FAQMatcher(path, reload_interval=config.get('FAQ_RELOAD_INTERVAL', 5.0))
@@ -0,0 +1,114 @@
+"""
+基于 Redis Stream 的消息队列
+
+/receive 在 stream 模式下只把消息追加到 Stream 后立即返回，
+由一个或多个 worker 进程以消费组的方式读取并处理，从而可以独立于 Web 进程横向扩展。
+"""
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# (entry_id, fields)
+StreamEntry = Tuple[str, Dict[str, str]]
+
+
+class MessageStream:
+    """Redis Stream 消费组的封装"""
+
+    def __init__(self, redis_client, stream_key: str = "wx_stream:messages", group: str = "wx_workers",
+                 maxlen: int = 100000):
+        """
+        初始化消息队列
+
+        Args:
+            redis_client: Redis 客户端 (decode_responses=True)
+            stream_key: Stream 的键名
+            group: 消费组名
+            maxlen: Stream 近似最大长度，超出时裁剪最早的消息
+        """
+        self.redis_client = redis_client
+        self.stream_key = stream_key
+        self.group = group
+        self.maxlen = maxlen
+
+    def ensure_group(self) -> None:
+        """创建消费组（已存在时忽略），Stream 不存在时一并创建"""
+        try:
+            self.redis_client.xgroup_create(self.stream_key, self.group, id='0', mkstream=True)
+            logger.info(f"已创建消费组: {self.stream_key} / {self.group}")
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def publish(self, message: Dict[str, Any]) -> str:
+        """
+        追加一条待处理的消息
+
+        Args:
+            message: 消息字段，值会被转换为字符串
+
+        Returns:
+            Stream 条目ID
+        """
+        fields = {key: "" if value is None else str(value) for key, value in message.items()}
+        fields.setdefault("received_at", f"{time.time():.3f}")
+        return self.redis_client.xadd(self.stream_key, fields, maxlen=self.maxlen, approximate=True)
+
+    def read(self, consumer: str, count: int = 1, block_ms: int = 5000) -> List[StreamEntry]:
+        """
+        读取分配给该消费者的新消息
+
+        Args:
+            consumer: 消费者名
+            count: 最多读取条数
+            block_ms: 没有消息时阻塞等待的毫秒数
+
+        Returns:
+            消息条目列表
+        """
+        response = self.redis_client.xreadgroup(self.group, consumer, {self.stream_key: '>'},
+                                                count=count, block=block_ms)
+        if not response:
+            return []
+        return [(entry_id, fields) for entry_id, fields in response[0][1] if fields]
+
+    def claim_stale(self, consumer: str, min_idle_ms: int, count: int = 10) -> List[StreamEntry]:
+        """
+        接管其他消费者（如已崩溃的 worker）长时间未确认的消息 (XAUTOCLAIM)
+
+        Args:
+            consumer: 接管后的消费者名
+            min_idle_ms: 未确认超过该毫秒数的消息才会被接管
+            count: 最多接管条数
+
+        Returns:
+            被接管的消息条目列表
+        """
+        response = self.redis_client.xautoclaim(self.stream_key, self.group, consumer,
+                                                min_idle_time=min_idle_ms, start_id='0-0', count=count)
+        # redis-py 返回 [next_start_id, entries, deleted_ids]，已被裁剪的条目 fields 为空
+        entries = response[1] if response else []
+        return [(entry_id, fields) for entry_id, fields in entries if fields]
+
+    def delivery_count(self, entry_id: str) -> int:
+        """获取消息已投递的次数"""
+        pending = self.redis_client.xpending_range(self.stream_key, self.group, min=entry_id, max=entry_id, count=1)
+        return pending[0]['times_delivered'] if pending else 0
+
+    def ack(self, entry_id: str) -> None:
+        """确认消息已处理"""
+        self.redis_client.xack(self.stream_key, self.group, entry_id)
+
+    def backlog(self) -> Optional[int]:
+        """获取消费组尚未处理的消息数 (lag + pending)，Redis 不可用时返回 None"""
+        try:
+            for info in self.redis_client.xinfo_groups(self.stream_key):
+                if info.get('name') == self.group:
+                    return (info.get('lag') or 0) + (info.get('pending') or 0)
+        except redis.RedisError:
+            return None
+        return 0
@@ -0,0 +1,93 @@
+"""
+进程内指标
+
+提供线程安全的计数器和耗时统计，通过 /api/metrics 查看。
+"""
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict
+
+
+class Metrics:
+    """线程安全的指标注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._timings: Dict[str, Dict[str, float]] = {}
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        """
+        增加计数器
+
+        Args:
+            name: 指标名
+            value: 增量
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        记录一次耗时
+
+        Args:
+            name: 指标名
+            seconds: 耗时（秒）
+        """
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                self._timings[name] = {"count": 1, "sum": seconds, "max": seconds}
+            else:
+                timing["count"] += 1
+                timing["sum"] += seconds
+                if seconds > timing["max"]:
+                    timing["max"] = seconds
+
+    def register_gauge(self, name: str, getter: Callable[[], Any]) -> None:
+        """
+        注册一个在快照时读取的瞬时值
+
+        Args:
+            name: 指标名
+            getter: 返回当前值的函数
+        """
+        with self._lock:
+            self._gauges[name] = getter
+
+    def get(self, name: str) -> int:
+        """获取计数器当前值"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取所有指标的快照"""
+        with self._lock:
+            timings = {
+                name: {
+                    "count": int(t["count"]),
+                    "avg_ms": t["sum"] / t["count"] * 1000,
+                    "max_ms": t["max"] * 1000,
+                }
+                for name, t in self._timings.items()
+            }
+            gauges = dict(self._gauges)
+            counters = dict(self._counters)
+        # 在锁外读取瞬时值，避免与其他组件的锁嵌套
+        return {
+            "counters": counters,
+            "timings": timings,
+            "gauges": {name: getter() for name, getter in gauges.items()},
+        }
+
+    def reset(self) -> None:
+        """清空所有计数器和耗时（保留已注册的瞬时值）"""
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+# 全局指标实例
+metrics = Metrics()
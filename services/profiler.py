@@ -0,0 +1,204 @@
+"""
+按需的采样分析与内存分配跟踪
+
+延迟突增时用于定位进程内的时间与内存花在哪里，通过 /api/admin/* 接口触发，默认关闭：
+  - SamplingProfiler: 在指定时长内按固定间隔读取所有线程的调用栈 (sys._current_frames)，
+    输出火焰图工具 (flamegraph.pl、speedscope 等) 可直接读取的折叠栈格式，每行 "帧;帧;...;帧 次数"
+  - AllocationTracker: 启动 tracemalloc 后拍摄快照，返回占用最多的位置以及与上一次快照的差异
+未触发时没有任何额外开销：不启动线程，不开启 tracemalloc。
+同一进程内同时只允许一次采样，另一次请求直接返回忙；多 worker 部署时每个请求只作用于处理它的那个 worker。
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusy(Exception):
+    """已有一次采样或跟踪操作正在进行"""
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """统计采样分析器"""
+
+    def __init__(self, max_seconds: float = 60.0, min_interval: float = 0.001):
+        """
+        Args:
+            max_seconds: 单次采样的最长时长（秒）
+            min_interval: 允许的最小采样间隔（秒），避免采样本身占满 CPU
+        """
+        self.max_seconds = max_seconds
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float, interval: float = 0.005) -> Dict[str, Any]:
+        """
+        在当前线程中采样 seconds 秒（阻塞）
+
+        Args:
+            seconds: 采样时长，不超过 max_seconds
+            interval: 采样间隔，不小于 min_interval
+
+        Returns:
+            {"samples": 采样次数, "seconds": 实际时长, "stacks": {折叠栈: 次数}}
+
+        Raises:
+            ProfilerBusy: 已有采样在进行
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("已有采样在进行")
+        try:
+            seconds = max(0.0, min(seconds, self.max_seconds))
+            interval = max(interval, self.min_interval)
+            own = threading.get_ident()
+            stacks: Counter = Counter()
+            samples = 0
+            start = time.monotonic()
+            end = start + seconds
+            logger.info(f"开始采样分析: {seconds}s, 间隔 {interval}s")
+            while True:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    labels.append(names.get(ident, f"thread-{ident}"))
+                    stacks[";".join(reversed(labels))] += 1
+                samples += 1
+                now = time.monotonic()
+                if now >= end:
+                    break
+                time.sleep(min(interval, end - now))
+            return {"samples": samples, "seconds": round(time.monotonic() - start, 3), "stacks": dict(stacks)}
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def collapse(stacks: Dict[str, int]) -> str:
+        """转换为折叠栈文本，按次数从多到少排列"""
+        return "".join(f"{stack} {count}\n" for stack, count in
+                       sorted(stacks.items(), key=lambda item: item[1], reverse=True))
+
+
+class AllocationTracker:
+    """基于 tracemalloc 的内存分配跟踪"""
+
+    def __init__(self, max_frames: int = 25):
+        """
+        Args:
+            max_frames: 每次分配记录的最大调用栈深度
+        """
+        self.max_frames = max_frames
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1) -> bool:
+        """
+        开始跟踪；跟踪期间每次分配都有额外开销，用完应调用 stop
+
+        Returns:
+            是否由本次调用开启（已在跟踪时返回 False）
+        """
+        with self._lock:
+            if tracemalloc.is_tracing():
+                return False
+            tracemalloc.start(max(1, min(frames, self.max_frames)))
+            self._snapshot = None
+            logger.info("tracemalloc 已开启")
+            return True
+
+    def stop(self) -> bool:
+        """
+        停止跟踪并释放快照
+
+        Returns:
+            停止前是否在跟踪
+        """
+        with self._lock:
+            self._snapshot = None
+            if not tracemalloc.is_tracing():
+                return False
+            tracemalloc.stop()
+            logger.info("tracemalloc 已关闭")
+            return True
+
+    def snapshot(self, top: int = 20, key_type: str = "lineno") -> Dict[str, Any]:
+        """
+        拍摄快照，返回占用最多的位置，以及与上一次快照相比增长最多的位置；本次快照成为下一次比较的基准
+
+        Args:
+            top: 返回的条目数
+            key_type: 统计维度，lineno、filename 或 traceback
+
+        Raises:
+            RuntimeError: 未开启跟踪
+            ProfilerBusy: 另一次快照正在进行
+        """
+        if key_type not in ("lineno", "filename", "traceback"):
+            raise ValueError(f"不支持的统计维度: {key_type}")
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("另一次快照正在进行")
+        try:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc 未开启")
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+            result = {
+                "traced_bytes": current,
+                "peak_bytes": peak,
+                "top": [self._stat(stat) for stat in snapshot.statistics(key_type)[:top]],
+                "diff": None,
+            }
+            if self._snapshot is not None:
+                result["diff"] = [self._stat(stat) for stat in snapshot.compare_to(self._snapshot, key_type)[:top]]
+            self._snapshot = snapshot
+            return result
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _stat(stat) -> Dict[str, Any]:
+        item = {
+            "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            "size": stat.size,
+            "count": stat.count,
+        }
+        if hasattr(stat, "size_diff"):
+            item["size_diff"] = stat.size_diff
+            item["count_diff"] = stat.count_diff
+        return item
+
+
+class Profiler:
+    """管理接口使用的采样分析器与内存分配跟踪器"""
+
+    def __init__(self, max_seconds: float = 60.0, max_frames: int = 25):
+        self.sampler = SamplingProfiler(max_seconds=max_seconds)
+        self.allocations = AllocationTracker(max_frames=max_frames)
+
+
+def create_profiler(config) -> Optional[Profiler]:
+    """根据配置创建，PROFILING_ENABLED 未开启或未设置 ADMIN_TOKEN 时返回 None"""
+    if not config.get('PROFILING_ENABLED', False) or not config.get('ADMIN_TOKEN'):
+        return None
+    return Profiler(max_seconds=config.get('PROFILING_MAX_SECONDS', 60.0))
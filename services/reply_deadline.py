@@ -0,0 +1,196 @@
+"""
+带时限的回复
+
+RagFlow 回答较慢时，用户往往会重复提问，进一步加重负载。处理一条消息时：
+  - interim_after 秒内拿到回答：直接回复 (direct)
+  - 超过 interim_after 秒：先发送一条简短的"正在查询"提示 (interim)，回答完成后再发送回答 (late)
+  - 超过 hard_deadline 秒仍未完成：回复兜底内容 (fallback)，之后完成的回答被丢弃 (discarded)
+提示与兜底由一个共享的后台线程按到期时间触发，不为每条消息单独创建线程；
+实际发送交给一个小线程池，某次发送变慢不会推迟其他消息的到期处理。
+传入消息的 Deadline 时，兜底不晚于该时限发送。
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ragflow.deadline import Deadline
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_PENDING = "pending"
+_INTERIM = "interim"
+_DONE = "done"
+_FALLBACK = "fallback"
+
+_KIND_INTERIM = "interim"
+_KIND_HARD = "hard"
+
+
+class _Ticket:
+    __slots__ = ("state", "notify", "lock")
+
+    def __init__(self, notify: Callable[[str], Any]):
+        self.state = _PENDING
+        self.notify = notify
+        self.lock = threading.Lock()
+
+
+class DeadlineReplier:
+    """按时限发送提示、回答或兜底回复"""
+
+    def __init__(self, interim_after: float = 5.0, hard_deadline: float = 30.0,
+                 interim_reply: str = "正在为您查询，请稍候…", fallback_reply: str = "",
+                 notify_workers: int = 4):
+        """
+        初始化
+
+        Args:
+            interim_after: 超过该时间（秒）仍无回答时发送提示，0 表示不发送提示
+            hard_deadline: 超过该时间（秒）仍无回答时回复兜底内容，0 表示一直等待回答
+            interim_reply: 提示内容
+            fallback_reply: 兜底内容
+            notify_workers: 发送提示与兜底回复的线程数
+        """
+        self.interim_after = interim_after
+        self.hard_deadline = hard_deadline
+        self.interim_reply = interim_reply
+        self.fallback_reply = fallback_reply
+        self.notify_workers = max(1, notify_workers)
+        self._heap: List[Tuple[float, int, str, _Ticket]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+
+    def run(self, compute: Callable[[], Dict[str, Any]], send: Callable[[str], Any],
+            deadline: Optional[Deadline] = None, notify: Optional[Callable[[str], Any]] = None) -> Dict[str, Any]:
+        """
+        计算回答并按时限回复
+
+        Args:
+            compute: 生成回答的函数，返回含 content 的字典；ignore_self_message 为真时不回复
+            send: 发送回答的函数
+            deadline: 消息处理时限，兜底回复不晚于该时限发送
+            notify: 发送提示与兜底回复的函数，默认与 send 相同（发送回答可能受时限约束，提示与兜底不应受约束）
+
+        Returns:
+            compute 的结果，附加 reply_path 表示最终走的路径
+        """
+        notify = notify or send
+        now = time.monotonic()
+        interim_at = now + self.interim_after if self.interim_after > 0 else None
+        hard_at = now + self.hard_deadline if self.hard_deadline > 0 else None
+        if deadline is not None:
+            hard_at = min(hard_at or deadline.expires_at, deadline.expires_at)
+
+        if interim_at is None and hard_at is None:
+            result = compute()
+            self._deliver(result, send)
+            metrics.incr("reply_direct")
+            result["reply_path"] = "direct"
+            return result
+
+        ticket = _Ticket(notify)
+        self._schedule(ticket, interim_at, hard_at)
+        try:
+            result = compute()
+        except Exception:
+            with ticket.lock:
+                ticket.state = _DONE
+            raise
+
+        with ticket.lock:
+            previous, ticket.state = ticket.state, _DONE
+            if previous == _FALLBACK:
+                # 兜底已发送，丢弃迟到的回答
+                metrics.incr("reply_discarded")
+                logger.info(f"回答在 {time.monotonic() - now:.1f} 秒后才完成，已回复兜底内容，丢弃")
+                result["reply_path"] = "discarded"
+                return result
+            if hard_at is not None and time.monotonic() >= hard_at and not result.get("ignore_self_message"):
+                # 已过时限但兜底尚未发出（后台线程还没轮到），由当前线程发送兜底
+                ticket.state = _FALLBACK
+                metrics.incr("reply_fallback")
+                metrics.incr("reply_discarded")
+                if self.fallback_reply:
+                    notify(self.fallback_reply)
+                result["reply_path"] = "discarded"
+                return result
+            # 持有锁发送，保证提示一定在回答之前发出
+            self._deliver(result, send)
+
+        path = "late" if previous == _INTERIM else "direct"
+        metrics.incr(f"reply_{path}")
+        result["reply_path"] = path
+        return result
+
+    def _deliver(self, result: Dict[str, Any], send: Callable[[str], Any]) -> None:
+        content = result.get("content", "")
+        if content and not result.get("ignore_self_message", False):
+            send(content)
+
+    def _schedule(self, ticket: _Ticket, interim_at: Optional[float], hard_at: Optional[float]) -> None:
+        with self._cond:
+            if interim_at is not None and (hard_at is None or interim_at < hard_at):
+                heapq.heappush(self._heap, (interim_at, next(self._seq), _KIND_INTERIM, ticket))
+            if hard_at is not None:
+                heapq.heappush(self._heap, (hard_at, next(self._seq), _KIND_HARD, ticket))
+            self._cond.notify()
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.notify_workers,
+                                                    thread_name_prefix="reply-notify")
+                self._thread = threading.Thread(target=self._loop, name="reply-deadline", daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, kind, ticket = heapq.heappop(self._heap)
+            # 状态判断与发送都交给线程池，在票据锁下进行；后台线程不等待锁，以免阻塞其他消息的到期处理
+            self._executor.submit(self._notify, kind, ticket)
+
+    def _notify(self, kind: str, ticket: _Ticket) -> None:
+        if kind == _KIND_INTERIM:
+            # 持有锁发送，保证提示在回答之前发出；提示确实发出后才进入 interim，回答据此计为 late
+            with ticket.lock:
+                if ticket.state != _PENDING or not self.interim_reply:
+                    return
+                try:
+                    ticket.notify(self.interim_reply)
+                except Exception as e:
+                    logger.error(f"发送提示失败: {e}", exc_info=True)
+                    return
+                ticket.state = _INTERIM
+            metrics.incr("reply_interim")
+            return
+
+        with ticket.lock:
+            if ticket.state not in (_PENDING, _INTERIM):
+                return
+            ticket.state = _FALLBACK
+        # 状态已改为兜底，之后完成的回答会被丢弃，兜底不必持有锁发送
+        metrics.incr("reply_fallback")
+        if not self.fallback_reply:
+            return
+        try:
+            ticket.notify(self.fallback_reply)
+        except Exception as e:
+            logger.error(f"发送兜底回复失败: {e}", exc_info=True)
+
+
+def create_deadline_replier(config) -> DeadlineReplier:
+    """根据配置创建，供 Web 进程和独立 worker 共用"""
+    return DeadlineReplier(
+        interim_after=config.get('REPLY_INTERIM_AFTER', 0),
+        hard_deadline=config.get('REPLY_HARD_DEADLINE', 0),
+        interim_reply=config.get('INTERIM_REPLY', ''),
+        fallback_reply=config['FALLBACK_REPLY']
+    )
@@ -0,0 +1,183 @@
+"""
+优先级调度
+
+将等待处理的消息按优先级类别排队，类别之间按权重公平调度（start-time fair queuing），
+并对等待过久的消息做防饿死处理，保证低优先级类别也能在有限时间内得到处理。
+"""
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional
+
+# 优先级类别
+PRIORITY_VIP = "vip"
+PRIORITY_COMMAND = "command"
+PRIORITY_PRIVATE = "private"
+PRIORITY_GROUP = "group"
+
+DEFAULT_WEIGHTS = {
+    PRIORITY_VIP: 8.0,
+    PRIORITY_COMMAND: 4.0,
+    PRIORITY_PRIVATE: 4.0,
+    PRIORITY_GROUP: 1.0,
+}
+
+
+def parse_priority_weights(spec: str) -> Dict[str, float]:
+    """
+    解析形如 "vip:8,private:4,group:1" 的权重配置，未配置的类别使用默认权重
+
+    Args:
+        spec: 权重配置字符串
+
+    Returns:
+        类别到权重的映射
+
+    Raises:
+        ValueError: 权重不是有限的正数
+    """
+    weights = dict(DEFAULT_WEIGHTS)
+    for part in filter(None, (p.strip() for p in (spec or "").split(','))):
+        name, _, value = part.partition(':')
+        try:
+            weights[name.strip()] = float(value)
+        except ValueError:
+            raise ValueError(f"优先级权重必须为数字: {part}") from None
+    _check_weights(weights)
+    return weights
+
+
+def _check_weights(weights: Dict[str, float]) -> None:
+    # pop() 按 1/权重 计算虚拟完成时间，0、负数或非有限的权重会使调度出错
+    for name, weight in weights.items():
+        if not (math.isfinite(weight) and weight > 0):
+            raise ValueError(f"优先级权重必须为有限的正数: {name}:{weight}")
+
+
+def classify_message(is_group: bool, sender_wxid: str, content: str, vip_wxids: Iterable[str] = ()) -> str:
+    """
+    根据消息来源、发送者和内容确定优先级类别
+
+    Args:
+        is_group: 是否为群聊消息
+        sender_wxid: 发送者wxid（群聊中为 finalFromWxid）
+        content: 消息内容
+        vip_wxids: VIP 用户 wxid 集合
+
+    Returns:
+        优先级类别
+    """
+    if sender_wxid and sender_wxid in vip_wxids:
+        return PRIORITY_VIP
+    if content.startswith('#'):
+        return PRIORITY_COMMAND
+    return PRIORITY_GROUP if is_group else PRIORITY_PRIVATE
+
+
+class PriorityScheduler:
+    """
+    多类别的加权公平队列（非线程安全，由调用方加锁）
+
+    入队的元素需要有 enqueued_at 属性（time.monotonic() 时间戳）。
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None, starvation_age: float = 2.0,
+                 default_class: str = PRIORITY_PRIVATE):
+        """
+        初始化调度器
+
+        Args:
+            weights: 类别到权重的映射，权重越大分到的处理名额越多
+            starvation_age: 等待超过该时间（秒）的消息优先处理
+            default_class: 未知类别使用的类别
+
+        Raises:
+            ValueError: 权重不是有限的正数
+        """
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        _check_weights(self.weights)
+        self.starvation_age = starvation_age
+        self.default_class = default_class
+        self._queues: Dict[str, Deque[Any]] = {}
+        self._start: Dict[str, float] = {}
+        self._finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def resolve(self, priority: Optional[str]) -> str:
+        """将未知类别映射到默认类别"""
+        return priority if priority in self.weights else self.default_class
+
+    def push(self, item: Any, priority: Optional[str]) -> None:
+        """
+        将元素加入对应类别的队列
+
+        Args:
+            item: 待调度的元素
+            priority: 优先级类别
+        """
+        name = self.resolve(priority)
+        queue = self._queues.setdefault(name, deque())
+        if not queue:
+            # 类别从空闲变为积压时，起始标签不早于当前虚拟时间，避免空闲期间积累"额度"
+            self._start[name] = max(self._finish.get(name, 0.0), self._virtual_time)
+        queue.append(item)
+        self._size += 1
+
+    def remove(self, item: Any, priority: Optional[str]) -> bool:
+        """
+        从队列中移除元素（如等待超时）
+
+        Returns:
+            是否找到并移除
+        """
+        queue = self._queues.get(self.resolve(priority))
+        if not queue:
+            return False
+        try:
+            queue.remove(item)
+        except ValueError:
+            return False
+        self._size -= 1
+        return True
+
+    def pop(self) -> Optional[Any]:
+        """
+        取出下一个应处理的元素
+
+        等待超过 starvation_age 的消息中最早入队的优先；
+        否则选择虚拟完成时间最小的类别。
+
+        Returns:
+            下一个元素，队列为空时返回 None
+        """
+        if not self._size:
+            return None
+
+        now = time.monotonic()
+        chosen = None
+        oldest = None
+        best_finish = None
+        for name, queue in self._queues.items():
+            if not queue:
+                continue
+            head = queue[0]
+            if now - head.enqueued_at >= self.starvation_age and (oldest is None or head.enqueued_at < oldest):
+                oldest = head.enqueued_at
+                chosen = name
+            if oldest is None:
+                finish = self._start[name] + 1.0 / self.weights[name]
+                if best_finish is None or finish < best_finish:
+                    best_finish = finish
+                    chosen = name
+
+        start = self._start[chosen]
+        self._finish[chosen] = start + 1.0 / self.weights[chosen]
+        self._virtual_time = start
+        # 同一类别的下一条消息紧接着上一条的完成标签
+        self._start[chosen] = self._finish[chosen]
+        self._size -= 1
+        return self._queues[chosen].popleft()
@@ -0,0 +1,135 @@
+"""
+预创建的 RagFlow 会话池
+
+会话轮换或新用户首次提问时，直接从池中取一个已创建好的会话，省去一次创建会话的往返。
+池按后端分别保存在 Redis 列表中，多个进程共享；后台线程在会话被取走后补足到目标数量。
+每次补充都会刷新池的过期时间，停用会话池后 Redis 中的列表会自动过期。
+Redis 处于降级模式时不取也不补充，取会话的请求直接按原流程创建会话。
+"""
+import logging
+import threading
+from typing import Optional, Tuple
+
+import redis
+
+from ragflow.router import RagFlowRouter
+from services.metrics import metrics
+from services.session_store import REDIS_DOWN_ERRORS, RedisHealth
+
+logger = logging.getLogger(__name__)
+
+SESSION_POOL_PREFIX = "ragflow_session_pool:"
+
+
+class SessionPool:
+    """按后端划分的预创建会话池"""
+
+    def __init__(self, router: RagFlowRouter, redis_client, size: int = 2, refill_interval: float = 30.0,
+                 title: str = "预创建会话", redis_health: Optional[RedisHealth] = None, ttl: int = 3600):
+        """
+        初始化会话池
+
+        Args:
+            router: RagFlow 路由，用于选择后端和创建会话
+            redis_client: Redis 客户端 (decode_responses=True)
+            size: 每个后端保持的预创建会话数
+            refill_interval: 定期检查并补足的间隔（秒）
+            title: 预创建会话的标题
+            redis_health: Redis 可用状态，与 ChatService 中的其他 Redis 功能共用；为 None 时视为一直可用
+            ttl: 池在 Redis 中的过期时间（秒），应大于 refill_interval
+        """
+        self.router = router
+        self.redis_client = redis_client
+        self.size = size
+        self.refill_interval = refill_interval
+        self.title = title
+        self.redis_health = redis_health
+        self.ttl = ttl
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _key(self, backend: str) -> str:
+        return f"{SESSION_POOL_PREFIX}{backend}"
+
+    def _redis_available(self) -> bool:
+        return self.redis_health is None or self.redis_health.available()
+
+    def _redis_failed(self, error: redis.RedisError) -> None:
+        if self.redis_health is not None and isinstance(error, REDIS_DOWN_ERRORS):
+            self.redis_health.mark_down(error)
+
+    def take(self) -> Optional[Tuple[str, str]]:
+        """
+        从路由选出的后端的池中取一个会话
+
+        Returns:
+            (后端名, 会话ID)，池为空、Redis 不可用或出错时返回 None
+        """
+        if not self._redis_available():
+            return None
+        backend = self.router.pick().name
+        try:
+            session_id = self.redis_client.lpop(self._key(backend))
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            logger.error(f"从会话池取会话失败: {e}")
+            return None
+        self._wakeup.set()
+        if not session_id:
+            metrics.incr("session_pool_miss")
+            return None
+        metrics.incr("session_pool_hit")
+        return backend, session_id
+
+    def refill(self) -> int:
+        """
+        将各个可用后端的池补足到目标数量，Redis 不可用时不补充
+
+        Returns:
+            新创建的会话数
+        """
+        created = 0
+        if not self._redis_available():
+            return created
+        try:
+            for name in self.router.backends:
+                if not self.router.is_available(name):
+                    continue
+                key = self._key(name)
+                missing = self.size - self.redis_client.llen(key)
+                for _ in range(missing):
+                    session_id = self.router.create_session(None, self.title, backend=name)
+                    if not session_id:
+                        break
+                    self.redis_client.rpush(key, session_id)
+                    created += 1
+                self.redis_client.expire(key, self.ttl)
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            raise
+        return created
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refill()
+            except Exception as e:
+                logger.error(f"补充会话池失败: {e}", exc_info=True)
+            self._wakeup.wait(self.refill_interval)
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        """启动后台补充线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="session-pool", daemon=True)
+            self._thread.start()
+            logger.info(f"会话池已启动，每个后端预创建 {self.size} 个会话")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """停止后台补充线程"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
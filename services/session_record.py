@@ -0,0 +1,187 @@
+"""
+Redis 中的用户会话记录
+
+每个用户（wx_session:* / chat_session:*）对应一个 Redis 哈希，保存 RagFlow 会话ID、所在后端、
+创建时间、轮次、累计 token 数、最近一次延迟，以及会话轮换后待带入新会话的摘要。
+读取并刷新过期时间、记录一轮问答都只需一次往返。
+
+旧版本只保存会话ID（或 会话ID@后端）的字符串键在首次读取时原地转换为哈希，
+也可以通过以下命令一次性转换:
+    python -m services.session_record [--pattern "wx_session:*"]
+"""
+import argparse
+import logging
+import sys
+import time
+from dataclasses import dataclass, fields
+from typing import Dict, Iterable, Optional
+
+import redis
+
+from ragflow.router import DEFAULT_BACKEND, decode_session_ref
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY_PATTERNS = ("wx_session:*", "chat_session:*")
+
+
+@dataclass
+class SessionRecord:
+    """一个用户的 RagFlow 会话记录"""
+    session_id: str
+    backend: str = DEFAULT_BACKEND
+    created_at: float = 0.0
+    last_active: float = 0.0
+    turns: int = 0
+    tokens: int = 0
+    last_latency_ms: float = 0.0
+    # 会话轮换后，下一次提问时带入新会话的上一会话摘要
+    carry_over: str = ""
+
+    def to_mapping(self) -> Dict[str, str]:
+        """转换为 Redis 哈希字段"""
+        return {f.name: str(getattr(self, f.name)) for f in fields(self)}
+
+    @classmethod
+    def from_mapping(cls, mapping: Dict[str, str]) -> Optional['SessionRecord']:
+        """从 Redis 哈希字段解析，缺少会话ID时返回 None；未知字段被忽略"""
+        if not mapping or not mapping.get("session_id"):
+            return None
+        values = {}
+        for f in fields(cls):
+            if f.name in mapping:
+                values[f.name] = f.type(mapping[f.name]) if f.type in (int, float) else mapping[f.name]
+        return cls(**values)
+
+
+class SessionRecordStore:
+    """基于 Redis 哈希的会话记录存储"""
+
+    def __init__(self, redis_client, ttl: int = 3600):
+        """
+        初始化会话记录存储
+
+        Args:
+            redis_client: Redis 客户端 (decode_responses=True)
+            ttl: 会话记录的过期时间（秒），每次读取或记录问答时刷新
+        """
+        self.redis_client = redis_client
+        self.ttl = ttl
+
+    def load(self, key: str) -> Optional[SessionRecord]:
+        """
+        读取会话记录并刷新过期时间（一次往返）
+
+        Returns:
+            会话记录，不存在时返回 None
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.expire(key, self.ttl)
+        mapping, _ = pipe.execute(raise_on_error=False)
+        if isinstance(mapping, redis.ResponseError):
+            if 'WRONGTYPE' not in str(mapping):
+                raise mapping
+            return self.migrate(key)
+        return SessionRecord.from_mapping(mapping)
+
+    def save(self, key: str, record: SessionRecord) -> None:
+        """整体写入会话记录（覆盖已有记录）"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping=record.to_mapping())
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def record_turn(self, key: str, tokens: int, latency: float, extra: Optional[Dict[str, str]] = None,
+                    pipe=None) -> None:
+        """
+        记录一轮问答：轮次加一、累计 token 数、最近延迟与活跃时间（一次往返）
+
+        Args:
+            key: 会话记录的键
+            tokens: 本轮问题与回答的估算 token 数
+            latency: 本轮 RagFlow 调用耗时（秒）
+            extra: 同时写入的其他字段
+            pipe: 已有的 pipeline，传入时只追加命令、由调用方执行
+        """
+        mapping = {"last_active": str(time.time()), "last_latency_ms": f"{latency * 1000:.1f}"}
+        if extra:
+            mapping.update(extra)
+        own = pipe is None
+        if own:
+            pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hincrby(key, "turns", 1)
+        pipe.hincrby(key, "tokens", tokens)
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, self.ttl)
+        if own:
+            pipe.execute()
+
+    def migrate(self, key: str) -> Optional[SessionRecord]:
+        """
+        将旧版本的字符串键原地转换为哈希，保留剩余过期时间
+
+        Returns:
+            转换后（或已是哈希）的会话记录，键不存在时返回 None
+        """
+        with self.redis_client.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(key)
+                key_type = pipe.type(key)
+                if key_type == 'hash':
+                    pipe.unwatch()
+                    return SessionRecord.from_mapping(self.redis_client.hgetall(key))
+                if key_type != 'string':
+                    return None
+                value = pipe.get(key)
+                ttl = pipe.ttl(key)
+
+                session_id, backend = decode_session_ref(value)
+                now = time.time()
+                record = SessionRecord(session_id=session_id, backend=backend, created_at=now, last_active=now)
+                pipe.multi()
+                pipe.delete(key)
+                pipe.hset(key, mapping=record.to_mapping())
+                pipe.expire(key, ttl if ttl and ttl > 0 else self.ttl)
+                pipe.execute()
+            except redis.WatchError:
+                # 其他进程同时转换或更新了该键，以其结果为准
+                return SessionRecord.from_mapping(self.redis_client.hgetall(key))
+
+        logger.info(f"会话记录已转换为哈希: {key} -> {session_id}@{backend}")
+        return record
+
+    def migrate_all(self, patterns: Iterable[str] = SESSION_KEY_PATTERNS) -> int:
+        """
+        转换所有匹配的旧版本字符串键
+
+        Returns:
+            转换的键数
+        """
+        count = 0
+        for pattern in patterns:
+            for key in self.redis_client.scan_iter(pattern):
+                if self.redis_client.type(key) == 'string' and self.migrate(key):
+                    count += 1
+        return count
+
+
+def main(argv=None) -> int:
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="将旧版本的会话字符串键转换为 Redis 哈希")
+    parser.add_argument('--pattern', action='append', help="键匹配模式，可重复指定，默认转换所有会话键")
+    args = parser.parse_args(argv)
+
+    client = redis.StrictRedis(host=Config.REDIS_HOST, port=Config.REDIS_PORT, db=Config.REDIS_DB,
+                               password=Config.REDIS_PASSWORD, decode_responses=True)
+    store = SessionRecordStore(client, Config.RAGFLOW_SESSION_EXPIRY_REDIS)
+    count = store.migrate_all(args.pattern or SESSION_KEY_PATTERNS)
+    print(f"已转换 {count} 个会话键")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,401 @@
+"""
+可替换的会话记录存储
+
+ChatService 通过统一的接口读写会话记录 (services.session_record.SessionRecord)：
+    load(key) / save(key, record) / record_turn(key, tokens, latency, extra, pipe) /
+    delete(key) / delete_prefix(prefix) / pipeline()
+  - redis:  SessionRecordStore（Redis 哈希），外层包一层 FailoverSessionStore，Redis 故障时自动降级
+  - memory: MemorySessionStore，基于 ragflow.session.SessionManager，仅当前进程可见
+  - sqlite: SQLiteSessionStore，单机多进程共享，重启后保留
+
+降级与恢复 (FailoverSessionStore + RedisHealth)：
+Redis 调用出现连接错误或超时后进入降级模式，会话记录改为读写进程内的 MemorySessionStore，
+去重、对话镜像等其他 Redis 功能也暂停使用，避免每条消息都等待超时。
+降级期间每 retry_interval 秒由一个请求线程 PING 一次 Redis，恢复后先把降级期间的变化写回 Redis
+（Redis 中没有或较旧的记录被覆盖，降级期间清除的会话在 Redis 中删除），再退出降级模式。
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import fields, replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+import redis
+
+from ragflow.session import RagFlowSession, SessionManager
+from services.metrics import metrics
+from services.session_record import SessionRecord, SessionRecordStore
+
+logger = logging.getLogger(__name__)
+
+STORE_REDIS = "redis"
+STORE_MEMORY = "memory"
+STORE_SQLITE = "sqlite"
+
+# 视为 Redis 不可用的错误；其他错误（如命令错误）照常抛出
+REDIS_DOWN_ERRORS = (redis.ConnectionError, redis.TimeoutError)
+
+
+def _apply_turn(record: SessionRecord, tokens: int, latency: float, extra: Optional[Dict[str, str]]) -> None:
+    """在记录上累计一轮问答，与 SessionRecordStore.record_turn 写入的字段相同"""
+    record.turns += 1
+    record.tokens += tokens
+    record.last_active = time.time()
+    record.last_latency_ms = round(latency * 1000, 1)
+    types = {f.name: f.type for f in fields(SessionRecord)}
+    for name, value in (extra or {}).items():
+        if name in types:
+            setattr(record, name, types[name](value) if types[name] in (int, float) else value)
+
+
+class RedisHealth:
+    """Redis 可用状态，故障后定期探测，恢复时先执行回调再标记为可用"""
+
+    def __init__(self, redis_client, retry_interval: float = 5.0):
+        """
+        Args:
+            redis_client: Redis 客户端
+            retry_interval: 降级期间探测 Redis 的间隔（秒）
+        """
+        self.redis_client = redis_client
+        self.retry_interval = retry_interval
+        self.degraded = False
+        # 进入降级模式的次数，用于区分不同的降级期
+        self.failovers = 0
+        self._next_probe = 0.0
+        self._probe_lock = threading.Lock()
+        self._on_recover: List[Callable[[], None]] = []
+        metrics.register_gauge("redis_degraded", lambda: int(self.degraded))
+
+    def on_recover(self, callback: Callable[[], None]) -> None:
+        """注册恢复回调，在退出降级模式之前调用；回调抛出 Redis 错误时保持降级"""
+        self._on_recover.append(callback)
+
+    def mark_down(self, error: Exception) -> None:
+        """Redis 调用失败，进入降级模式"""
+        if not self.degraded:
+            self.degraded = True
+            self.failovers += 1
+            metrics.incr("redis_failover")
+            logger.error(f"Redis 不可用，进入降级模式: {error}")
+        self._next_probe = time.monotonic() + self.retry_interval
+
+    def available(self) -> bool:
+        """
+        Redis 当前是否可用；降级期间到达探测时间时由一个线程 PING 一次，其他线程直接返回 False
+        """
+        if not self.degraded:
+            return True
+        if time.monotonic() < self._next_probe or not self._probe_lock.acquire(blocking=False):
+            return False
+        try:
+            if not self.degraded:
+                return True
+            try:
+                self.redis_client.ping()
+                for callback in self._on_recover:
+                    callback()
+            except REDIS_DOWN_ERRORS as e:
+                logger.warning(f"Redis 仍不可用: {e}")
+                return False
+            except Exception as e:
+                # 回调中的其他错误不应让每个请求都失败，保持降级，下次探测时重试
+                logger.error(f"Redis 恢复回调失败，保持降级模式: {e}", exc_info=True)
+                return False
+            self.degraded = False
+            metrics.incr("redis_recovered")
+            logger.info("Redis 已恢复，退出降级模式")
+            return True
+        finally:
+            if self.degraded:
+                self._next_probe = time.monotonic() + self.retry_interval
+            self._probe_lock.release()
+
+
+class _RecordSession(RagFlowSession):
+    """在 SessionManager 中保存会话记录的会话对象"""
+
+    __slots__ = ('record',)
+
+    def __init__(self, session_id: str, system_prompt: Optional[str] = None,
+                 ragflow_chat_id: Optional[str] = None):
+        super().__init__(session_id, system_prompt, ragflow_chat_id)
+        self.record: Optional[SessionRecord] = None
+
+
+class MemorySessionStore:
+    """进程内的会话记录存储，按最后活动时间过期"""
+
+    def __init__(self, ttl: int = 3600):
+        """
+        Args:
+            ttl: 会话记录的过期时间（秒），每次读取或记录问答时刷新
+        """
+        self.manager = SessionManager(expiry_seconds=ttl, session_factory=_RecordSession)
+
+    def load(self, key: str) -> Optional[SessionRecord]:
+        session = self.manager.find_session(key)
+        if session is None or session.record is None:
+            return None
+        return replace(session.record)
+
+    def save(self, key: str, record: SessionRecord) -> None:
+        self.manager.get_session(key).record = replace(record)
+
+    def record_turn(self, key: str, tokens: int, latency: float, extra: Optional[Dict[str, str]] = None,
+                    pipe=None) -> None:
+        def apply(session):
+            if session.record is not None:
+                _apply_turn(session.record, tokens, latency, extra)
+        self.manager.update_session(key, apply)
+
+    def delete(self, key: str) -> bool:
+        return self.manager.clear_session(key)
+
+    def delete_prefix(self, prefix: str) -> int:
+        return self.manager.clear_prefix(prefix)
+
+    def items(self) -> List[Tuple[str, SessionRecord]]:
+        """所有未过期的 (键, 会话记录)"""
+        return [(key, replace(session.record)) for key, session in self.manager.active_sessions()
+                if session.record is not None]
+
+    def pipeline(self):
+        return None
+
+
+class SQLiteSessionStore:
+    """SQLite 会话记录存储（WAL 模式），同一台机器上的多个进程可以共享"""
+
+    def __init__(self, path: str, ttl: int = 3600):
+        """
+        Args:
+            path: 数据库文件路径
+            ttl: 会话记录的过期时间（秒），每次读取或记录问答时刷新
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS session_records ("
+                           "key TEXT PRIMARY KEY, " + ", ".join(f"{f.name} {self._column_type(f.type)}"
+                                                              for f in fields(SessionRecord)) +
+                           ", expires_at REAL)")
+        self._columns = [f.name for f in fields(SessionRecord)]
+
+    @staticmethod
+    def _column_type(kind) -> str:
+        return {int: "INTEGER", float: "REAL"}.get(kind, "TEXT")
+
+    def load(self, key: str) -> Optional[SessionRecord]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(self._columns)} FROM session_records "
+                                     f"WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE session_records SET expires_at = ? WHERE key = ?", (now + self.ttl, key))
+        return SessionRecord(*row)
+
+    def save(self, key: str, record: SessionRecord) -> None:
+        values = [getattr(record, name) for name in self._columns]
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO session_records (key, {', '.join(self._columns)}, expires_at) "
+                f"VALUES (?, {', '.join('?' * len(self._columns))}, ?)",
+                [key] + values + [time.time() + self.ttl]
+            )
+
+    def record_turn(self, key: str, tokens: int, latency: float, extra: Optional[Dict[str, str]] = None,
+                    pipe=None) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(f"SELECT {', '.join(self._columns)} FROM session_records WHERE key = ?",
+                                         (key,)).fetchone()
+                if row is not None:
+                    record = SessionRecord(*row)
+                    _apply_turn(record, tokens, latency, extra)
+                    self._conn.execute(
+                        f"UPDATE session_records SET {', '.join(f'{name} = ?' for name in self._columns)}, "
+                        f"expires_at = ? WHERE key = ?",
+                        [getattr(record, name) for name in self._columns] + [time.time() + self.ttl, key]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM session_records WHERE key = ?", (key,)).rowcount > 0
+
+    def delete_prefix(self, prefix: str) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM session_records WHERE substr(key, 1, ?) = ?",
+                                      (len(prefix), prefix)).rowcount
+
+    def purge_expired(self) -> int:
+        """删除已过期的记录"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM session_records WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def pipeline(self):
+        return None
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class RedisSessionStore(SessionRecordStore):
+    """SessionRecordStore 加上统一接口中的其他方法"""
+
+    def delete(self, key: str) -> bool:
+        return bool(self.redis_client.delete(key))
+
+    def delete_prefix(self, prefix: str) -> int:
+        count = 0
+        for key in self.redis_client.scan_iter(f"{prefix}*"):
+            count += self.redis_client.delete(key)
+        return count
+
+    def pipeline(self):
+        return self.redis_client.pipeline(transaction=False)
+
+
+class FailoverSessionStore:
+    """Redis 不可用时降级到进程内存储，恢复后写回"""
+
+    def __init__(self, primary: RedisSessionStore, health: RedisHealth, fallback: Optional[MemorySessionStore] = None):
+        """
+        Args:
+            primary: Redis 会话记录存储
+            health: Redis 可用状态，与 ChatService 中的其他 Redis 功能共用
+            fallback: 降级期间使用的存储，默认为与 primary 过期时间相同的 MemorySessionStore
+        """
+        self.primary = primary
+        self.health = health
+        self.fallback = fallback or MemorySessionStore(primary.ttl)
+        # 降级期间清除的会话，恢复时在 Redis 中删除：(是否为前缀, 键或前缀)
+        self._deleted: List[Tuple[bool, str]] = []
+        # 所有对 fallback 的访问与写回都持有该锁，写回期间到达的调用等待写回完成
+        self._fallback_lock = threading.Lock()
+        # 已写回 Redis 的降级期 (RedisHealth.failovers)
+        self._drained_failover = 0
+        health.on_recover(self.reconcile)
+
+    def _call(self, method: str, *args, deleted: Optional[Tuple[bool, str]] = None):
+        if self.health.available():
+            try:
+                return getattr(self.primary, method)(*args)
+            except REDIS_DOWN_ERRORS as e:
+                self.health.mark_down(e)
+        with self._fallback_lock:
+            if self._drained_failover == self.health.failovers:
+                # 本次降级期的记录已经写回，RedisHealth 退出降级模式之前到达的调用直接访问 Redis，
+                # 不再写入 fallback（否则要等到下一次降级恢复时才会写回）
+                try:
+                    return getattr(self.primary, method)(*args)
+                except REDIS_DOWN_ERRORS as e:
+                    self.health.mark_down(e)
+            metrics.incr("session_store_degraded_calls")
+            if deleted is not None:
+                self._deleted.append(deleted)
+            return getattr(self.fallback, method)(*args)
+
+    def load(self, key: str) -> Optional[SessionRecord]:
+        return self._call("load", key)
+
+    def save(self, key: str, record: SessionRecord) -> None:
+        self._call("save", key, record)
+
+    def record_turn(self, key: str, tokens: int, latency: float, extra: Optional[Dict[str, str]] = None,
+                    pipe=None) -> None:
+        if pipe is not None:
+            # pipeline 只在 Redis 可用时创建，由调用方执行
+            self.primary.record_turn(key, tokens, latency, extra, pipe=pipe)
+            return
+        self._call("record_turn", key, tokens, latency, extra)
+
+    def delete(self, key: str) -> bool:
+        return self._call("delete", key, deleted=(False, key))
+
+    def delete_prefix(self, prefix: str) -> int:
+        return self._call("delete_prefix", prefix, deleted=(True, prefix))
+
+    def pipeline(self):
+        """Redis 可用时返回 pipeline，降级期间返回 None"""
+        return self.primary.pipeline() if self.health.available() else None
+
+    def reconcile(self) -> int:
+        """
+        把降级期间的变化写回 Redis：先执行清除，再写入 Redis 中没有或最后活跃时间较早的记录；
+        写回期间持有 fallback 的锁，降级期间的其他调用等待写回完成，不会在快照之后写入 fallback
+
+        Returns:
+            写回的记录数
+        """
+        with self._fallback_lock:
+            deleted, self._deleted = self._deleted, []
+            done = 0
+            try:
+                for is_prefix, key in deleted:
+                    try:
+                        if is_prefix:
+                            self.primary.delete_prefix(key)
+                        else:
+                            self.primary.delete(key)
+                    except REDIS_DOWN_ERRORS:
+                        raise
+                    except redis.RedisError as e:
+                        logger.error(f"写回清除操作失败，跳过: {key}, {e}")
+                    done += 1
+                written = 0
+                for key, record in self.fallback.items():
+                    try:
+                        current = self.primary.redis_client.hget(key, "last_active")
+                        if current is None or float(current) < record.last_active:
+                            self.primary.save(key, record)
+                            written += 1
+                    except REDIS_DOWN_ERRORS:
+                        raise
+                    except (redis.RedisError, ValueError) as e:
+                        # 例如旧版本留下的同名字符串键 (WRONGTYPE)，该记录无法写回
+                        metrics.incr("session_store_reconcile_skipped")
+                        logger.error(f"写回会话记录失败，跳过: {key}, {e}")
+                    self.fallback.delete(key)
+            except REDIS_DOWN_ERRORS:
+                # 未执行的清除操作放回，下次恢复时重试
+                self._deleted = deleted[done:] + self._deleted
+                raise
+            self._drained_failover = self.health.failovers
+        metrics.incr("session_store_reconciled", written)
+        logger.info(f"已将降级期间的 {written} 条会话记录写回 Redis")
+        return written
+
+
+def create_session_store(config: Dict, redis_client, health: RedisHealth, ttl: int):
+    """
+    根据 SESSION_STORE 创建会话记录存储
+
+    Args:
+        config: 包含 SESSION_STORE、SESSION_STORE_PATH 的映射
+        redis_client: Redis 客户端，redis 存储使用
+        health: Redis 可用状态，redis 存储使用
+        ttl: 会话记录的过期时间（秒）
+    """
+    kind = config.get('SESSION_STORE') or STORE_REDIS
+    if kind == STORE_REDIS:
+        return FailoverSessionStore(RedisSessionStore(redis_client, ttl), health)
+    if kind == STORE_MEMORY:
+        return MemorySessionStore(ttl)
+    if kind == STORE_SQLITE:
+        path = config.get('SESSION_STORE_PATH') or 'data/sessions.db'
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteSessionStore(path, ttl)
+    raise ValueError(f"未知的会话存储: {kind}")
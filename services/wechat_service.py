@@ -1,8 +1,11 @@
 import requests
 import logging
-import json
 from typing import Dict, Any, Optional
 
+from ragflow import codec
+from ragflow.deadline import Deadline, expired, timeout_for
+from services.metrics import metrics
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,9 +20,11 @@ class WeChatService:
             api_base: 微信HTTP API基础URL
         """
         self.api_base = api_base
+        self.headers = {'Content-Type': 'application/json'}
         logger.info(f"微信服务已初始化，API基础URL: {api_base}")
 
-    def send_text_message(self, to_wxid: str, content: str, at_list: Optional[list] = None) -> Dict[str, Any]:
+    def send_text_message(self, to_wxid: str, content: str, at_list: Optional[list] = None,
+                          deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
         发送文本消息
 
@@ -27,6 +32,7 @@ class WeChatService:
             to_wxid: 接收者wxid (用户ID或群ID)
             content: 消息内容
             at_list: 需要@的用户列表 (仅群聊有效)
+            deadline: 消息处理时限，已过期时不发送，否则以剩余时间作为请求超时
 
         Returns:
             API响应
@@ -47,20 +53,53 @@ class WeChatService:
         # 例如: "你好[@,wxid=wxid_123456,nick=用户昵称,isAuto=true]"
         # 或者使用 @all: "[@,wxid=all,nick=所有人,isAuto=true]"
 
-        logger.debug(f"发送微信消息: {json.dumps(payload, ensure_ascii=False)}")
+        if expired(deadline):
+            metrics.incr("wechat_send_skipped")
+            logger.warning(f"消息处理已超过时限，不再发送: {to_wxid}")
+            return {"status": "error", "message": "deadline exceeded"}
+
+        body = codec.dumps(payload)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"发送微信消息: {body.decode('utf-8')}")
 
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = requests.post(url, headers=self.headers, data=body, timeout=timeout_for(deadline, 10))
             response.raise_for_status()
-            result = response.json()
+            result = codec.loads(response.content)
 
-            logger.info(f"微信消息发送结果: {json.dumps(result, ensure_ascii=False)}")
+            logger.info(f"微信消息发送结果: {result}")
             return result
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, codec.JSONDecodeError) as e:
             logger.error(f"发送微信消息失败: {e}")
             return {"status": "error", "message": str(e)}
 
+    def send_reply(self, from_wxid: str, final_from_wxid: str, is_group: bool, content: str,
+                   deadline: Optional[Deadline] = None) -> Optional[Dict[str, Any]]:
+        """
+        回复一条收到的消息：私聊直接回复对方，群聊回复到群并@发送者
+
+        Args:
+            from_wxid: 私聊为对方wxid，群聊为群wxid
+            final_from_wxid: 群聊中发送者wxid
+            is_group: 是否为群聊
+            content: 回复内容
+            deadline: 消息处理时限，见 send_text_message
+
+        Returns:
+            API响应，内容为空时返回None
+        """
+        if not content:
+            logger.warning("回复内容为空，不发送")
+            return None
+
+        return self.send_text_message(
+            to_wxid=from_wxid,
+            content=content,
+            at_list=[final_from_wxid] if is_group and final_from_wxid else None,
+            deadline=deadline
+        )
+
     def send_image(self, to_wxid: str, image_path: str) -> Dict[str, Any]:
         """
         发送图片消息
@@ -87,16 +126,18 @@ class WeChatService:
             }
         }
 
-        logger.debug(f"发送微信图片: {json.dumps(payload, ensure_ascii=False)}")
+        body = codec.dumps(payload)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"发送微信图片: {body.decode('utf-8')}")
 
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = requests.post(url, headers=self.headers, data=body, timeout=10)
             response.raise_for_status()
-            result = response.json()
+            result = codec.loads(response.content)
 
-            logger.info(f"微信图片发送结果: {json.dumps(result, ensure_ascii=False)}")
+            logger.info(f"微信图片发送结果: {result}")
             return result
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, codec.JSONDecodeError) as e:
             logger.error(f"发送微信图片失败: {e}")
             return {"status": "error", "message": str(e)}
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""
+独立的消息处理 worker
+
+从 Redis Stream 消费 /receive 写入的消息，调用 RagFlow 获取回答并通过微信服务回复。
+每个进程运行 WORKER_CONCURRENCY 个消费线程，可以在多台机器上启动任意数量的进程。
+崩溃的 worker 留下的未确认消息会在 STREAM_CLAIM_IDLE_MS 后被其他 worker 通过 XAUTOCLAIM 接管。
+
+用法:
+    python -m services.worker [--concurrency 8] [--name worker-1]
+"""
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from ragflow.deadline import Deadline
+from services.chat_service import ChatService, create_chat_service
+from services.message_stream import MessageStream, StreamEntry
+from services.metrics import metrics
+from services.reply_deadline import DeadlineReplier, create_deadline_replier
+from services.wechat_service import WeChatService
+
+logger = logging.getLogger(__name__)
+
+
+class StreamWorker:
+    """Redis Stream 消息处理 worker"""
+
+    def __init__(self, chat_service: ChatService, wechat_service: WeChatService, stream: MessageStream,
+                 consumer_name: str, concurrency: int = 8, claim_idle_ms: int = 120000,
+                 max_deliveries: int = 3, block_ms: int = 2000, replier: Optional[DeadlineReplier] = None,
+                 message_deadline: float = 0):
+        """
+        初始化 worker
+
+        Args:
+            chat_service: 聊天服务
+            wechat_service: 微信服务
+            stream: 消息队列
+            consumer_name: 消费者名前缀，每个线程追加序号
+            concurrency: 消费线程数
+            claim_idle_ms: 接管其他消费者未确认消息的空闲阈值（毫秒）
+            max_deliveries: 超过该投递次数仍未成功的消息回复兜底后直接确认
+            block_ms: 没有新消息时阻塞等待的毫秒数
+            replier: 按时限发送提示/兜底回复，为 None 时不启用时限
+            message_deadline: 消息从写入队列起的处理时限（秒），0 表示不限时
+        """
+        self.chat_service = chat_service
+        self.wechat_service = wechat_service
+        self.stream = stream
+        self.consumer_name = consumer_name
+        self.concurrency = concurrency
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.block_ms = block_ms
+        self.replier = replier or DeadlineReplier(interim_after=0, hard_deadline=0)
+        self.message_deadline = message_deadline
+        self._stop = threading.Event()
+        self._threads = []
+
+    def handle(self, entry: StreamEntry, reclaimed: bool = False) -> None:
+        """
+        处理一条消息并确认
+
+        处理过程中抛出异常时不确认，消息会在空闲超时后被重新投递。
+        reclaimed: 是否为接管的消息；接管时已至少空闲 claim_idle_ms，时限从接管时重新计算，
+        否则崩溃恢复的消息总是已超时，只能回复兜底内容
+        """
+        entry_id, fields = entry
+        is_group = fields.get('is_group') == '1'
+        from_wxid = fields.get('from_wxid', '')
+        final_from_wxid = fields.get('final_from_wxid', '')
+        received_at = fields.get('received_at')
+
+        deadline = None
+        if self.message_deadline > 0 and reclaimed:
+            deadline = Deadline(self.message_deadline)
+        elif self.message_deadline > 0 and received_at:
+            # 时限从消息写入队列时开始计算，包含排队时间
+            deadline = Deadline.from_received_at(float(received_at), self.message_deadline)
+            if deadline.expired():
+                # 在队列中等待已超过时限，不再调用 RagFlow，直接回复兜底内容
+                logger.warning(f"消息 {entry_id} 在队列中已超过处理时限，回复兜底内容")
+                try:
+                    self.wechat_service.send_reply(from_wxid, final_from_wxid, is_group,
+                                                   self.chat_service.fallback_reply)
+                finally:
+                    self.stream.ack(entry_id)
+                    metrics.incr("worker_expired")
+                    self.chat_service.archive_wechat_reply(fields.get('question', ''), self.chat_service.fallback_reply,
+                                                           from_wxid, final_from_wxid, is_group, error=True)
+                return
+
+        start = time.monotonic()
+        self.replier.run(
+            lambda: self.chat_service.process_wechat_message(
+                question=fields.get('question', ''),
+                from_wxid=from_wxid,
+                final_from_wxid=final_from_wxid,
+                is_group=is_group,
+                context={"is_group": is_group, "bot_wxid": fields.get('bot_wxid', '')},
+                deadline=deadline
+            ),
+            lambda content: self.wechat_service.send_reply(from_wxid, final_from_wxid, is_group, content,
+                                                          deadline=deadline),
+            deadline=deadline,
+            notify=lambda content: self.wechat_service.send_reply(from_wxid, final_from_wxid, is_group, content)
+        )
+
+        self.stream.ack(entry_id)
+        metrics.incr("worker_processed")
+        metrics.observe("worker_process", time.monotonic() - start)
+        if received_at:
+            metrics.observe("worker_end_to_end", time.time() - float(received_at))
+
+    def give_up(self, entry: StreamEntry) -> None:
+        """多次投递仍失败的消息：回复兜底内容后确认，避免无限重试"""
+        entry_id, fields = entry
+        from_wxid, final_from_wxid = fields.get('from_wxid', ''), fields.get('final_from_wxid', '')
+        is_group = fields.get('is_group') == '1'
+        logger.error(f"消息 {entry_id} 已多次处理失败，回复兜底内容后丢弃")
+        try:
+            self.wechat_service.send_reply(from_wxid, final_from_wxid, is_group, self.chat_service.fallback_reply)
+        finally:
+            self.stream.ack(entry_id)
+            metrics.incr("worker_dead_letter")
+            self.chat_service.archive_wechat_reply(fields.get('question', ''), self.chat_service.fallback_reply,
+                                                   from_wxid, final_from_wxid, is_group, error=True)
+
+    def run_once(self, consumer: str, count: int = 1) -> int:
+        """
+        先接管超时未确认的消息，再读取新消息，逐条处理
+
+        Returns:
+            本轮处理的消息数
+        """
+        entries = self.stream.claim_stale(consumer, self.claim_idle_ms, count)
+        claimed = {entry_id for entry_id, _ in entries}
+        if claimed:
+            metrics.incr("worker_claimed", len(claimed))
+        if not entries:
+            entries = self.stream.read(consumer, count=count, block_ms=self.block_ms)
+
+        for entry in entries:
+            if entry[0] in claimed and self.stream.delivery_count(entry[0]) > self.max_deliveries:
+                self.give_up(entry)
+                continue
+            try:
+                self.handle(entry, reclaimed=entry[0] in claimed)
+            except Exception as e:
+                metrics.incr("worker_failed")
+                logger.error(f"处理消息 {entry[0]} 失败，等待重新投递: {e}", exc_info=True)
+        return len(entries)
+
+    def _loop(self, consumer: str) -> None:
+        logger.info(f"消费线程已启动: {consumer}")
+        while not self._stop.is_set():
+            try:
+                self.run_once(consumer)
+            except Exception as e:
+                logger.error(f"消费线程 {consumer} 读取消息失败: {e}", exc_info=True)
+                self._stop.wait(1.0)
+
+    def start(self) -> None:
+        """创建消费组并启动消费线程"""
+        self.stream.ensure_group()
+        for i in range(self.concurrency):
+            consumer = f"{self.consumer_name}-{i}"
+            thread = threading.Thread(target=self._loop, args=(consumer,), name=consumer, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """停止消费线程，正在处理的消息会处理完再退出"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+def config_from_object(obj) -> Dict:
+    """将 Config 类的大写属性转换为字典"""
+    return {key: getattr(obj, key) for key in dir(obj) if key.isupper()}
+
+
+def main(argv=None) -> int:
+    from config import Config
+
+    config = config_from_object(Config)
+    parser = argparse.ArgumentParser(description="Redis Stream 消息处理 worker")
+    parser.add_argument('--concurrency', type=int, default=config['WORKER_CONCURRENCY'])
+    parser.add_argument('--name', default=f"{socket.gethostname()}-{os.getpid()}", help="消费者名前缀")
+    args = parser.parse_args(argv)
+
+    chat_service = create_chat_service(config)
+    if not chat_service.redis_health.available():
+        logger.error("Redis 不可用，worker 无法启动")
+        return 1
+
+    worker = StreamWorker(
+        chat_service=chat_service,
+        wechat_service=WeChatService(api_base=config['WECHAT_API_BASE']),
+        stream=MessageStream(chat_service.redis_client, config['STREAM_KEY'], config['STREAM_GROUP'],
+                             config['STREAM_MAXLEN']),
+        consumer_name=args.name,
+        concurrency=args.concurrency,
+        claim_idle_ms=config['STREAM_CLAIM_IDLE_MS'],
+        max_deliveries=config['STREAM_MAX_DELIVERIES'],
+        replier=create_deadline_replier(config),
+        message_deadline=config['MESSAGE_DEADLINE']
+    )
+    worker.start()
+    logger.info(f"worker 已启动: {args.name}，消费线程数: {args.concurrency}")
+
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"worker 指标: {metrics.snapshot()['counters']}")
+    except KeyboardInterrupt:
+        logger.info("正在停止 worker...")
+        worker.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
+    )
+    sys.exit(main())
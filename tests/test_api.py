@@ -1,4 +1,5 @@
 import json
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 import sys
@@ -8,6 +9,12 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app import create_app
+from services.admission import AdmissionController
+from services.reply_deadline import DeadlineReplier
+from services.faq import FAQRule
+from services.metrics import metrics
+from api.webhook_filter import WebhookPrefilter
+from services.profiler import Profiler
 
 
 class TestAPI(unittest.TestCase):
@@ -23,11 +30,11 @@ class TestAPI(unittest.TestCase):
         self.chat_service_mock = MagicMock()
         self.app.extensions['chat_service'] = self.chat_service_mock
 
-    @patch('services.chat_service.ChatService')
+    @patch('api.routes.chat_service')
     def test_chat_endpoint(self, mock_chat_service):
         """测试聊天接口"""
         # 设置模拟返回值
-        mock_instance = mock_chat_service.return_value
+        mock_instance = mock_chat_service
         mock_instance.process_message.return_value = {
             "content": "这是一个测试回复",
             "error": False,
@@ -61,11 +68,31 @@ class TestAPI(unittest.TestCase):
             context=None
         )
 
-    @patch('services.chat_service.ChatService')
+    @patch('api.routes.chat_service')
+    def test_chat_non_string_question(self, mock_chat_service):
+        """测试 question 或 session_id 不是字符串时返回 400，而不是在处理时报 500"""
+        for body in ({"question": 123}, {"question": ["你好"]}, {"question": "你好", "session_id": 1}):
+            response = self.client.post('/api/chat', json=body)
+            self.assertEqual(response.status_code, 400, body)
+        mock_chat_service.process_message.assert_not_called()
+
+    @patch('api.routes.wechat_service')
+    @patch('api.routes.chat_service')
+    def test_receive_non_string_msg(self, mock_chat_service, mock_wechat_service):
+        """测试 msg 不是字符串的微信消息返回 400，不写入去重标记"""
+        response = self.client.post('/api/receive', json={
+            "data": {"data": {"msgId": "10001", "msg": ["你好"], "fromType": 1, "fromWxid": "wxid_user"}}
+        })
+
+        self.assertEqual(response.status_code, 400)
+        mock_chat_service.is_duplicate_message.assert_not_called()
+        mock_wechat_service.send_reply.assert_not_called()
+
+    @patch('api.routes.chat_service')
     def test_clear_session_endpoint(self, mock_chat_service):
         """测试清除会话接口"""
         # 设置模拟返回值
-        mock_instance = mock_chat_service.return_value
+        mock_instance = mock_chat_service
         mock_instance.clear_session.return_value = True
 
         # 发送请求
@@ -80,11 +107,11 @@ class TestAPI(unittest.TestCase):
         # 验证服务调用
         mock_instance.clear_session.assert_called_once_with("test-session-id")
 
-    @patch('services.chat_service.ChatService')
+    @patch('api.routes.chat_service')
     def test_clear_all_sessions_endpoint(self, mock_chat_service):
         """测试清除所有会话接口"""
         # 设置模拟返回值
-        mock_instance = mock_chat_service.return_value
+        mock_instance = mock_chat_service
 
         # 发送请求
         response = self.client.delete('/api/sessions')
@@ -98,6 +125,208 @@ class TestAPI(unittest.TestCase):
         # 验证服务调用
         mock_instance.clear_all_sessions.assert_called_once()
 
+    @patch('api.routes.admission_controller', AdmissionController(max_in_flight=4, max_queue=4, max_wait=1.0))
+    @patch('api.routes.chat_service')
+    def test_chat_batch_endpoint(self, mock_chat_service):
+        """测试批量问答接口以 JSONL 流式返回结果"""
+        mock_chat_service.ragflow_client.send_message.side_effect = lambda question, session_id, chat_id, **kwargs: {
+            "content": f"回答: {question}", "error": False, "session_id": session_id
+        }
+        self.app.config['ADMIN_TOKEN'] = "secret"
+
+        body = "\n".join(json.dumps({"id": i, "question": f"问题{i}"}, ensure_ascii=False) for i in range(5))
+        response = self.client.post('/api/chat/batch?concurrency=2', data=body.encode('utf-8'),
+                                    content_type='application/x-ndjson', headers={"X-Admin-Token": "secret"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(sorted(r["id"] for r in results), list(range(5)))
+        for r in results:
+            self.assertEqual(r["answer"], f"回答: 问题{r['id']}")
+            self.assertIn("latency_ms", r)
+
+    @patch('api.routes.chat_service')
+    def test_chat_batch_requires_token(self, mock_chat_service):
+        """测试批量问答接口未设置或未携带正确的 X-Admin-Token 时返回 403"""
+        body = json.dumps({"id": 1, "question": "问题"}).encode('utf-8')
+        self.app.config['ADMIN_TOKEN'] = ""
+        self.assertEqual(self.client.post('/api/chat/batch', data=body).status_code, 403)
+
+        self.app.config['ADMIN_TOKEN'] = "secret"
+        self.assertEqual(self.client.post('/api/chat/batch', data=body, headers={"X-Admin-Token": "wrong"})
+                         .status_code, 403)
+        mock_chat_service.ragflow_client.send_message.assert_not_called()
+
+    @patch('api.routes.admission_controller', AdmissionController(max_in_flight=0, max_queue=0, max_wait=0))
+    @patch('api.routes.chat_service')
+    def test_chat_batch_shed(self, mock_chat_service):
+        """测试批量问题计入准入控制，负载过高时逐项返回繁忙提示"""
+        self.app.config.update(ADMIN_TOKEN="secret", BUSY_REPLY="繁忙")
+        body = "\n".join(json.dumps({"id": i, "question": f"问题{i}"}) for i in range(3))
+        response = self.client.post('/api/chat/batch', data=body.encode('utf-8'), headers={"X-Admin-Token": "secret"})
+
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([(r["answer"], r["error"]) for r in results], [("繁忙", True)] * 3)
+        mock_chat_service.ragflow_client.send_message.assert_not_called()
+
+    @patch('api.routes.wechat_service')
+    @patch('api.routes.chat_service')
+    def test_receive_duplicate_message(self, mock_chat_service, mock_wechat_service):
+        """测试重复投递的微信消息直接确认，不调用 RagFlow"""
+        mock_chat_service.is_duplicate_message.return_value = True
+
+        response = self.client.post('/api/receive', json={
+            "data": {"data": {"msgId": "10001", "msg": "你好", "fromType": 1, "fromWxid": "wxid_user"}}
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['message'], "Duplicate message ignored.")
+        mock_chat_service.process_wechat_message.assert_not_called()
+        mock_wechat_service.send_text_message.assert_not_called()
+
+    @patch('api.routes.message_stream')
+    @patch('api.routes.chat_service')
+    def test_receive_failure_releases_dedup_marker(self, mock_chat_service, mock_message_stream):
+        """测试处理失败时删除去重标记，框架重试投递时不会被当作重复"""
+        mock_chat_service.is_duplicate_message.return_value = False
+        mock_message_stream.publish.side_effect = RuntimeError("redis down")
+        msg = {"msgId": "10003", "msg": "你好", "fromType": 1, "fromWxid": "wxid_user"}
+
+        response = self.client.post('/api/receive', json={"data": {"data": msg}})
+
+        self.assertEqual(response.status_code, 500)
+        mock_chat_service.release_message.assert_called_once_with(msg)
+
+    @patch('api.routes.message_stream')
+    @patch('api.routes.chat_service')
+    def test_receive_stream_mode(self, mock_chat_service, mock_message_stream):
+        """测试 stream 模式下消息写入 Redis Stream 后立即返回"""
+        mock_chat_service.is_duplicate_message.return_value = False
+        mock_message_stream.publish.return_value = "1-0"
+
+        response = self.client.post('/api/receive', json={
+            "data": {"data": {"msgId": "10002", "msg": "你好", "fromType": 1, "fromWxid": "wxid_user"}}
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['entry_id'], "1-0")
+        published = mock_message_stream.publish.call_args.args[0]
+        self.assertEqual(published["question"], "你好")
+        self.assertEqual(published["from_wxid"], "wxid_user")
+        self.assertEqual(published["is_group"], 0)
+        mock_chat_service.process_wechat_message.assert_not_called()
+
+
+    @patch('api.routes.faq_matcher')
+    @patch('api.routes.wechat_service')
+    @patch('api.routes.chat_service')
+    def test_receive_faq_reply(self, mock_chat_service, mock_wechat_service, mock_faq_matcher):
+        """测试命中快速回复规则时直接回复，不调用 RagFlow"""
+        mock_chat_service.is_duplicate_message.return_value = False
+        mock_faq_matcher.match.return_value = FAQRule("greeting", "您好", exact=["你好"])
+
+        response = self.client.post('/api/receive', json={
+            "data": {"data": {"msgId": "10004", "msg": "你好", "fromType": 1, "fromWxid": "wxid_user"}}
+        })
+
+        self.assertEqual(response.get_json()["faq"], "greeting")
+        self.assertEqual(mock_wechat_service.send_reply.call_args.args, ("wxid_user", "", False, "您好"))
+        mock_chat_service.archive_wechat_reply.assert_called_once_with("你好", "您好", "wxid_user", "", False)
+        mock_chat_service.process_wechat_message.assert_not_called()
+
+    @patch('api.routes.webhook_prefilter', WebhookPrefilter("wxid_bot"))
+    @patch('api.routes.chat_service')
+    def test_receive_prefilter(self, mock_chat_service):
+        """测试预过滤丢弃未@机器人的群聊消息和机器人自身的消息，只计数"""
+        metrics.reset()
+        mock_chat_service.is_duplicate_message.return_value = False
+        group = {"msgId": "10005", "msg": "大家好", "fromType": 2, "fromWxid": "123@chatroom",
+                 "finalFromWxid": "wxid_user", "atWxidList": ["wxid_other"]}
+
+        response = self.client.post('/api/receive', json={"data": {"data": group}})
+        self.assertEqual(response.get_json()["status"], "ok")
+        response = self.client.post('/api/receive', json={"data": {"data": dict(group, fromType=1, msgSource=1)}})
+        self.assertEqual(response.get_json()["status"], "ok")
+
+        self.assertEqual(metrics.get("webhook_ignored_not_mentioned"), 1)
+        self.assertEqual(metrics.get("webhook_ignored_self_message"), 1)
+        mock_chat_service.is_duplicate_message.assert_not_called()
+
+    def test_webhook_prefilter(self):
+        """测试预过滤只丢弃可以确定的情况"""
+        prefilter = WebhookPrefilter("wxid_bot")
+        self.assertEqual(prefilter.check(b'{"data":{"data":{"fromType": 2,"atWxidList":[]}}}'), "not_mentioned")
+        self.assertEqual(prefilter.check(b'{"data":{"data":{"fromType":1,"msgSource":1}}}'), "self_message")
+        # @了机器人、私聊、字段值只是相同前缀或出现在消息正文中时交给完整流程
+        self.assertIsNone(prefilter.check(b'{"data":{"data":{"fromType":2,"atWxidList":["wxid_bot"]}}}'))
+        self.assertIsNone(prefilter.check(b'{"data":{"data":{"fromType":1,"msgSource":0}}}'))
+        self.assertIsNone(prefilter.check(b'{"data":{"data":{"fromType":21,"msgSource":10}}}'))
+        self.assertIsNone(prefilter.check(b'{"data":{"data":{"msg":"\\"fromType\\":2","fromType":1}}}'))
+        # 未配置机器人 wxid 时与完整流程一致，群聊消息全部忽略
+        self.assertEqual(WebhookPrefilter("").check(b'{"fromType":2}'), "not_mentioned")
+
+    @patch('api.routes.chat_service')
+    def test_admin_disabled(self, mock_chat_service):
+        """测试未开启管理接口时与不存在的路由一致"""
+        response = self.client.post('/api/admin/profile?seconds=0', headers={"X-Admin-Token": ""})
+        self.assertEqual(response.status_code, 404)
+
+    @patch('api.routes.profiler', Profiler())
+    @patch('api.routes.chat_service')
+    def test_admin_profile(self, mock_chat_service):
+        """测试管理接口校验令牌，并返回折叠栈文本"""
+        self.app.config['ADMIN_TOKEN'] = "secret"
+        response = self.client.post('/api/admin/profile?seconds=0.05', headers={"X-Admin-Token": "wrong"})
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post('/api/admin/profile?seconds=0.05&interval=0.01',
+                                    headers={"X-Admin-Token": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        self.assertGreater(int(response.headers["X-Profile-Samples"]), 0)
+
+        for query in ("seconds=nan", "seconds=0.05&interval=nan", "seconds=inf", "interval=-inf"):
+            response = self.client.post(f'/api/admin/profile?{query}', headers={"X-Admin-Token": "secret"})
+            self.assertEqual(response.status_code, 400, query)
+
+        response = self.client.get('/api/admin/tracemalloc/snapshot', headers={"X-Admin-Token": "secret"})
+        self.assertEqual(response.status_code, 400)
+
+    @patch('api.routes.admission_controller', AdmissionController(max_in_flight=0, max_queue=0, max_wait=0))
+    @patch('api.routes.wechat_service')
+    @patch('api.routes.chat_service')
+    def test_receive_shed_reply_archived(self, mock_chat_service, mock_wechat_service):
+        """测试负载过高时回复繁忙提示，不调用 RagFlow，繁忙提示也归档"""
+        mock_chat_service.is_duplicate_message.return_value = False
+        self.app.config['BUSY_REPLY'] = "当前咨询人数较多"
+
+        response = self.client.post('/api/receive', json={
+            "data": {"data": {"msgId": "10005", "msg": "你好", "fromType": 1, "fromWxid": "wxid_user"}}
+        })
+
+        self.assertEqual(response.status_code, 200)
+        mock_chat_service.process_wechat_message.assert_not_called()
+        mock_chat_service.archive_wechat_reply.assert_called_once_with("你好", "当前咨询人数较多", "wxid_user", "",
+                                                                       False, error=True)
+
+    @patch('api.routes.admission_controller', AdmissionController(max_in_flight=4, max_queue=4, max_wait=1.0))
+    @patch('api.routes.deadline_replier', DeadlineReplier(interim_after=0.05, hard_deadline=0, interim_reply="请稍候"))
+    @patch('api.routes.wechat_service')
+    @patch('api.routes.chat_service')
+    def test_receive_interim_reply(self, mock_chat_service, mock_wechat_service):
+        """测试回答超过提示时限时先发送提示，回答完成后再发送回答"""
+        mock_chat_service.is_duplicate_message.return_value = False
+        mock_chat_service.process_wechat_message.side_effect = lambda **kwargs: (
+            time.sleep(0.3), {"content": "回答", "error": False})[1]
+
+        response = self.client.post('/api/receive', json={
+            "data": {"data": {"msgId": "10003", "msg": "你好", "fromType": 1, "fromWxid": "wxid_user"}}
+        })
+
+        self.assertEqual(response.status_code, 200)
+        sent = [c.args for c in mock_wechat_service.send_reply.call_args_list]
+        self.assertEqual(sent, [("wxid_user", "", False, "请稍候"), ("wxid_user", "", False, "回答")])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -2,13 +2,22 @@ import unittest
 from unittest.mock import patch, MagicMock
 import sys
 import os
+import threading
 import time
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from ragflow import codec
 from ragflow.client import RagFlowClient
-from ragflow.session import SessionManager, RagFlowSession
+from ragflow.deadline import Deadline
+from ragflow.limiter import AdaptiveLimiter, ALGORITHM_AIMD, ALGORITHM_GRADIENT
+from ragflow.router import Backend, RagFlowRouter, decode_session_ref, encode_session_ref
+from services.session_record import SessionRecord
+from ragflow.session import SessionManager, RagFlowSession, Role
+from ragflow.utils import truncate_messages, clamp_question
+from ragflow.tokens import estimate_tokens, estimate_tokens_batch, count_features, calibrate
+from benchmarks.simulator import RagFlowSimulator
 
 
 class TestRagFlowClient(unittest.TestCase):
@@ -28,12 +37,12 @@ class TestRagFlowClient(unittest.TestCase):
         """测试创建会话"""
         # 设置模拟响应
         mock_response = MagicMock()
-        mock_response.json.return_value = {
+        mock_response.content = codec.dumps({
             "code": 0,
             "data": {
                 "id": "test-session-123"
             }
-        }
+        })
         mock_post.return_value = mock_response
 
         # 调用方法
@@ -49,7 +58,7 @@ class TestRagFlowClient(unittest.TestCase):
                 'Content-Type': 'application/json',
                 'Authorization': f'Bearer {self.api_key}'
             },
-            json={"name": "Test Session"},
+            data=codec.dumps({"name": "Test Session"}),
             timeout=10
         )
 
@@ -58,12 +67,12 @@ class TestRagFlowClient(unittest.TestCase):
         """测试发送消息"""
         # 设置模拟响应
         mock_response = MagicMock()
-        mock_response.json.return_value = {
+        mock_response.content = codec.dumps({
             "code": 0,
             "data": {
                 "answer": "这是一个测试回复"
             }
-        }
+        })
         mock_post.return_value = mock_response
 
         # 调用方法
@@ -83,14 +92,275 @@ class TestRagFlowClient(unittest.TestCase):
                 'Content-Type': 'application/json',
                 'Authorization': f'Bearer {self.api_key}'
             },
-            json={
+            data=codec.dumps({
                 "question": "这是一个测试问题",
                 "session_id": "test-session-id",
                 "stream": False
-            },
+            }),
             timeout=60
         )
 
+    @patch('requests.post')
+    def test_send_message_deadline(self, mock_post):
+        """测试请求超时不超过剩余时限，时限已过时不发送请求"""
+        mock_post.return_value.content = codec.dumps({"code": 0, "data": {"answer": "ok"}})
+
+        self.client.send_message("你好", "sid", deadline=Deadline(5))
+        self.assertLessEqual(mock_post.call_args.kwargs["timeout"], 5)
+
+        mock_post.reset_mock()
+        result = self.client.send_message("你好", "sid", deadline=Deadline(0))
+        self.assertTrue(result["timeout"])
+        mock_post.assert_not_called()
+
+    def test_codec_backends(self):
+        """测试两种 JSON 实现输出一致的紧凑 UTF-8 字节串"""
+        payload = {"question": "你好", "n": [1, 2.5, None, True], "big": 2 ** 70}
+        encoded = {name: c.dumps(payload) for name, c in codec.CODECS.items()}
+
+        for name, data in encoded.items():
+            self.assertEqual(data, '{"question":"你好","n":[1,2.5,null,true],"big":1180591620717411303424}'
+                             .encode("utf-8"), name)
+            self.assertEqual(codec.CODECS[name].loads(data), payload)
+            with self.assertRaises(codec.JSONDecodeError):
+                codec.CODECS[name].loads(b"{bad")
+
+
+class TestRagFlowRouter(unittest.TestCase):
+    """RagFlow多后端路由测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.clients = {name: MagicMock() for name in ("a", "b")}
+        self.router = RagFlowRouter([Backend(name, client, f"chat-{name}") for name, client in self.clients.items()],
+                                    eject_after_failures=2, eject_seconds=60)
+
+    def test_session_ref(self):
+        """测试会话引用的编码与旧数据兼容"""
+        self.assertEqual(decode_session_ref(encode_session_ref("sid-1", "b")), ("sid-1", "b"))
+        self.assertEqual(decode_session_ref("sid-legacy"), ("sid-legacy", "default"))
+
+    def test_legacy_session_with_named_backends(self):
+        """测试后端使用自定义名称时，旧会话数据与默认会话记录仍发往第一个后端，不被视为不可用"""
+        _, backend = decode_session_ref("sid-legacy")
+        self.assertTrue(self.router.is_available(backend))
+        self.assertTrue(self.router.is_available(SessionRecord("sid-legacy").backend))
+        self.assertFalse(self.router.is_available("removed"))
+
+        self.clients["a"].send_message.return_value = {"content": "ok", "error": False}
+        self.router.send_message("你好", "sid-legacy", backend=backend)
+        self.clients["a"].send_message.assert_called_once()
+        self.clients["b"].send_message.assert_not_called()
+
+    def test_pick_least_outstanding(self):
+        """测试新会话选择在途请求最少的后端"""
+        self.router.backends["a"].outstanding = 3
+        self.clients["b"].create_session.return_value = "sid-b"
+
+        self.assertEqual(self.router.open_session("标题"), ("b", "sid-b"))
+        self.clients["b"].create_session.assert_called_once_with(chat_id="chat-b", title="标题", deadline=None)
+        self.assertEqual(self.router.backends["b"].outstanding, 0)
+
+    def test_send_message_affinity(self):
+        """测试消息发往指定后端并使用该后端的 chat_id"""
+        self.clients["b"].send_message.return_value = {"content": "ok", "error": False}
+
+        self.router.send_message("你好", "sid-b", backend="b")
+        self.clients["b"].send_message.assert_called_once_with(
+            question="你好", session_id="sid-b", chat_id="chat-b", stream=False, timeout=60, deadline=None)
+        self.clients["a"].send_message.assert_not_called()
+        self.assertTrue(self.router.send_message("你好", "sid", backend="missing")["error"])
+
+    def test_eject_after_failures(self):
+        """测试连续失败的后端被摘除，新会话改用其他后端"""
+        self.clients["a"].send_message.return_value = {"content": "超时", "error": True}
+        self.clients["b"].create_session.return_value = "sid-b"
+
+        for _ in range(2):
+            self.router.send_message("你好", "sid-a", backend="a")
+
+        self.assertFalse(self.router.is_available("a"))
+        self.assertTrue(self.router.stats()["a"]["ejected"])
+        self.assertEqual(self.router.open_session("标题"), ("b", "sid-b"))
+
+
+    def test_deadline_timeout_not_counted_as_failure(self):
+        """测试因剩余时限不足导致的超时不计入后端失败次数"""
+        self.clients["a"].send_message.return_value = {"content": "超时", "error": True, "timeout": True}
+
+        for _ in range(3):
+            self.router.send_message("你好", "sid-a", backend="a", deadline=Deadline(1))
+
+        self.assertTrue(self.router.is_available("a"))
+        self.assertEqual(self.router.send_message("你好", "sid-a", backend="a", deadline=Deadline(0))["timeout"], True)
+        self.assertEqual(self.clients["a"].send_message.call_count, 3)
+
+        # 连接超时说明后端不可达，即使剩余时限很短也计入失败
+        self.clients["a"].send_message.return_value = {"content": "超时", "error": True, "timeout": True,
+                                                       "connect_timeout": True}
+        for _ in range(2):
+            self.router.send_message("你好", "sid-a", backend="a", deadline=Deadline(1))
+        self.assertFalse(self.router.is_available("a"))
+
+    def test_timeouts_eject_backend_with_default_deadline(self):
+        """测试默认时限 (30 秒，超时 60 秒) 下持续超时的后端仍会被摘除，并作为过载信号反馈给限制器"""
+        router = RagFlowRouter([Backend("a", self.clients["a"], "chat-a")], eject_after_failures=2,
+                               limiter_options={"initial_limit": 4})
+        limiter = router.backends["a"].limiter
+        self.clients["a"].send_message.return_value = {"content": "超时", "error": True, "timeout": True}
+
+        with patch.object(limiter, "release", wraps=limiter.release) as release:
+            for _ in range(2):
+                router.send_message("你好", "sid-a", backend="a", deadline=Deadline(30))
+
+        self.assertFalse(router.is_available("a"))
+        self.assertIsNotNone(release.call_args.args[0])
+        self.assertFalse(release.call_args.args[1])
+
+    def test_business_errors_not_overload(self):
+        """测试未知会话、4xx 等业务错误不作为过载信号，连接失败与 5xx 才是"""
+        router = RagFlowRouter([Backend("a", self.clients["a"], "chat-a")], limiter_options={"initial_limit": 4})
+        limiter = router.backends["a"].limiter
+        results = [({"content": "会话不存在", "error": True}, True),
+                   ({"content": "HTTP 404", "error": True, "status_code": 404}, True),
+                   ({"content": "HTTP 503", "error": True, "status_code": 503}, False),
+                   ({"content": "连接失败", "error": True, "connection_error": True}, False)]
+
+        with patch.object(limiter, "release", wraps=limiter.release) as release:
+            for result, ok in results:
+                self.clients["a"].send_message.return_value = result
+                router.send_message("你好", "sid-a", backend="a")
+                self.assertEqual(release.call_args.args[1], ok, result)
+
+    def test_limiter_rejects_when_full(self):
+        """测试问答请求经过并发限制器，名额用满时直接返回繁忙且不计入后端失败"""
+        router = RagFlowRouter([Backend("a", self.clients["a"], "chat-a")],
+                               limiter_options={"initial_limit": 2, "min_limit": 2, "max_wait": 0.05})
+        limiter = router.backends["a"].limiter
+        self.assertTrue(limiter.acquire() and limiter.acquire())
+
+        result = router.send_message("你好", "sid-a", backend="a")
+
+        self.assertTrue(result["limited"])
+        self.clients["a"].send_message.assert_not_called()
+        self.assertEqual(router.backends["a"].consecutive_failures, 0)
+        self.assertEqual(router.stats()["a"]["limiter"]["rejected"], 1)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    """自适应并发限制器测试类"""
+
+    def setUp(self):
+        """测试前准备：用可控的时钟驱动采样窗口"""
+        self.now = 1000.0
+        clock_patcher = patch('ragflow.limiter.time.monotonic', lambda: self.now)
+        self.addCleanup(clock_patcher.stop)
+        clock_patcher.start()
+
+    def run_windows(self, limiter, latency, windows, ok=True, busy=True):
+        """模拟若干个采样窗口，busy 为真时每个窗口都用满 limit"""
+        for _ in range(windows):
+            in_flight = limiter.limit if busy else 1
+            for _ in range(in_flight):
+                limiter.acquire(0)
+            self.now += latency
+            for _ in range(in_flight):
+                limiter.release(latency, ok)
+
+    def test_gradient_tracks_latency(self):
+        """测试 gradient 算法延迟正常时增加 limit，延迟升高时收缩"""
+        limiter = AdaptiveLimiter(ALGORITHM_GRADIENT, initial_limit=8, max_limit=64)
+        self.run_windows(limiter, 0.1, 10)
+        grown = limiter.limit
+        self.assertGreater(grown, 8)
+
+        self.run_windows(limiter, 0.4, 5)
+        self.assertLess(limiter.limit, grown / 2)
+
+    def test_aimd_backoff_and_app_limited(self):
+        """测试 aimd 算法失败时按比例收缩，在途请求较少时不增加 limit"""
+        limiter = AdaptiveLimiter(ALGORITHM_AIMD, initial_limit=20, backoff=0.5)
+        self.run_windows(limiter, 0.1, 5, busy=False)
+        self.assertEqual(limiter.limit, 20)
+
+        self.run_windows(limiter, 0.1, 1, ok=False, busy=False)
+        self.assertEqual(limiter.limit, 10)
+        self.run_windows(limiter, 0.1, 3)
+        self.assertEqual(limiter.limit, 13)
+
+    def test_probe_follows_slower_backend(self):
+        """测试 RagFlow 本身变慢后，重新测量基线使 limit 不会一直停留在最小值"""
+        limiter = AdaptiveLimiter(ALGORITHM_GRADIENT, initial_limit=16, probe_interval=5.0)
+        self.run_windows(limiter, 0.1, 5)
+        grown = limiter.limit
+        self.run_windows(limiter, 1.0, 4)
+        shrunk = limiter.limit
+        self.assertLess(shrunk, grown / 2)
+
+        self.run_windows(limiter, 1.0, 5)
+        self.assertEqual(limiter.stats()["rtt_noload_ms"], 1000.0)
+        self.assertGreater(limiter.limit, shrunk + 4)
+
+    def test_zero_latency_windows(self):
+        """测试时钟精度不足、窗口延迟为 0 时不会除以 0"""
+        limiter = AdaptiveLimiter(ALGORITHM_GRADIENT, initial_limit=8, min_window=0.05)
+        for _ in range(5):
+            for _ in range(limiter.limit):
+                limiter.acquire(0)
+            self.now += 0.1
+            for _ in range(limiter.limit):
+                limiter.release(0.0)
+        self.assertGreaterEqual(limiter.limit, 8)
+
+    def test_acquire_timeout(self):
+        """测试 limit 用满时等待超时返回 False"""
+        limiter = AdaptiveLimiter(initial_limit=2, min_limit=1)
+        self.assertTrue(limiter.acquire(0) and limiter.acquire(0))
+        self.assertFalse(limiter.acquire(0))
+        limiter.release()
+        self.assertTrue(limiter.acquire(0))
+        self.assertEqual(limiter.stats()["rejected"], 1)
+
+
+class TestAdaptiveLimiterSimulator(unittest.TestCase):
+    """在本地模拟器上测试自适应并发限制：上游容量下降时收缩，恢复后增长"""
+
+    def drive(self, algorithm):
+        with RagFlowSimulator(latency=0.1, capacity=4) as simulator:
+            router = RagFlowRouter([Backend("a", RagFlowClient("key", simulator.api_base, "chat"), "chat")],
+                                   limiter_options={"algorithm": algorithm, "initial_limit": 24, "max_limit": 64})
+            limiter = router.backends["a"].limiter
+            stop = threading.Event()
+
+            def client():
+                while not stop.is_set():
+                    router.send_message("你好", "sid", backend="a")
+
+            threads = [threading.Thread(target=client) for _ in range(32)]
+            for t in threads:
+                t.start()
+            try:
+                time.sleep(1.5)
+                congested = limiter.limit
+                simulator.set_latency(0.1, capacity=32)
+                time.sleep(1.5)
+                recovered = limiter.limit
+            finally:
+                stop.set()
+                for t in threads:
+                    t.join()
+            return congested, recovered
+
+    def test_gradient(self):
+        congested, recovered = self.drive(ALGORITHM_GRADIENT)
+        self.assertLess(congested, 16)
+        self.assertGreater(recovered, congested + 4)
+
+    def test_aimd(self):
+        congested, recovered = self.drive(ALGORITHM_AIMD)
+        self.assertLess(congested, 16)
+        self.assertGreater(recovered, congested + 4)
+
 
 class TestSessionManager(unittest.TestCase):
     """会话管理器测试类"""
@@ -134,6 +404,20 @@ class TestSessionManager(unittest.TestCase):
         # 验证结果
         self.assertFalse(result)
 
+    def test_prefix_update_and_active_sessions(self):
+        """测试按前缀清除、修改已存在的会话，以及清理过期会话后列出剩余会话"""
+        for key in ("wx:a", "wx:b", "chat:c"):
+            self.session_manager.get_session(key)
+
+        self.assertTrue(self.session_manager.update_session("wx:a", lambda s: s.add_message("user", "你好")))
+        self.assertEqual(len(self.session_manager.find_session("wx:a").get_messages()), 1)
+        self.assertFalse(self.session_manager.update_session("missing", lambda s: self.fail("不应调用")))
+
+        self.assertEqual(self.session_manager.clear_prefix("wx:"), 2)
+        self.assertEqual([key for key, _ in self.session_manager.active_sessions()], ["chat:c"])
+        self.session_manager.expiry_seconds = -1
+        self.assertEqual(self.session_manager.active_sessions(), [])
+
     def test_clear_all_sessions(self):
         """测试清除所有会话"""
         # 创建多个会话
@@ -161,6 +445,33 @@ class TestSessionManager(unittest.TestCase):
         self.assertNotIn("test-session-id", self.session_manager.sessions)
         self.assertIn("another-session-id", self.session_manager.sessions)
 
+    def test_lookup_keeps_active_session(self):
+        """测试访问会刷新会话在过期队列中的位置"""
+        self.session_manager.expiry_seconds = 3600
+        first = self.session_manager.get_session("session-1")
+        second = self.session_manager.get_session("session-2")
+
+        # 再次访问 session-1，它应移到队尾
+        self.session_manager.get_session("session-1")
+        self.assertEqual(list(self.session_manager.sessions), ["session-2", "session-1"])
+
+        # 只有最久未活动的 session-2 过期时，清理不会影响 session-1
+        second.last_active = time.time() - 7200
+        self.session_manager.get_session("session-3")
+        self.assertNotIn("session-2", self.session_manager.sessions)
+        self.assertIs(self.session_manager.sessions["session-1"], first)
+
+    def test_background_cleanup(self):
+        """测试后台清理线程"""
+        self.session_manager.get_session("test-session-id")
+        self.session_manager.start_background_cleanup(interval=0.2)
+        try:
+            time.sleep(1.5)
+        finally:
+            self.session_manager.stop_background_cleanup()
+
+        self.assertEqual(len(self.session_manager.sessions), 0)
+
 
 class TestRagFlowSession(unittest.TestCase):
     """RagFlow会话测试类"""
@@ -239,6 +550,111 @@ class TestRagFlowSession(unittest.TestCase):
         # 现在应该过期
         self.assertTrue(self.session.is_expired(3600))
 
+    def test_compact_message_store(self):
+        """测试紧凑消息存储"""
+        self.session.add_message(Role.USER, "用户消息")
+        self.session.add_message("assistant", "助手消息")
+
+        # 会话没有 __dict__，角色以枚举保存
+        self.assertFalse(hasattr(self.session, "__dict__"))
+        self.assertIs(self.session.messages.role_at(1), Role.USER)
+        self.assertEqual(self.session.messages.content_at(-1), "助手消息")
+
+        # 对外仍以字典列表的形式返回
+        self.assertEqual(self.session.get_messages(), [
+            {"role": "system", "content": "这是一个系统提示"},
+            {"role": "user", "content": "用户消息"},
+            {"role": "assistant", "content": "助手消息"},
+        ])
+
+        # 未知角色应被拒绝
+        with self.assertRaises(ValueError):
+            self.session.add_message("robot", "未知角色")
+
+    def test_truncate(self):
+        """测试基于前缀和的截断与 truncate_messages 结果一致"""
+        for i in range(20):
+            self.session.add_message("user" if i % 2 == 0 else "assistant", "消息" * (i + 1))
+
+        for max_tokens in (5, 8, 30, 100, 1000):
+            view = self.session.truncate(max_tokens)
+            self.assertEqual(list(view), truncate_messages(self.session.get_messages(), max_tokens))
+
+        # 截断后继续追加消息，前缀和应增量更新
+        self.session.add_message("user", "最新消息")
+        view = self.session.truncate(20)
+        self.assertEqual(view[0]["role"], "system")
+        self.assertEqual(view[-1]["content"], "最新消息")
+        self.assertEqual(list(view), truncate_messages(self.session.get_messages(), 20))
+
+
+class TestUtils(unittest.TestCase):
+    """工具函数测试类"""
+
+    def test_truncate_messages(self):
+        """测试截断消息列表"""
+        messages = [
+            {"role": "system", "content": "系统"},
+            {"role": "user", "content": "一二三"},
+            {"role": "assistant", "content": "四五"},
+            {"role": "user", "content": "六"},
+        ]
+
+        # 保留系统消息和最新的两条消息
+        self.assertEqual(truncate_messages(messages, 5), [messages[0], messages[2], messages[3]])
+
+        # 不需要截断
+        self.assertEqual(truncate_messages(messages, 100), messages)
+
+        # 系统消息已超过最大token数
+        self.assertEqual(truncate_messages(messages, 2), [messages[0]])
+
+    def test_clamp_question(self):
+        """测试压缩超长问题"""
+        # 未超出预算时原样返回
+        self.assertEqual(clamp_question("短问题", 100), "短问题")
+
+        question = ("我是一名新用户。" + "这是一段很长的背景介绍，讲述了产品的各种细节。" * 50
+                    + "退款政策是什么？" + "补充一些无关的内容。" * 30 + "请问我该如何申请退款？")
+        clamped = clamp_question(question, 100)
+
+        # 压缩后不超过预算，保留开头、结尾和中间的关键问句
+        self.assertLessEqual(estimate_tokens(clamped), 100)
+        self.assertTrue(clamped.startswith("我是一名新用户。"))
+        self.assertTrue(clamped.endswith("请问我该如何申请退款？"))
+        self.assertIn("退款政策是什么？", clamped)
+
+        # 单个句子超出预算时直接截断
+        self.assertEqual(clamp_question("一" * 500, 50), "一" * 50)
+
+    def test_estimate_tokens(self):
+        """测试按字符类别估算token数"""
+        # CJK、拉丁单词、数字组、标点、emoji 分别计数
+        self.assertEqual(count_features("你好，world 12345！😀"), (2, 1, 2, 2, 1, 0))
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("你好"), 2)
+
+        # 英文按词计数，明显少于字符数
+        self.assertLess(estimate_tokens("hello world " * 10), len("hello world " * 10))
+        self.assertEqual(count_features("internationalization")[1], 4)
+
+        # 超长的字母串（URL、base64 等）按长度折算，不会只算作 1 个词
+        self.assertGreater(estimate_tokens("a" * 10000), 2000)
+        self.assertGreater(estimate_tokens("https://example.com/" + "QUJDREVGR0hJSktMTU5PUFFSU1RVVldYWVo" * 30), 200)
+        self.assertLessEqual(estimate_tokens(clamp_question("a" * 10000, 100)), 100)
+
+        # 批量模式与逐条结果一致
+        texts = ["你好", "hello", "你好", "123"]
+        self.assertEqual(estimate_tokens_batch(texts), [estimate_tokens(t) for t in texts])
+
+    def test_calibrate(self):
+        """测试根据参考样本拟合权重"""
+        samples = [("你好", 4), ("hello world", 2), ("123456", 2), ("，。", 2), ("😀", 3), ("привет", 2)]
+        weights = calibrate(samples)
+        self.assertAlmostEqual(weights["cjk"], 2.0, places=2)
+        self.assertAlmostEqual(weights["word"], 1.0, places=2)
+        self.assertAlmostEqual(weights["emoji"], 3.0, places=2)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,1161 @@
+import sqlite3
+import tempfile
+import threading
+import redis
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.chat_service import ChatService
+from services.metrics import metrics
+from services.batch_service import run_batch, parse_jsonl
+from services.admission import AdmissionController
+from services.scheduler import PriorityScheduler, classify_message, parse_priority_weights
+from services.worker import StreamWorker
+from services.reply_deadline import DeadlineReplier
+from services.session_record import SessionRecord, SessionRecordStore
+from services.session_pool import SessionPool
+from services.conversation_mirror import ConversationMirror
+from services.archive import ArchiveSink, JSONLArchiveWriter, SQLiteArchiveWriter, POLICY_BLOCK, POLICY_DROP
+from services.faq import FAQIndex, FAQMatcher, FAQRule
+from services.session_store import (FailoverSessionStore, MemorySessionStore, RedisHealth,
+                                    RedisSessionStore, SQLiteSessionStore)
+from services.profiler import AllocationTracker, ProfilerBusy, SamplingProfiler
+from ragflow import codec
+from ragflow.deadline import Deadline
+
+
+class TestChatService(unittest.TestCase):
+    """聊天服务测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        redis_patcher = patch('services.chat_service.redis.StrictRedis')
+        self.addCleanup(redis_patcher.stop)
+        self.redis_mock = redis_patcher.start().return_value
+
+        self.chat_service = ChatService(
+            api_key="test-api-key",
+            api_base="https://api.example.com",
+            default_chat_id="test-chat-id",
+            session_expiry=3600,
+            max_tokens=200,
+            fallback_reply="转人工",
+            redis_config={
+                'REDIS_HOST': '127.0.0.1',
+                'REDIS_PORT': 6379,
+                'REDIS_DB': 0,
+                'REDIS_PASSWORD': None,
+                'RAGFLOW_SESSION_EXPIRY_REDIS': 3600
+            }
+        )
+        self.chat_service.ragflow_client = MagicMock()
+        self.chat_service.ragflow_client.is_available.return_value = True
+        self.chat_service.ragflow_client.send_message.return_value = {
+            "content": "测试回复", "error": False, "session_id": "ragflow-session-1"
+        }
+        self.records = self.chat_service.session_records = MagicMock()
+        metrics.reset()
+
+    def test_clamp_oversized_question(self):
+        """测试超长问题在发送前被压缩并计入指标"""
+        self.records.load.return_value = SessionRecord("ragflow-session-1")
+
+        question = "背景。" + "很长的文档内容。" * 200 + "请问怎么办？"
+        self.chat_service.archive = MagicMock()
+        result = self.chat_service.process_wechat_message(question, "wxid_user", "", False)
+        # 归档保存原始问题
+        self.assertEqual(self.chat_service.archive.submit.call_args.args[0]["question"], question)
+
+        self.assertEqual(result["content"], "测试回复")
+        sent_question = self.chat_service.ragflow_client.send_message.call_args.kwargs["question"]
+        self.assertLess(len(sent_question), len(question))
+        self.assertTrue(sent_question.endswith("请问怎么办？"))
+        self.assertEqual(metrics.get("question_clamped"), 1)
+
+        # 正常长度的问题不受影响
+        self.chat_service.process_wechat_message("你好", "wxid_user", "", False)
+        sent_question = self.chat_service.ragflow_client.send_message.call_args.kwargs["question"]
+        self.assertEqual(sent_question, "你好")
+        self.assertEqual(metrics.get("question_clamped"), 1)
+
+    def test_process_message_uses_chat_namespace(self):
+        """测试通用聊天接口使用 chat_session: 命名空间的 Redis 会话"""
+        self.records.load.return_value = None
+        self.chat_service.ragflow_client.open_session.return_value = ("default", "ragflow-session-2")
+        self.chat_service.archive = MagicMock()
+
+        result = self.chat_service.process_message("你好", session_id="web-1", user_id="user-1")
+
+        self.assertEqual(result["content"], "测试回复")
+        self.assertEqual(result["ragflow_session_id"], "ragflow-session-2")
+        self.records.load.assert_called_once_with("chat_session:web-1")
+        key, record = self.records.save.call_args.args
+        self.assertEqual((key, record.session_id, record.backend), ("chat_session:web-1", "ragflow-session-2", "default"))
+        self.records.record_turn.assert_called_once()
+        self.assertEqual(self.records.record_turn.call_args.args[0], "chat_session:web-1")
+        archived = self.chat_service.archive.submit.call_args.args[0]
+        self.assertEqual((archived["session_key"], archived["question"], archived["answer"]),
+                         ("chat_session:web-1", "你好", "测试回复"))
+
+        # 已有会话时直接使用，不再创建
+        self.records.load.return_value = record
+        self.chat_service.process_message("再问一句", session_id="web-1")
+        self.chat_service.ragflow_client.open_session.assert_called_once()
+        self.records.save.assert_called_once()
+
+    def test_process_message_numeric_user_id(self):
+        """测试 user_id 为数字时仍能生成会话标题"""
+        self.records.load.return_value = None
+        self.chat_service.ragflow_client.open_session.return_value = ("default", "ragflow-session-3")
+
+        result = self.chat_service.process_message("你好", session_id="web-2", user_id=1234567890)
+
+        self.assertEqual(result["content"], "测试回复")
+        self.assertEqual(self.chat_service.ragflow_client.open_session.call_args.args[0], "网页 12345678")
+
+    def test_archive_wechat_reply(self):
+        """测试命中 FAQ 的问答按微信会话键归档"""
+        self.chat_service.archive = MagicMock()
+
+        self.chat_service.archive_wechat_reply("你好", "您好", "12345678@chatroom", "wxid_user", True)
+
+        archived = self.chat_service.archive.submit.call_args.args[0]
+        self.assertEqual((archived["session_key"], archived["question"], archived["answer"], archived["error"]),
+                         ("wx_session:group_user:wxid_user", "你好", "您好", 0))
+        self.assertIsNone(archived["ragflow_session_id"])
+
+        # 超过处理时限时回复兜底内容并归档为错误
+        self.chat_service.process_wechat_message("在吗", "wxid_user", "", False, deadline=Deadline(0))
+        archived = self.chat_service.archive.submit.call_args.args[0]
+        self.assertEqual((archived["question"], archived["answer"], archived["error"]), ("在吗", "转人工", 1))
+
+    def test_session_affinity(self):
+        """测试已保存的会话发往创建它的后端，后端不可用时重新创建"""
+        self.records.load.return_value = SessionRecord("ragflow-session-9", backend="backend-b")
+
+        self.chat_service.process_wechat_message("你好", "wxid_user", "", False)
+        kwargs = self.chat_service.ragflow_client.send_message.call_args.kwargs
+        self.assertEqual((kwargs["session_id"], kwargs["backend"]), ("ragflow-session-9", "backend-b"))
+        self.chat_service.ragflow_client.open_session.assert_not_called()
+
+        self.chat_service.ragflow_client.is_available.return_value = False
+        self.chat_service.ragflow_client.open_session.return_value = ("backend-a", "ragflow-session-10")
+        self.chat_service.process_wechat_message("你好", "wxid_user", "", False)
+        kwargs = self.chat_service.ragflow_client.send_message.call_args.kwargs
+        self.assertEqual((kwargs["session_id"], kwargs["backend"]), ("ragflow-session-10", "backend-a"))
+        key, record = self.records.save.call_args.args
+        self.assertEqual((key, record.session_id, record.backend),
+                         ("wx_session:private:wxid_user", "ragflow-session-10", "backend-a"))
+        self.assertEqual(metrics.get("ragflow_session_rehomed"), 1)
+
+    def test_mirror_without_redis_session_store(self):
+        """测试会话记录不在 Redis 中（pipeline 为 None）时对话镜像仍写入 Redis，Redis 降级期间跳过"""
+        mirror = self.chat_service.conversation_mirror = MagicMock()
+        self.records.load.return_value = SessionRecord("ragflow-session-1")
+        self.records.pipeline.return_value = None
+
+        self.chat_service.process_wechat_message("你好", "wxid_user", "", False)
+        mirror.append_turn.assert_called_once_with("wx_session:private:wxid_user", "你好", "测试回复", pipe=None)
+
+        self.chat_service.redis_health.mark_down(redis.ConnectionError("down"))
+        self.chat_service.process_wechat_message("你好", "wxid_user", "", False)
+        mirror.append_turn.assert_called_once()
+
+    def test_rotate_long_session(self):
+        """测试会话达到轮次阈值后轮换，并将对话镜像中最近问答的摘要带入新会话的第一个问题"""
+        self.chat_service.rotate_turns = 20
+        self.chat_service.carry_summary = True
+        mirror = self.chat_service.conversation_mirror = MagicMock()
+        mirror.context.return_value = [{"role": "user", "content": "订单 20240518 什么时候发货？"},
+                                       {"role": "assistant", "content": "预计明天发货。"}]
+        self.records.load.return_value = SessionRecord("ragflow-session-old", turns=19)
+        self.chat_service.ragflow_client.open_session.return_value = ("default", "ragflow-session-new")
+
+        self.chat_service.process_wechat_message("你好", "wxid_user", "", False)
+        self.chat_service.ragflow_client.open_session.assert_not_called()
+        mirror.append_turn.assert_called_once()
+        self.assertEqual(mirror.append_turn.call_args.args, ("wx_session:private:wxid_user", "你好", "测试回复"))
+
+        self.records.load.return_value = SessionRecord("ragflow-session-old", turns=20)
+        self.chat_service.process_wechat_message("那物流单号呢？", "wxid_user", "", False)
+
+        key, record = self.records.save.call_args.args
+        self.assertEqual((record.session_id, record.turns), ("ragflow-session-new", 0))
+        self.assertIn("预计明天发货", record.carry_over)
+        kwargs = self.chat_service.ragflow_client.send_message.call_args.kwargs
+        self.assertEqual(kwargs["session_id"], "ragflow-session-new")
+        self.assertIn("预计明天发货", kwargs["question"])
+        self.assertTrue(kwargs["question"].endswith("那物流单号呢？"))
+        # 镜像中只记录用户的原始问题，摘要只带入一次
+        self.assertEqual(mirror.append_turn.call_args.args[1], "那物流单号呢？")
+        self.assertEqual(self.records.record_turn.call_args.args[3], {"carry_over": ""})
+        self.assertEqual(metrics.get("ragflow_session_rotated"), 1)
+
+    def test_rotate_uses_session_pool(self):
+        """测试轮换时优先使用预创建的会话"""
+        self.chat_service.rotate_tokens = 1000
+        self.chat_service.session_pool = MagicMock()
+        self.chat_service.session_pool.take.return_value = ("default", "ragflow-session-pooled")
+        self.records.load.return_value = SessionRecord("ragflow-session-old", tokens=1500)
+
+        self.chat_service.process_wechat_message("你好", "wxid_user", "", False)
+
+        self.chat_service.ragflow_client.open_session.assert_not_called()
+        self.assertEqual(self.chat_service.ragflow_client.send_message.call_args.kwargs["session_id"],
+                         "ragflow-session-pooled")
+
+    def test_expired_deadline_skips_work(self):
+        """测试处理时限已过时不访问 Redis 与 RagFlow，直接返回兜底回复"""
+        result = self.chat_service.process_wechat_message("你好", "wxid_user", "", False, deadline=Deadline(0))
+
+        self.assertTrue(result["deadline_exceeded"])
+        self.assertEqual(result["content"], "转人工")
+        self.records.load.assert_not_called()
+        self.chat_service.ragflow_client.send_message.assert_not_called()
+        self.assertEqual(metrics.get("deadline_exceeded"), 1)
+
+    def test_deadline_passed_to_ragflow(self):
+        """测试处理时限传递给会话创建与消息发送"""
+        self.records.load.return_value = None
+        self.chat_service.ragflow_client.open_session.return_value = ("default", "ragflow-session-1")
+        deadline = Deadline(30)
+
+        self.chat_service.process_message("你好", "web-1", deadline=deadline)
+
+        self.assertIs(self.chat_service.ragflow_client.open_session.call_args.kwargs["deadline"], deadline)
+        self.assertIs(self.chat_service.ragflow_client.send_message.call_args.kwargs["deadline"], deadline)
+
+    def test_duplicate_message(self):
+        """测试按 msgId 去重，缺少 msgId 时按内容哈希去重"""
+        self.redis_mock.set.side_effect = [True, None]
+        msg = {"msgId": "10001", "fromWxid": "wxid_user", "msg": "你好"}
+
+        self.assertFalse(self.chat_service.is_duplicate_message(msg))
+        self.assertTrue(self.chat_service.is_duplicate_message(msg))
+        self.redis_mock.set.assert_called_with("wx_dedup:10001", 1, nx=True, ex=300)
+        self.assertEqual(metrics.get("webhook_duplicate"), 1)
+
+        # 没有 msgId 时，相同内容与时间戳得到相同的key
+        self.redis_mock.set.side_effect = None
+        self.redis_mock.set.return_value = True
+        msg = {"fromWxid": "wxid_user", "msg": "你好", "timeStamp": "1700000000"}
+        self.chat_service.is_duplicate_message(msg)
+        first_key = self.redis_mock.set.call_args.args[0]
+        self.chat_service.is_duplicate_message(dict(msg))
+        self.assertEqual(self.redis_mock.set.call_args.args[0], first_key)
+        self.assertTrue(first_key.startswith("wx_dedup:h:"))
+
+        # 既没有 msgId 也没有时间戳时不做去重，相同内容的消息都会被处理
+        self.redis_mock.set.reset_mock()
+        self.assertFalse(self.chat_service.is_duplicate_message({"fromWxid": "wxid_user", "msg": "你好"}))
+        self.redis_mock.set.assert_not_called()
+
+    def test_release_message(self):
+        """测试处理失败后删除去重标记"""
+        self.chat_service.release_message({"msgId": "10001", "fromWxid": "wxid_user", "msg": "你好"})
+        self.redis_mock.delete.assert_called_once_with("wx_dedup:10001")
+
+        self.redis_mock.delete.reset_mock()
+        self.chat_service.release_message({"fromWxid": "wxid_user", "msg": "你好"})
+        self.redis_mock.delete.assert_not_called()
+
+
+class TestSessionRecordStore(unittest.TestCase):
+    """Redis 会话记录测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.redis_mock = MagicMock()
+        self.pipe = self.redis_mock.pipeline.return_value
+        self.pipe.__enter__.return_value = self.pipe
+        self.store = SessionRecordStore(self.redis_mock, ttl=600)
+
+    def test_load_hash_in_one_round_trip(self):
+        """测试读取会话记录与刷新过期时间在同一个 pipeline 中完成"""
+        self.pipe.execute.return_value = [
+            {"session_id": "sid-1", "backend": "b", "turns": "3", "tokens": "120", "unknown": "x"}, True]
+
+        record = self.store.load("wx_session:private:wxid_user")
+
+        self.assertEqual(record, SessionRecord("sid-1", backend="b", turns=3, tokens=120))
+        self.pipe.hgetall.assert_called_once_with("wx_session:private:wxid_user")
+        self.pipe.expire.assert_called_once_with("wx_session:private:wxid_user", 600)
+        self.pipe.execute.assert_called_once()
+
+        self.pipe.execute.return_value = [{}, False]
+        self.assertIsNone(self.store.load("wx_session:private:missing"))
+
+    def test_migrate_legacy_string_key(self):
+        """测试旧版本的字符串键在读取时原地转换为哈希，并保留剩余过期时间"""
+        self.pipe.execute.return_value = [redis.ResponseError("WRONGTYPE Operation against a key"), True]
+        self.pipe.type.return_value = "string"
+        self.pipe.get.return_value = "sid-legacy"
+        self.pipe.ttl.return_value = 120
+
+        record = self.store.load("wx_session:private:wxid_user")
+
+        self.assertEqual((record.session_id, record.backend), ("sid-legacy", "default"))
+        self.pipe.multi.assert_called_once()
+        self.pipe.hset.assert_called_once_with("wx_session:private:wxid_user", mapping=record.to_mapping())
+        self.pipe.expire.assert_called_with("wx_session:private:wxid_user", 120)
+
+
+class TestConversationMirror(unittest.TestCase):
+    """对话镜像测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.redis_mock = MagicMock()
+        self.pipe = self.redis_mock.pipeline.return_value
+        self.mirror = ConversationMirror(self.redis_mock, max_messages=4, ttl=600)
+
+    def test_append_turn_in_one_pipeline(self):
+        """测试一轮问答以 RPUSH + LTRIM + EXPIRE 在同一个 pipeline 中写入"""
+        self.mirror.append_turn("wx_session:private:wxid_user", "问题", "回答")
+
+        key = "history:wx_session:private:wxid_user"
+        user, assistant = self.pipe.rpush.call_args.args[1:]
+        self.assertEqual(self.pipe.rpush.call_args.args[0], key)
+        self.assertEqual((codec.loads(user)["role"], codec.loads(assistant)["content"]), ("user", "回答"))
+        self.pipe.ltrim.assert_called_once_with(key, -4, -1)
+        self.pipe.expire.assert_called_once_with(key, 600)
+        self.pipe.execute.assert_called_once()
+
+    def test_bulk_context(self):
+        """测试批量读取多个会话的镜像并按token预算截断"""
+        history = [codec.dumps({"role": "user", "content": f"第{i}个问题" * 20}) for i in range(4)]
+        self.pipe.execute.return_value = [history, [], [b"{bad"]]
+
+        contexts = self.mirror.contexts(["a", "b", "c"], max_tokens=100)
+
+        self.pipe.lrange.assert_any_call("history:a", 0, -1)
+        self.assertTrue(0 < len(contexts["a"]) < 4)
+        self.assertTrue(contexts["a"][-1]["content"].startswith("第3个问题"))
+        self.assertEqual((contexts["b"], contexts["c"]), ([], []))
+
+
+class TestSessionPool(unittest.TestCase):
+    """预创建会话池测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.router = MagicMock()
+        self.router.backends = {"a": None, "b": None}
+        self.router.pick.return_value.name = "a"
+        self.router.is_available.side_effect = lambda name: name == "a"
+        self.router.create_session.side_effect = ["sid-1", "sid-2"]
+        self.redis_mock = MagicMock()
+        self.pool = SessionPool(self.router, self.redis_mock, size=3)
+        metrics.reset()
+
+    def test_refill_available_backends(self):
+        """测试只为可用后端补足会话"""
+        self.redis_mock.llen.return_value = 1
+
+        self.assertEqual(self.pool.refill(), 2)
+        self.redis_mock.rpush.assert_any_call("ragflow_session_pool:a", "sid-1")
+        self.redis_mock.rpush.assert_any_call("ragflow_session_pool:a", "sid-2")
+        self.router.create_session.assert_called_with(None, "预创建会话", backend="a")
+        self.redis_mock.expire.assert_called_once_with("ragflow_session_pool:a", 3600)
+
+    def test_take(self):
+        """测试从选出的后端的池中取会话，池为空时返回 None"""
+        self.redis_mock.lpop.side_effect = ["sid-1", None]
+
+        self.assertEqual(self.pool.take(), ("a", "sid-1"))
+        self.redis_mock.lpop.assert_called_with("ragflow_session_pool:a")
+        self.assertIsNone(self.pool.take())
+        self.assertEqual((metrics.get("session_pool_hit"), metrics.get("session_pool_miss")), (1, 1))
+
+    def test_skip_when_redis_down(self):
+        """测试 Redis 不可用时不取不补，连接错误使 Redis 进入降级模式"""
+        health = RedisHealth(self.redis_mock, retry_interval=60)
+        pool = SessionPool(self.router, self.redis_mock, size=3, redis_health=health)
+        self.redis_mock.lpop.side_effect = redis.ConnectionError("connection refused")
+
+        self.assertIsNone(pool.take())
+        self.assertTrue(health.degraded)
+        self.assertIsNone(pool.take())
+        self.assertEqual(pool.refill(), 0)
+        self.redis_mock.lpop.assert_called_once()
+        self.redis_mock.llen.assert_not_called()
+        self.router.create_session.assert_not_called()
+
+
+class TestBatchService(unittest.TestCase):
+    """批量问答测试类"""
+
+    def test_run_batch_bounded_concurrency(self):
+        """测试并发数受限，结果按完成顺序返回"""
+        lock = threading.Lock()
+        state = {"in_flight": 0, "peak": 0}
+
+        def ask(item):
+            with lock:
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            # 问题编号越小耗时越长
+            time.sleep(0.01 * (10 - item["id"]))
+            with lock:
+                state["in_flight"] -= 1
+            return {"content": f"答案{item['id']}", "error": False}
+
+        items = [{"id": i, "question": f"问题{i}"} for i in range(10)]
+        results = list(run_batch(ask, iter(items), concurrency=3))
+
+        self.assertEqual(len(results), 10)
+        self.assertLessEqual(state["peak"], 3)
+        self.assertEqual(sorted(r["id"] for r in results), list(range(10)))
+        self.assertNotEqual([r["id"] for r in results], list(range(10)))
+        self.assertTrue(all(r["latency_ms"] >= 0 for r in results))
+
+    def test_invalid_lines(self):
+        """测试无法解析或缺少问题的行作为错误项返回"""
+        ask = MagicMock(return_value={"content": "答案", "error": False})
+        items = parse_jsonl(['{"id": "a", "question": "你好"}', '', 'not json', '{"id": "b"}',
+                             '{"id": "c", "question": 123}'])
+        results = {r["id"]: r for r in run_batch(ask, items, concurrency=2)}
+
+        self.assertFalse(results["a"]["error"])
+        self.assertTrue(results["line-3"]["error"])
+        self.assertTrue(results["b"]["error"])
+        self.assertEqual(results["c"]["answer"], "question 必须为字符串")
+        ask.assert_called_once()
+
+    def test_non_object_lines(self):
+        """测试数字、数组等不是对象的行作为错误项返回，不中断整个批次"""
+        ask = MagicMock(return_value={"content": "答案", "error": False})
+        items = parse_jsonl(['123', '[1]', 'null', '{"id": "a", "question": "你好"}'])
+        results = {r["id"]: r for r in run_batch(ask, items, concurrency=2)}
+
+        self.assertEqual(set(results), {"line-1", "line-2", "line-3", "a"})
+        self.assertTrue(all(results[f"line-{i}"]["error"] for i in (1, 2, 3)))
+        self.assertFalse(results["a"]["error"])
+
+        results = list(run_batch(ask, [123, {"question": "你好"}], concurrency=1))
+        self.assertEqual([r["error"] for r in sorted(results, key=lambda r: r["index"])], [True, False])
+
+
+class TestAdmissionController(unittest.TestCase):
+    """准入控制测试类"""
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_shed_when_queue_full(self):
+        """测试在途和队列都满时立即拒绝"""
+        controller = AdmissionController(max_in_flight=1, max_queue=0, max_wait=1.0, name="test_admission")
+        self.assertTrue(controller.try_acquire())
+
+        start = time.monotonic()
+        self.assertFalse(controller.try_acquire())
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(metrics.get("test_admission_shed_queue_full"), 1)
+
+        controller.release(0.1)
+        self.assertTrue(controller.try_acquire())
+
+    def test_shed_by_wait_estimate(self):
+        """测试根据最近耗时估算的等待时间超过上限时拒绝"""
+        controller = AdmissionController(max_in_flight=1, max_queue=10, max_wait=1.0, name="test_admission")
+        controller.try_acquire()
+        controller.release(2.0)  # 最近平均处理耗时 2 秒
+
+        controller.try_acquire()
+        self.assertFalse(controller.try_acquire())
+        self.assertEqual(metrics.get("test_admission_shed_wait_estimate"), 1)
+
+    def test_queued_request_admitted_after_release(self):
+        """测试排队的请求在名额释放后被接纳"""
+        controller = AdmissionController(max_in_flight=1, max_queue=1, max_wait=2.0, name="test_admission")
+        controller.try_acquire()
+
+        threading.Timer(0.1, controller.release, args=(0.1,)).start()
+        with controller.admit() as admitted:
+            self.assertTrue(admitted)
+            self.assertEqual(controller.stats()["in_flight"], 1)
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+
+class TestPriorityScheduler(unittest.TestCase):
+    """优先级调度测试类"""
+
+    class Item:
+        def __init__(self, name, enqueued_at=None):
+            self.name = name
+            self.enqueued_at = time.monotonic() if enqueued_at is None else enqueued_at
+
+    def test_classify_message(self):
+        """测试优先级类别划分"""
+        self.assertEqual(classify_message(False, "wxid_vip", "你好", {"wxid_vip"}), "vip")
+        self.assertEqual(classify_message(True, "wxid_vip", "你好", {"wxid_vip"}), "vip")
+        self.assertEqual(classify_message(False, "wxid_a", "#帮助"), "command")
+        self.assertEqual(classify_message(False, "wxid_a", "你好"), "private")
+        self.assertEqual(classify_message(True, "wxid_a", "你好"), "group")
+        self.assertEqual(parse_priority_weights("group:2, vip:10")["group"], 2.0)
+
+    def test_invalid_weights_rejected(self):
+        """测试 0、负数、非有限或非数字的权重在解析时报错，而不是在 pop() 中除以 0"""
+        for spec in ("group:0", "vip:-1", "private:nan", "group:inf", "group:abc"):
+            with self.assertRaises(ValueError, msg=spec):
+                parse_priority_weights(spec)
+        with self.assertRaises(ValueError):
+            PriorityScheduler(weights={"private": 4, "group": 0})
+
+    def test_weighted_fair_queuing(self):
+        """测试按权重分配名额"""
+        scheduler = PriorityScheduler(weights={"private": 4, "group": 1}, starvation_age=60)
+        for i in range(20):
+            scheduler.push(self.Item(f"g{i}"), "group")
+            scheduler.push(self.Item(f"p{i}"), "private")
+
+        first = [scheduler.pop().name for _ in range(10)]
+        self.assertEqual(sum(name.startswith("p") for name in first), 8)
+        self.assertEqual(sum(name.startswith("g") for name in first), 2)
+        self.assertEqual(len(scheduler), 30)
+
+    def test_starvation_protection(self):
+        """测试等待过久的低优先级消息优先处理"""
+        scheduler = PriorityScheduler(weights={"private": 100, "group": 1}, starvation_age=1.0)
+        scheduler.push(self.Item("old-group", time.monotonic() - 5), "group")
+        scheduler.push(self.Item("new-private"), "private")
+
+        self.assertEqual(scheduler.pop().name, "old-group")
+        self.assertEqual(scheduler.pop().name, "new-private")
+        self.assertIsNone(scheduler.pop())
+
+    def test_admission_grants_by_priority(self):
+        """测试名额释放时优先转交给高优先级的排队请求"""
+        controller = AdmissionController(max_in_flight=1, max_queue=10, max_wait=2.0, name="test_priority")
+        controller.try_acquire()
+        order = []
+
+        def worker(priority):
+            with controller.admit(priority) as admitted:
+                if admitted:
+                    order.append(priority)
+
+        threads = [threading.Thread(target=worker, args=("group",))]
+        threads[0].start()
+        time.sleep(0.05)
+        threads.append(threading.Thread(target=worker, args=("vip",)))
+        threads[1].start()
+        time.sleep(0.05)
+
+        controller.release(0.01)
+        for t in threads:
+            t.join()
+        self.assertEqual(order, ["vip", "group"])
+
+
+class TestStreamWorker(unittest.TestCase):
+    """Redis Stream worker 测试类"""
+
+    def setUp(self):
+        self.chat_service = MagicMock()
+        self.chat_service.fallback_reply = "转人工"
+        self.chat_service.process_wechat_message.return_value = {"content": "回答", "error": False}
+        self.wechat_service = MagicMock()
+        self.stream = MagicMock()
+        self.worker = StreamWorker(self.chat_service, self.wechat_service, self.stream, "test",
+                                   concurrency=1, max_deliveries=3)
+        self.entry = ("1-0", {"question": "你好", "from_wxid": "room@chatroom", "final_from_wxid": "wxid_a",
+                              "is_group": "1", "bot_wxid": "wxid_bot"})
+
+    def test_process_new_entry(self):
+        """测试读取新消息，处理、回复并确认"""
+        self.stream.claim_stale.return_value = []
+        self.stream.read.return_value = [self.entry]
+
+        self.assertEqual(self.worker.run_once("test-0"), 1)
+
+        self.chat_service.process_wechat_message.assert_called_once_with(
+            question="你好", from_wxid="room@chatroom", final_from_wxid="wxid_a", is_group=True,
+            context={"is_group": True, "bot_wxid": "wxid_bot"}, deadline=None
+        )
+        self.wechat_service.send_reply.assert_called_once_with("room@chatroom", "wxid_a", True, "回答",
+                                                               deadline=None)
+        self.stream.ack.assert_called_once_with("1-0")
+
+    def test_entry_expired_in_queue(self):
+        """测试在队列中等待超过处理时限的消息不再调用 RagFlow，回复兜底后确认"""
+        self.worker.message_deadline = 30
+        fields = dict(self.entry[1], received_at=f"{time.time() - 60:.3f}")
+        self.stream.claim_stale.return_value = []
+        self.stream.read.return_value = [("1-0", fields)]
+
+        self.worker.run_once("test-0")
+
+        self.chat_service.process_wechat_message.assert_not_called()
+        self.wechat_service.send_reply.assert_called_once_with("room@chatroom", "wxid_a", True, "转人工")
+        self.stream.ack.assert_called_once_with("1-0")
+        self.chat_service.archive_wechat_reply.assert_called_once_with("你好", "转人工", "room@chatroom", "wxid_a",
+                                                                       True, error=True)
+
+    def test_claimed_entry_restarts_deadline(self):
+        """测试接管的消息从接管时重新计时，崩溃恢复后仍然调用 RagFlow 回复回答"""
+        self.worker.message_deadline = 30
+        fields = dict(self.entry[1], received_at=f"{time.time() - 150:.3f}")
+        self.stream.claim_stale.return_value = [("1-0", fields)]
+        self.stream.delivery_count.return_value = 2
+
+        self.worker.run_once("test-0")
+
+        deadline = self.chat_service.process_wechat_message.call_args.kwargs["deadline"]
+        self.assertGreater(deadline.remaining(), 29)
+        self.assertEqual(self.wechat_service.send_reply.call_args_list[0].args[3], "回答")
+        self.stream.ack.assert_called_once_with("1-0")
+
+    def test_failed_entry_not_acked(self):
+        """测试处理失败的消息不确认，等待重新投递"""
+        self.stream.claim_stale.return_value = []
+        self.stream.read.return_value = [self.entry]
+        self.chat_service.process_wechat_message.side_effect = RuntimeError("boom")
+
+        self.worker.run_once("test-0")
+        self.stream.ack.assert_not_called()
+
+    def test_claimed_entry_gives_up_after_max_deliveries(self):
+        """测试接管的消息超过最大投递次数时回复兜底并确认"""
+        self.stream.claim_stale.return_value = [self.entry]
+        self.stream.delivery_count.return_value = 4
+
+        self.worker.run_once("test-0")
+
+        self.stream.read.assert_not_called()
+        self.chat_service.process_wechat_message.assert_not_called()
+        self.wechat_service.send_reply.assert_called_once_with("room@chatroom", "wxid_a", True, "转人工")
+        self.stream.ack.assert_called_once_with("1-0")
+
+
+class TestArchiveSink(unittest.TestCase):
+    """对话归档测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        metrics.reset()
+
+    def record(self, i):
+        return {"ts": time.time(), "session_key": f"wx_session:private:wxid_{i}", "ragflow_session_id": "sid",
+                "question": f"问题{i}", "answer": f"回答{i}", "error": 0, "latency_ms": 12.5}
+
+    def test_sqlite_flush_on_close(self):
+        """测试记录按批写入 SQLite，关闭时写完缓冲区"""
+        path = os.path.join(self.tmpdir.name, "archive.db")
+        sink = ArchiveSink(SQLiteArchiveWriter(path), batch_size=100, flush_interval=60).start()
+        for i in range(250):
+            self.assertTrue(sink.submit(self.record(i)))
+        sink.close()
+
+        conn = sqlite3.connect(path)
+        self.addCleanup(conn.close)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 250)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("SELECT question FROM messages ORDER BY id DESC").fetchone()[0], "问题249")
+        self.assertFalse(sink.submit(self.record(250)))
+
+    def test_jsonl_rotation(self):
+        """测试 JSONL 文件超过大小后轮转，文件名包含进程号"""
+        sink = ArchiveSink(JSONLArchiveWriter(self.tmpdir.name, max_bytes=1000), batch_size=5,
+                           flush_interval=60).start()
+        for i in range(40):
+            sink.submit(self.record(i))
+        sink.close()
+
+        files = sorted(os.listdir(self.tmpdir.name))
+        self.assertGreater(len(files), 1)
+        self.assertTrue(all(f"-{os.getpid()}-" in name for name in files))
+        lines = []
+        for name in files:
+            with open(os.path.join(self.tmpdir.name, name), "rb") as f:
+                lines.extend(codec.loads(line) for line in f)
+        self.assertEqual(sorted(r["question"] for r in lines), sorted(f"问题{i}" for i in range(40)))
+
+    def test_drop_and_block_policy(self):
+        """测试缓冲区满时 drop 策略立即丢弃，block 策略等待写入腾出空间"""
+        release = threading.Event()
+        writer = MagicMock()
+        writer.write_batch.side_effect = lambda batch: release.wait(5)
+
+        sink = ArchiveSink(writer, capacity=2, policy=POLICY_DROP, batch_size=1, flush_interval=0.01).start()
+        self.addCleanup(sink.close)
+        results = [sink.submit(self.record(i)) for i in range(6)]
+        self.assertIn(False, results)
+        self.assertGreaterEqual(metrics.get("archive_dropped"), 1)
+
+        sink.policy = POLICY_BLOCK
+        sink.block_timeout = 5
+        timer = threading.Timer(0.1, release.set)
+        timer.start()
+        self.assertTrue(sink.submit(self.record(99)))
+        timer.join()
+
+    def test_retry_with_backoff(self):
+        """测试写入失败后重新打开写入器并重试同一批记录，重试次数用完后才丢弃"""
+        writer = MagicMock()
+        writer.write_batch.side_effect = [OSError("disk full"), sqlite3.OperationalError("database is locked"), None]
+        sink = ArchiveSink(writer, batch_size=10, max_retries=2, retry_backoff=0.01)
+        batch = [self.record(i) for i in range(3)]
+
+        sink._write(batch)
+        self.assertEqual(writer.write_batch.call_count, 3)
+        self.assertTrue(all(c.args[0] is batch for c in writer.write_batch.call_args_list))
+        self.assertEqual(writer.close.call_count, 2)
+        self.assertEqual((metrics.get("archive_written"), metrics.get("archive_retried")), (3, 2))
+
+        writer.write_batch.side_effect = OSError("disk full")
+        sink._write(batch)
+        self.assertEqual(metrics.get("archive_failed"), 3)
+
+    def test_sqlite_waits_for_lock(self):
+        """测试数据库被其他连接锁定时等待锁释放，而不是立即失败"""
+        path = os.path.join(self.tmpdir.name, "archive.db")
+        writer = SQLiteArchiveWriter(path, busy_timeout=5)
+        self.addCleanup(writer.close)
+        writer.write_batch([self.record(0)])
+        other = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.addCleanup(other.close)
+        other.execute("BEGIN IMMEDIATE")
+        timer = threading.Timer(0.2, lambda: other.execute("COMMIT"))
+        timer.start()
+
+        writer.write_batch([self.record(1)])
+        timer.join()
+        self.assertEqual(other.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 2)
+
+
+class TestDeadlineReplier(unittest.TestCase):
+    """带时限回复测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.replier = DeadlineReplier(interim_after=0.05, hard_deadline=0.2, interim_reply="请稍候",
+                                       fallback_reply="转人工")
+        self.sent = []
+        metrics.reset()
+
+    def answer_after(self, seconds):
+        def compute():
+            time.sleep(seconds)
+            return {"content": "回答", "error": False}
+        return compute
+
+    def test_direct(self):
+        """测试时限内完成的回答直接发送"""
+        result = self.replier.run(self.answer_after(0), self.sent.append)
+
+        self.assertEqual(result["reply_path"], "direct")
+        self.assertEqual(self.sent, ["回答"])
+        time.sleep(0.3)
+        self.assertEqual(self.sent, ["回答"])
+        self.assertEqual(metrics.get("reply_direct"), 1)
+
+    def test_interim_then_answer(self):
+        """测试超过提示时限先发送提示，回答完成后再发送回答"""
+        result = self.replier.run(self.answer_after(0.12), self.sent.append)
+
+        self.assertEqual(result["reply_path"], "late")
+        self.assertEqual(self.sent, ["请稍候", "回答"])
+        self.assertEqual((metrics.get("reply_interim"), metrics.get("reply_late")), (1, 1))
+
+    def test_fallback_discards_late_answer(self):
+        """测试超过硬时限回复兜底内容，之后完成的回答被丢弃"""
+        result = self.replier.run(self.answer_after(0.35), self.sent.append)
+
+        self.assertEqual(result["reply_path"], "discarded")
+        self.assertEqual(self.sent, ["请稍候", "转人工"])
+        self.assertEqual((metrics.get("reply_fallback"), metrics.get("reply_discarded")), (1, 1))
+
+    def test_message_deadline_caps_fallback(self):
+        """测试消息时限早于硬时限时按消息时限回复兜底，兜底通过 notify 发送"""
+        notified = []
+        replier = DeadlineReplier(interim_after=0, hard_deadline=10, fallback_reply="转人工")
+
+        result = replier.run(self.answer_after(0.2), self.sent.append, deadline=Deadline(0.05),
+                             notify=notified.append)
+
+        self.assertEqual(result["reply_path"], "discarded")
+        self.assertEqual((self.sent, notified), ([], ["转人工"]))
+
+    def test_slow_notify_does_not_delay_other_messages(self):
+        """测试某条消息的提示发送变慢时，其他消息的提示仍按时发出"""
+        started = threading.Event()
+        notified = []
+
+        def slow_notify(content):
+            started.set()
+            time.sleep(0.5)
+
+        slow = threading.Thread(target=self.replier.run,
+                                args=(self.answer_after(0.6), self.sent.append), kwargs={"notify": slow_notify})
+        slow.start()
+        self.assertTrue(started.wait(1))
+
+        start = time.monotonic()
+        self.replier.run(self.answer_after(0.1), self.sent.append, notify=lambda c: notified.append(
+            (c, time.monotonic() - start)))
+        slow.join()
+
+        self.assertEqual(notified[0][0], "请稍候")
+        self.assertLess(notified[0][1], 0.1)
+
+    def test_interim_not_sent_not_counted_late(self):
+        """测试提示到期但还没来得及发出时回答已完成，不再发送提示，也不计为 late"""
+        replier = DeadlineReplier(interim_after=0.02, hard_deadline=0, interim_reply="请稍候", notify_workers=1)
+        started = threading.Event()
+
+        def slow_notify(content):
+            started.set()
+            time.sleep(0.3)
+
+        # 占住唯一的发送线程，使下一条消息的提示排队等待
+        slow = threading.Thread(target=replier.run, args=(self.answer_after(0.4), self.sent.append),
+                                kwargs={"notify": slow_notify})
+        slow.start()
+        self.assertTrue(started.wait(1))
+
+        result = replier.run(self.answer_after(0.1), self.sent.append)
+        slow.join()
+        time.sleep(0.05)
+
+        self.assertEqual(result["reply_path"], "direct")
+        self.assertEqual(self.sent, ["回答", "回答"])
+        self.assertEqual((metrics.get("reply_interim"), metrics.get("reply_late")), (1, 1))
+
+    def test_failed_interim_not_counted_late(self):
+        """测试提示发送失败时回答按 direct 计数"""
+        def failing_notify(content):
+            raise RuntimeError("send failed")
+
+        result = self.replier.run(self.answer_after(0.12), self.sent.append, notify=failing_notify)
+
+        self.assertEqual(result["reply_path"], "direct")
+        self.assertEqual(self.sent, ["回答"])
+        self.assertEqual((metrics.get("reply_interim"), metrics.get("reply_late")), (0, 0))
+
+    def test_self_message_not_sent(self):
+        """测试机器人自身消息不回复"""
+        self.replier.run(lambda: {"content": "", "ignore_self_message": True}, self.sent.append)
+        self.assertEqual(self.sent, [])
+
+
+class TestFAQ(unittest.TestCase):
+    """FAQ 快速回复测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.index = FAQIndex([
+            FAQRule("greeting", "您好", exact=["你好", "在吗"]),
+            FAQRule("human", "转接中", exact=["人工"], keywords=["转人工", "人工客服"], max_length=20),
+            FAQRule("hours", "9:00-21:00", keywords=["工作时间", "人工客服"]),
+        ])
+        metrics.reset()
+
+    def test_exact_and_keyword(self):
+        """测试整句匹配忽略大小写与标点，关键词匹配受长度限制"""
+        self.assertEqual(self.index.match("你好！").name, "greeting")
+        self.assertEqual(self.index.match(" 在吗？？").name, "greeting")
+        self.assertIsNone(self.index.match("你好，请问怎么退货"))
+        self.assertEqual(self.index.match("人工").name, "human")
+        self.assertEqual(self.index.match("麻烦帮我转人工").name, "human")
+        self.assertIsNone(self.index.match("请问人工智能和机器学习有什么区别"))
+        self.assertIsNone(self.index.match("我已经说了很多遍了，你们这个产品质量太差，我要转人工处理退款"))
+        self.assertEqual(self.index.match("你们的工作时间是几点").name, "hours")
+
+    def test_rule_priority(self):
+        """测试多条规则命中时按文件顺序，超过长度限制时由后面的规则命中"""
+        self.assertEqual(self.index.match("人工客服").name, "human")
+        self.assertEqual(self.index.match("我想问一下人工客服是不是二十四小时都有人在线").name, "hours")
+
+    def test_hot_reload_and_hit_counters(self):
+        """测试规则文件修改后重新加载，加载失败时保留旧规则，并按规则计数"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "faq.json")
+            with open(path, "wb") as f:
+                f.write(codec.dumps([{"name": "greeting", "reply": "您好", "exact": ["你好"]}]))
+            matcher = FAQMatcher(path, reload_interval=0)
+            self.assertEqual(matcher.match("你好").reply, "您好")
+
+            with open(path, "wb") as f:
+                f.write(codec.dumps([{"name": "greeting", "reply": "您好呀", "exact": ["你好", "hi"]}]))
+            os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+            self.assertEqual(matcher.match("HI").reply, "您好呀")
+
+            with open(path, "wb") as f:
+                f.write(b"[{bad json")
+            os.utime(path, ns=(time.time_ns(), time.time_ns() + 2 * 10 ** 9))
+            self.assertEqual(matcher.match("你好").reply, "您好呀")
+
+        self.assertEqual(metrics.get("faq_hit_greeting"), 3)
+        self.assertEqual(metrics.get("faq_reload_failed"), 1)
+
+
+def _profiled_busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestProfiler(unittest.TestCase):
+    """采样分析与内存分配跟踪测试"""
+
+    def test_sampling_collapsed_stacks(self):
+        """测试采样结果包含其他线程的调用栈，并且同时只允许一次采样"""
+        stop = threading.Event()
+        worker = threading.Thread(target=_profiled_busy_loop, args=(stop,), name="busy-worker")
+        worker.start()
+        profiler = SamplingProfiler()
+        try:
+            result = profiler.sample(0.1, interval=0.005)
+            profiler._lock.acquire()
+            with self.assertRaises(ProfilerBusy):
+                profiler.sample(0.1)
+            profiler._lock.release()
+        finally:
+            stop.set()
+            worker.join()
+
+        self.assertGreater(result["samples"], 1)
+        busy = [stack for stack in result["stacks"] if stack.startswith("busy-worker;")]
+        self.assertTrue(busy)
+        self.assertIn("_profiled_busy_loop (test_services.py:", busy[0])
+        lines = SamplingProfiler.collapse(result["stacks"]).splitlines()
+        self.assertEqual(len(lines), len(result["stacks"]))
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+
+    def test_tracemalloc_snapshot_diff(self):
+        """测试快照统计与相邻两次快照的差异，停止后不再允许快照"""
+        tracker = AllocationTracker()
+        self.assertTrue(tracker.start())
+        try:
+            self.assertFalse(tracker.start())
+            first = tracker.snapshot(top=5)
+            self.assertIsNone(first["diff"])
+            retained = [bytearray(1024) for _ in range(1000)]
+            second = tracker.snapshot(top=5)
+            self.assertGreaterEqual(second["diff"][0]["size_diff"], 1024 * 1000)
+            self.assertIn("test_services.py", second["diff"][0]["traceback"][0])
+            del retained
+        finally:
+            self.assertTrue(tracker.stop())
+        with self.assertRaises(RuntimeError):
+            tracker.snapshot()
+
+
+class TestSessionStore(unittest.TestCase):
+    """会话记录存储与 Redis 故障降级测试"""
+
+    def setUp(self):
+        metrics.reset()
+
+    def _check_store(self, store):
+        record = SessionRecord("ragflow-session-1", backend="a", created_at=1.0, last_active=1.0)
+        store.save("wx_session:private:u1", record)
+        store.save("wx_session:private:u2", SessionRecord("ragflow-session-2"))
+        store.save("chat_session:web-1", SessionRecord("ragflow-session-3"))
+        self.assertEqual(store.load("wx_session:private:u1"), record)
+        self.assertIsNone(store.load("wx_session:private:missing"))
+
+        store.record_turn("wx_session:private:u1", 30, 0.25, {"carry_over": ""})
+        store.record_turn("wx_session:private:u1", 20, 0.5)
+        loaded = store.load("wx_session:private:u1")
+        self.assertEqual((loaded.turns, loaded.tokens, loaded.last_latency_ms, loaded.backend), (2, 50, 500.0, "a"))
+        self.assertGreater(loaded.last_active, 1.0)
+
+        self.assertTrue(store.delete("wx_session:private:u1"))
+        self.assertFalse(store.delete("wx_session:private:u1"))
+        self.assertEqual(store.delete_prefix("wx_session:"), 1)
+        self.assertIsNotNone(store.load("chat_session:web-1"))
+        self.assertIsNone(store.pipeline())
+
+    def test_memory_store(self):
+        """测试基于 SessionManager 的进程内存储，读取返回副本，过期后不再返回"""
+        store = MemorySessionStore(ttl=3600)
+        self._check_store(store)
+
+        loaded = store.load("chat_session:web-1")
+        loaded.turns = 99
+        self.assertEqual(store.load("chat_session:web-1").turns, 0)
+        store.manager.expiry_seconds = -1
+        self.assertIsNone(store.load("chat_session:web-1"))
+
+    def test_sqlite_store(self):
+        """测试 SQLite 存储，过期记录不再返回"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = SQLiteSessionStore(os.path.join(directory, "sessions.db"), ttl=3600)
+            self._check_store(store)
+            store.ttl = -1
+            store.save("chat_session:web-2", SessionRecord("ragflow-session-4"))
+            self.assertIsNone(store.load("chat_session:web-2"))
+            self.assertEqual(store.purge_expired(), 1)
+            store.close()
+
+    def test_failover_and_reconcile(self):
+        """测试 Redis 故障时降级到进程内存储，恢复后写回降级期间的记录与清除操作"""
+        redis_client = MagicMock()
+        redis_client.hget.return_value = None
+        health = RedisHealth(redis_client, retry_interval=0)
+        primary = MagicMock(spec=RedisSessionStore)
+        primary.ttl = 3600
+        primary.redis_client = redis_client
+        primary.load.side_effect = redis.ConnectionError("connection refused")
+        redis_client.ping.side_effect = redis.ConnectionError("connection refused")
+        store = FailoverSessionStore(primary, health)
+
+        self.assertIsNone(store.load("wx_session:private:u1"))
+        self.assertTrue(health.degraded)
+        store.save("wx_session:private:u1", SessionRecord("ragflow-session-1", last_active=time.time()))
+        store.record_turn("wx_session:private:u1", 10, 0.1)
+        self.assertEqual(store.load("wx_session:private:u1").turns, 1)
+        self.assertFalse(store.delete("wx_session:private:u2"))
+        self.assertIsNone(store.pipeline())
+        primary.save.assert_not_called()
+
+        redis_client.ping.side_effect = None
+        self.assertIsNotNone(store.pipeline())
+
+        self.assertFalse(health.degraded)
+        primary.delete.assert_called_once_with("wx_session:private:u2")
+        key, record = primary.save.call_args.args
+        self.assertEqual((key, record.session_id, record.turns), ("wx_session:private:u1", "ragflow-session-1", 1))
+        self.assertEqual(store.fallback.items(), [])
+        self.assertEqual(metrics.get("redis_failover"), 1)
+        self.assertEqual(metrics.get("redis_recovered"), 1)
+        self.assertEqual(metrics.get("session_store_reconciled"), 1)
+
+    def test_reconcile_skips_wrongtype_key(self):
+        """测试写回时遇到旧版本留下的字符串键只跳过该键，Redis 仍正常恢复，清除操作不丢失"""
+        redis_client = MagicMock()
+
+        def hget(key, field):
+            if key == "wx_session:private:legacy":
+                raise redis.ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+            return None
+        redis_client.hget.side_effect = hget
+        health = RedisHealth(redis_client, retry_interval=0)
+        primary = MagicMock(spec=RedisSessionStore)
+        primary.ttl = 3600
+        primary.redis_client = redis_client
+        store = FailoverSessionStore(primary, health)
+        health.mark_down(redis.TimeoutError("timeout"))
+        redis_client.ping.side_effect = redis.TimeoutError("timeout")
+        store.save("wx_session:private:legacy", SessionRecord("ragflow-session-1", last_active=time.time()))
+        store.save("wx_session:private:u1", SessionRecord("ragflow-session-2", last_active=time.time()))
+        store.delete("wx_session:private:u2")
+
+        redis_client.ping.side_effect = None
+        self.assertTrue(health.available())
+
+        self.assertFalse(health.degraded)
+        primary.delete.assert_called_once_with("wx_session:private:u2")
+        self.assertEqual([c.args[0] for c in primary.save.call_args_list], ["wx_session:private:u1"])
+        self.assertEqual(metrics.get("session_store_reconcile_skipped"), 1)
+
+    def test_recover_callback_error_keeps_degraded(self):
+        """测试恢复回调出现意外错误时不抛出，保持降级并推迟下一次探测，未执行的清除操作保留"""
+        redis_client = MagicMock()
+        health = RedisHealth(redis_client, retry_interval=60)
+        primary = MagicMock(spec=RedisSessionStore)
+        primary.ttl = 3600
+        primary.redis_client = redis_client
+        store = FailoverSessionStore(primary, health)
+        health.mark_down(redis.TimeoutError("timeout"))
+        store.delete("wx_session:private:u1")
+        store.delete("wx_session:private:u2")
+        primary.delete.side_effect = [None, redis.TimeoutError("timeout")]
+        health._next_probe = 0
+
+        self.assertFalse(health.available())
+        self.assertTrue(health.degraded)
+        self.assertGreater(health._next_probe, time.monotonic())
+        self.assertEqual(store._deleted, [(False, "wx_session:private:u2")])
+
+        health.on_recover(MagicMock(side_effect=RuntimeError("bug")))
+        primary.delete.side_effect = None
+        health._next_probe = 0
+        self.assertFalse(health.available())
+        self.assertGreater(health._next_probe, time.monotonic())
+
+    def test_reconcile_keeps_newer_redis_record(self):
+        """测试 Redis 中的记录比降级期间的更新时不覆盖"""
+        redis_client = MagicMock()
+        redis_client.hget.return_value = str(time.time() + 60)
+        health = RedisHealth(redis_client, retry_interval=0)
+        primary = MagicMock(spec=RedisSessionStore)
+        primary.ttl = 3600
+        primary.redis_client = redis_client
+        store = FailoverSessionStore(primary, health)
+        health.mark_down(redis.TimeoutError("timeout"))
+        redis_client.ping.side_effect = redis.TimeoutError("timeout")
+        store.save("wx_session:private:u1", SessionRecord("ragflow-session-1", last_active=time.time()))
+
+        redis_client.ping.side_effect = None
+        self.assertIsNotNone(store.pipeline())
+        primary.save.assert_not_called()
+        self.assertFalse(health.degraded)
+
+    def test_writes_during_reconcile_are_not_lost(self):
+        """测试写回期间到达的写入等待写回完成，之后直接写入 Redis，不留在进程内存储中"""
+        redis_client = MagicMock()
+        redis_client.hget.return_value = None
+        health = RedisHealth(redis_client, retry_interval=0)
+        primary = MagicMock(spec=RedisSessionStore)
+        primary.ttl = 3600
+        primary.redis_client = redis_client
+        store = FailoverSessionStore(primary, health)
+        health.mark_down(redis.TimeoutError("timeout"))
+        redis_client.ping.side_effect = redis.TimeoutError("timeout")
+        store.save("wx_session:private:u1", SessionRecord("ragflow-session-1", last_active=time.time()))
+        writer = threading.Thread(target=store.save,
+                                  args=("wx_session:private:u2", SessionRecord("ragflow-session-2")))
+
+        def save_during_reconcile(key, record):
+            if key == "wx_session:private:u1":
+                writer.start()
+                writer.join(0.1)
+                self.assertTrue(writer.is_alive())
+        primary.save.side_effect = save_during_reconcile
+
+        redis_client.ping.side_effect = None
+        self.assertIsNotNone(store.pipeline())
+        writer.join(1)
+
+        self.assertEqual([c.args[0] for c in primary.save.call_args_list],
+                         ["wx_session:private:u1", "wx_session:private:u2"])
+        self.assertEqual(store.fallback.items(), [])
+
+    @patch('services.chat_service.redis.StrictRedis')
+    def test_chat_service_starts_without_redis(self, mock_redis):
+        """测试启动时 Redis 不可用，会话记录保存在进程内，去重暂停，不再返回创建会话失败"""
+        client = mock_redis.return_value
+        client.ping.side_effect = redis.ConnectionError("connection refused")
+        chat_service = ChatService(
+            api_key="test-api-key", api_base="https://api.example.com", default_chat_id="test-chat-id",
+            session_expiry=3600, max_tokens=200, fallback_reply="转人工",
+            redis_config={'REDIS_HOST': '127.0.0.1', 'REDIS_PORT': 6379, 'REDIS_DB': 0, 'REDIS_PASSWORD': None,
+                          'RAGFLOW_SESSION_EXPIRY_REDIS': 3600, 'REDIS_RETRY_INTERVAL': 60}
+        )
+        chat_service.ragflow_client = MagicMock()
+        chat_service.ragflow_client.is_available.return_value = True
+        chat_service.ragflow_client.open_session.return_value = ("default", "ragflow-session-1")
+        chat_service.ragflow_client.send_message.return_value = {"content": "测试回复", "error": False}
+
+        self.assertFalse(chat_service.is_duplicate_message({"msgId": "10001"}))
+        for _ in range(2):
+            result = chat_service.process_wechat_message("你好", "wxid_user", "", False)
+            self.assertEqual(result["content"], "测试回复")
+        chat_service.ragflow_client.open_session.assert_called_once()
+        self.assertEqual(chat_service.session_records.load("wx_session:private:wxid_user").turns, 2)
+        client.set.assert_not_called()
+        client.pipeline.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()